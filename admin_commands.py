@@ -1,6 +1,8 @@
 from telegram import Update, ParseMode
 from telegram.ext import CallbackContext
 from user_tracking import get_total_users_count
+from result_cache import get_cache_stats
+from ocr_cache import get_ocr_cache_stats
 from config import ADMIN_ID
 
 def stats_command(update: Update, context: CallbackContext):
@@ -17,10 +19,16 @@ def stats_command(update: Update, context: CallbackContext):
     # إحصائيات المستخدمين
     total_users = get_total_users_count()
     
+    # إحصائيات ذاكرة النتائج المحفوظة
+    cache_stats = get_cache_stats()
+    ocr_stats = get_ocr_cache_stats()
+    
     stats_text = f"""
 📊 *إحصائيات البوت*
 
 👥 *إجمالي المستخدمين:* {total_users}
+💾 *النتائج المحفوظة:* {cache_stats['hits']} إصابة / {cache_stats['misses']} إخفاق
+🔍 *صفحات OCR المحفوظة:* {ocr_stats['entries']} صفحة، نسبة الإصابة {ocr_stats['hit_rate']:.0%}
     """
     
     update.message.reply_text(
@@ -48,35 +56,13 @@ def broadcast_command(update: Update, context: CallbackContext):
     # إعداد نص الرسالة الجماعية
     broadcast_text = ' '.join(context.args)
     
-    # إرسال رسالة للمدير بأن العملية بدأت
-    update.message.reply_text('تم بدء الإرسال الجماعي. سيتم إعلامك عند الانتهاء.')
-    
-    # الحصول على جميع المستخدمين
-    from user_tracking import get_all_users
-    users = get_all_users()
-    
-    # عداد المستخدمين الذين تم إرسال الرسالة لهم بنجاح وعدد الحالات الفاشلة
-    success_count = 0
-    failed_count = 0
+    # الإرسال يتم في الخلفية على دفعات مع حفظ التقدم، ويتم تحديث رسالة التقدم للمدير
+    from broadcast import get_broadcaster
+    broadcast_id = get_broadcaster().start(broadcast_text, update.effective_chat.id)
     
-    # إرسال الرسالة لكل مستخدم
-    for user in users:
-        try:
-            context.bot.send_message(chat_id=user.user_id, text=broadcast_text)
-            success_count += 1
-        except Exception as e:
-            print(f"Failed to send message to user {user.user_id}: {e}")
-            failed_count += 1
+    if broadcast_id is None:
+        update.message.reply_text('هناك إرسال جماعي قيد التنفيذ بالفعل. انتظر حتى ينتهي.')
+        return
     
-    # إرسال تقرير إلى المدير عن حالة الإرسال الجماعي
-    report = f"""
-📨 تم اكتمال الإرسال الجماعي
-
-✅ نجح: {success_count} مستخدم
-❌ فشل: {failed_count} مستخدم
-📝 إجمالي: {len(users)} مستخدم
-
-الرسالة:
-"{broadcast_text}"
-"""
-    update.message.reply_text(report)
\ No newline at end of file
+    # إرسال رسالة للمدير بأن العملية بدأت
+    update.message.reply_text('تم بدء الإرسال الجماعي. سيتم إعلامك بالتقدم وعند الانتهاء.')
@@ -1,8 +1,14 @@
 
 import os
+import re
+import hmac
+import time
+import fcntl
 import logging
+import threading
+from telegram import Update
 from telegram.ext import (
-    Updater, CommandHandler, MessageHandler, 
+    Updater, CommandHandler, MessageHandler, TypeHandler,
     Filters, ConversationHandler, CallbackQueryHandler
 )
 from handlers import (
@@ -15,20 +21,95 @@ from handlers import (
     watermark_command, background_command, resize_pages_command,
     page_orientation_command, crop_command, split_pages_command,
     sort_pages_command, add_toc_command, edit_metadata_command,
-    file_info_command, rename_command, auto_delete_command, add_pages_command,
+    file_info_command, rename_command, auto_delete_command, add_pages_command, pipeline_command,
     handle_document, handle_photo, handle_text, handle_done, cancel, button_callback
 )
 from admin_commands import stats_command, broadcast_command
-from config import BOT_TOKEN
+from task_queue import start_task_queue
+from user_tracking import start_activity_tracker, record_activity
+from broadcast import start_broadcaster
+from office_converter import start_office_converter
+from config import (
+    BOT_TOKEN, TELEGRAM_API_URL, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_LOCK_PATH,
+    WEBHOOK_STARTUP_ATTEMPTS, WEBHOOK_STARTUP_DELAY
+)
 
 logger = logging.getLogger(__name__)
 
-def create_bot():
-    """Create and configure the bot with all handlers."""
+# Open (and locked) for as long as this process serves the webhook
+_webhook_lock = None
+
+# Thread running the dispatcher in webhook mode
+_dispatcher_thread = None
+
+# Characters Telegram accepts in a webhook secret token
+_SECRET_TOKEN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+def _check_webhook_secret():
+    """Refuse webhook mode without a valid secret: anyone could otherwise post updates as any user (even the admin)."""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set in webhook mode")
+    if not _SECRET_TOKEN.fullmatch(WEBHOOK_SECRET):
+        raise RuntimeError("WEBHOOK_SECRET must be 1-256 characters from A-Z, a-z, 0-9, _ and -")
+
+def is_authentic_update(secret_header):
+    """
+    Whether a request on the webhook route comes from Telegram.
+    
+    Args:
+        secret_header: Value of the X-Telegram-Bot-Api-Secret-Token header (None if missing)
+    """
+    return hmac.compare_digest((secret_header or '').encode('utf-8'), WEBHOOK_SECRET.encode('utf-8'))
+
+def _lock_webhook_process():
+    """
+    Make sure this is the only process serving the webhook.
+
+    Conversation state (context.user_data) and the background workers live in
+    the process, so updates of one user handled by different worker processes
+    would lose multi-step flows like /merge or /pipeline.
+    """
+    global _webhook_lock
+    lock_file = open(WEBHOOK_LOCK_PATH, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(
+            "Another process is already serving the webhook; run webhook mode with a single "
+            "web worker process (e.g. gunicorn --workers 1 --threads 8 wsgi:app)"
+        )
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _webhook_lock = lock_file
+
+def _get_me_with_retry(bot):
+    """
+    Fetch the bot's own user from Telegram, retrying while it cannot be reached.
+
+    The dispatcher needs it (bot.id) when it starts; fetched here, a network
+    problem at boot delays the start instead of killing the dispatcher thread.
+    """
+    delay = WEBHOOK_STARTUP_DELAY
+    for attempt in range(1, WEBHOOK_STARTUP_ATTEMPTS + 1):
+        try:
+            return bot.get_me()
+        except Exception as e:
+            if attempt == WEBHOOK_STARTUP_ATTEMPTS:
+                raise
+            logger.warning(f"Could not reach Telegram (attempt {attempt}): {str(e)}; retrying in {delay}s")
+            time.sleep(delay)
+            delay *= 2
+
+def build_updater():
+    """Create the Updater, register all handlers and start the job queue workers."""
     # Create the Updater instance
-    updater = Updater(BOT_TOKEN)
+    updater = Updater(BOT_TOKEN, base_url=TELEGRAM_API_URL)
     dispatcher = updater.dispatcher
 
+    # Record user activity for every update; group -1 runs before the other handlers
+    dispatcher.add_handler(TypeHandler(Update, record_activity), group=-1)
+
     # Add command handlers
     dispatcher.add_handler(CommandHandler("start", start))
     dispatcher.add_handler(CommandHandler("help", help_command))
@@ -41,6 +122,7 @@ def create_bot():
     dispatcher.add_handler(CommandHandler("delete_pages", delete_pages_command))
     dispatcher.add_handler(CommandHandler("reorder", reorder_command))
     dispatcher.add_handler(CommandHandler("rotate", rotate_command))
+    dispatcher.add_handler(CommandHandler("pipeline", pipeline_command))
     
     # Conversion operations
     dispatcher.add_handler(CommandHandler("photo_to_pdf", photo_to_pdf_command))
@@ -92,6 +174,24 @@ def create_bot():
     dispatcher.add_handler(MessageHandler(Filters.document, handle_document))
     dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_text))
     
+    # Start the background workers that run heavy PDF jobs
+    start_task_queue(updater.bot)
+    
+    # Start saving buffered user activity in the background
+    start_activity_tracker(updater.bot)
+    
+    # Resume admin broadcasts interrupted by a restart
+    start_broadcaster(updater.bot)
+    
+    # Report whether office documents can be converted with warm LibreOffice instances
+    start_office_converter()
+    
+    return updater
+
+def create_bot():
+    """Create the bot and run it with long polling until interrupted."""
+    updater = build_updater()
+    
     # Start the Bot
     updater.start_polling()
     
@@ -99,3 +199,53 @@ def create_bot():
     updater.idle()
     
     return updater
+
+def create_webhook_bot():
+    """
+    Create the bot for webhook mode.
+    
+    No getUpdates loop is started: the web app passes the updates Telegram posts
+    to it to feed_update, and the dispatcher thread handles them. The webhook is
+    registered with Telegram when WEBHOOK_URL is set. WEBHOOK_SECRET must be set,
+    and only one process may serve the webhook; RuntimeError is raised otherwise.
+    
+    Returns:
+        The Updater whose dispatcher processes the updates
+    """
+    global _dispatcher_thread
+    _check_webhook_secret()
+    _lock_webhook_process()
+    updater = build_updater()
+    _get_me_with_retry(updater.bot)
+    
+    _dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='dispatcher', daemon=True)
+    _dispatcher_thread.start()
+    
+    if WEBHOOK_URL:
+        try:
+            updater.bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        except Exception as e:
+            # Another worker may have registered it already; updates still arrive on the route
+            logger.error(f"Error setting webhook: {str(e)}")
+    
+    return updater
+
+def feed_update(updater, data):
+    """
+    Queue an update received on the webhook route for the dispatcher.
+    
+    Args:
+        updater: Updater returned by create_webhook_bot
+        data: Decoded JSON body of the request
+    
+    Returns:
+        False if the dispatcher thread is not running and the update was not queued;
+        the route should then fail so that Telegram delivers the update again
+    """
+    if _dispatcher_thread is None or not _dispatcher_thread.is_alive():
+        logger.error("Dispatcher thread is not running; update not queued")
+        return False
+    update = Update.de_json(data, updater.bot)
+    if update is not None:
+        updater.update_queue.put(update)
+    return True
@@ -0,0 +1,332 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from telegram.error import Unauthorized, BadRequest
+from rate_limiter import get_send_rate_limiter
+from user_tracking import iter_user_id_batches, get_total_users_count
+from config import (
+    BROADCAST_DB_PATH, BROADCAST_BATCH_SIZE, BROADCAST_WORKERS, BROADCAST_PROGRESS_INTERVAL, BROADCAST_STALE_AFTER,
+    BROADCAST_MAX_ATTEMPTS
+)
+
+logger = logging.getLogger(__name__)
+
+class BroadcastStore:
+    """
+    SQLite table holding each broadcast's text, counters and checkpoint (last user primary key done).
+
+    Checkpoints are only written by the process that owns the broadcast, so a process
+    whose broadcast was taken over notices it at its next checkpoint.
+    """
+
+    def __init__(self, db_path=BROADCAST_DB_PATH):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS broadcasts ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'text TEXT NOT NULL, '
+            'admin_chat_id INTEGER NOT NULL, '
+            'progress_message_id INTEGER, '
+            "status TEXT NOT NULL DEFAULT 'running', "
+            'owner TEXT, '
+            'last_id INTEGER NOT NULL DEFAULT 0, '
+            'total INTEGER NOT NULL DEFAULT 0, '
+            'sent INTEGER NOT NULL DEFAULT 0, '
+            'failed INTEGER NOT NULL DEFAULT 0, '
+            'blocked INTEGER NOT NULL DEFAULT 0, '
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'retry_at REAL NOT NULL DEFAULT 0, '
+            'created_at REAL NOT NULL, '
+            'updated_at REAL NOT NULL)'
+        )
+        # Columns added after the table was first created
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(broadcasts)')}
+        for name, definition in (('attempts', 'INTEGER NOT NULL DEFAULT 0'), ('retry_at', 'REAL NOT NULL DEFAULT 0')):
+            if name not in columns:
+                self._db.execute(f'ALTER TABLE broadcasts ADD COLUMN {name} {definition}')
+
+    def create(self, text, admin_chat_id, total, owner):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO broadcasts (text, admin_chat_id, total, owner, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (text, admin_chat_id, total, owner, now, now)
+            )
+        return cursor.lastrowid
+
+    def claim(self, broadcast_id, owner, stale_after):
+        """
+        Take over a running broadcast whose owner has not saved a checkpoint for stale_after
+        seconds, once the delay before its next attempt (after a failure) has passed.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE broadcasts SET owner = ?, updated_at = ? WHERE id = ? AND status = 'running' "
+                "AND retry_at <= ? AND (owner IS NULL OR owner = ? OR updated_at < ?)",
+                (owner, now, broadcast_id, now, owner, now - stale_after)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, broadcast_id):
+        with self._lock:
+            self._db.row_factory = sqlite3.Row
+            try:
+                row = self._db.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+            finally:
+                self._db.row_factory = None
+        return dict(row) if row else None
+
+    def running_ids(self):
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall()
+        return [row[0] for row in rows]
+
+    def update(self, broadcast_id, owner, **fields):
+        """
+        Save fields of a broadcast owned by owner.
+
+        Returns:
+            False if the broadcast was taken over by another owner (nothing is saved)
+        """
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock:
+            cursor = self._db.execute(
+                f'UPDATE broadcasts SET {assignments} WHERE id = ? AND owner = ?',
+                (*fields.values(), broadcast_id, owner)
+            )
+        return cursor.rowcount == 1
+
+def _progress_text(state):
+    done = state['sent'] + state['failed'] + state['blocked']
+    total = max(state['total'], done)
+    percent = done * 100 // total if total else 100
+    return (
+        f"📨 جاري الإرسال الجماعي... {percent}%\n\n"
+        f"✅ نجح: {state['sent']}\n"
+        f"🚫 حظروا البوت: {state['blocked']}\n"
+        f"❌ فشل: {state['failed']}\n"
+        f"📝 تمت معالجة {done} من {total} مستخدم"
+    )
+
+def _report_text(state):
+    return f"""
+📨 تم اكتمال الإرسال الجماعي
+
+✅ نجح: {state['sent']} مستخدم
+🚫 حظروا البوت: {state['blocked']} مستخدم
+❌ فشل: {state['failed']} مستخدم
+📝 إجمالي: {state['sent'] + state['failed'] + state['blocked']} مستخدم
+
+الرسالة:
+"{state['text']}"
+"""
+
+class Broadcaster:
+    """
+    Sends admin broadcasts in the background.
+
+    Users are read from the database in keyset-paginated batches and each batch is
+    sent by a pool of threads through the shared rate limiter. After every batch the
+    counters and the last user primary key are saved, so a broadcast interrupted by
+    a restart resumes where it stopped (at most one batch may be sent twice).
+    A broadcast whose checkpoint is older than stale_after seconds is taken over
+    by whichever bot process notices it first; the previous owner stops at its next
+    checkpoint, so it runs in only one process. A failed broadcast is retried after
+    a delay that doubles with every failure, and given up after max_attempts.
+    The admin sees a progress message that is edited as the broadcast advances.
+    """
+
+    def __init__(self, bot, store=None, batch_size=BROADCAST_BATCH_SIZE, workers=BROADCAST_WORKERS,
+                 progress_interval=BROADCAST_PROGRESS_INTERVAL, stale_after=BROADCAST_STALE_AFTER,
+                 max_attempts=BROADCAST_MAX_ATTEMPTS):
+        self.bot = bot
+        self.store = store or BroadcastStore()
+        self.batch_size = batch_size
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.owner = uuid4().hex
+        self._lock = threading.Lock()
+        self._active = None
+        self._watchdog = None
+        # No resume before this time; also holds when the store could not record the retry delay
+        self._retry_at = 0
+
+    def is_running(self):
+        with self._lock:
+            return self._active is not None and self._active.is_alive()
+
+    def start(self, text, admin_chat_id):
+        """
+        Start a new broadcast.
+
+        Returns:
+            The broadcast id, or None if another broadcast is still running
+        """
+        with self._lock:
+            if self._active is not None and self._active.is_alive():
+                return None
+            broadcast_id = self.store.create(text, admin_chat_id, get_total_users_count(), self.owner)
+            self._spawn(broadcast_id)
+        return broadcast_id
+
+    def resume(self):
+        """Resume a broadcast that was interrupted (e.g. by a restart), if there is one and this process is idle."""
+        with self._lock:
+            if self._active is not None and self._active.is_alive():
+                return
+            if time.time() < self._retry_at:
+                return
+            for broadcast_id in self.store.running_ids():
+                if self.store.claim(broadcast_id, self.owner, self.stale_after):
+                    logger.info(f"Resuming broadcast {broadcast_id}")
+                    self._spawn(broadcast_id)
+                    return
+
+    def _watch(self):
+        while True:
+            try:
+                self.resume()
+            except Exception as e:
+                logger.error(f"Error resuming broadcasts: {str(e)}")
+            time.sleep(self.stale_after / 2)
+
+    def start_watchdog(self):
+        """Check periodically for interrupted broadcasts to resume."""
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name='broadcast-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def _spawn(self, broadcast_id):
+        self._active = threading.Thread(
+            target=self._run, args=(broadcast_id,), name=f"broadcast-{broadcast_id}", daemon=True
+        )
+        self._active.start()
+
+    def _send_one(self, chat_id, text):
+        """Send the broadcast text to one user. Returns 'sent', 'blocked' or 'failed'."""
+        try:
+            get_send_rate_limiter().call(self.bot.send_message, chat_id=chat_id, text=text)
+            return 'sent'
+        except Unauthorized:
+            return 'blocked'
+        except BadRequest as e:
+            # e.g. "Chat not found" for deleted accounts
+            logger.warning(f"Failed to send broadcast to user {chat_id}: {str(e)}")
+            return 'failed'
+        except Exception as e:
+            logger.warning(f"Failed to send broadcast to user {chat_id}: {str(e)}")
+            return 'failed'
+
+    def _show_progress(self, state):
+        try:
+            if state['progress_message_id']:
+                self.bot.edit_message_text(
+                    chat_id=state['admin_chat_id'], message_id=state['progress_message_id'],
+                    text=_progress_text(state)
+                )
+            else:
+                message = self.bot.send_message(chat_id=state['admin_chat_id'], text=_progress_text(state))
+                state['progress_message_id'] = message.message_id
+                self.store.update(state['id'], self.owner, progress_message_id=message.message_id)
+        except Exception as e:
+            # "Message is not modified" and similar errors must not stop the broadcast
+            logger.warning(f"Could not update broadcast progress: {str(e)}")
+
+    def _run(self, broadcast_id):
+        state = self.store.get(broadcast_id)
+        text = state['text']
+        last_progress = 0
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for batch in iter_user_id_batches(state['last_id'], self.batch_size):
+                    results = pool.map(lambda row: self._send_one(row[1], text), batch)
+                    for outcome in results:
+                        state[outcome] += 1
+                    state['last_id'] = batch[-1][0]
+                    state['attempts'] = 0
+
+                    # Checkpoint after every batch; stop if another process has taken the broadcast over
+                    if not self.store.update(
+                        broadcast_id, self.owner, last_id=state['last_id'], sent=state['sent'],
+                        failed=state['failed'], blocked=state['blocked'], attempts=0
+                    ):
+                        logger.warning(f"Broadcast {broadcast_id} was taken over by another process, stopping")
+                        return
+
+                    if time.time() - last_progress >= self.progress_interval:
+                        self._show_progress(state)
+                        last_progress = time.time()
+        except Exception as e:
+            logger.error(f"Error in broadcast {broadcast_id}: {str(e)}")
+            self._failed(state, e)
+            return
+
+        if not self.store.update(broadcast_id, self.owner, status='done'):
+            logger.warning(f"Broadcast {broadcast_id} was taken over by another process, stopping")
+            return
+        self._show_progress(state)
+        try:
+            self.bot.send_message(chat_id=state['admin_chat_id'], text=_report_text(state))
+        except Exception as e:
+            logger.error(f"Error sending broadcast report: {str(e)}")
+
+    def _failed(self, state, error):
+        """
+        Schedule the next attempt of a failed broadcast, or give it up after max_attempts.
+
+        The admin is told about the first failure and about giving up, not about every retry.
+        """
+        attempts = state['attempts'] + 1
+        delay = self.stale_after * 2 ** (attempts - 1)
+        self._retry_at = time.time() + delay
+        give_up = attempts >= self.max_attempts
+        try:
+            if give_up:
+                self.store.update(state['id'], self.owner, status='failed', attempts=attempts)
+            else:
+                # Left as 'running' so it is resumed from the last checkpoint after the delay
+                self.store.update(state['id'], self.owner, attempts=attempts, retry_at=self._retry_at)
+        except Exception as e:
+            logger.error(f"Could not save the state of broadcast {state['id']}: {str(e)}")
+
+        if give_up:
+            text = f"❌ تم إيقاف الإرسال الجماعي بعد {attempts} محاولات فاشلة: {str(error)}"
+        elif attempts == 1:
+            text = f"حدث خطأ أثناء الإرسال الجماعي: {str(error)}\nسيتم استئنافه تلقائياً من آخر نقطة محفوظة."
+        else:
+            return
+        try:
+            self.bot.send_message(chat_id=state['admin_chat_id'], text=text)
+        except Exception:
+            pass
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+def start_broadcaster(bot):
+    """Create the shared broadcaster; interrupted broadcasts are resumed in the background."""
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            _broadcaster = Broadcaster(bot)
+            _broadcaster.start_watchdog()
+        return _broadcaster
+
+def get_broadcaster():
+    """Return the shared broadcaster (start_broadcaster must have been called)."""
+    if _broadcaster is None:
+        raise RuntimeError("Broadcaster has not been started")
+    return _broadcaster
@@ -15,3 +15,143 @@ DEFAULT_LANGUAGE = "ar"  # Arabic
 
 # Admin user ID (change this to your Telegram user ID)
 ADMIN_ID = 7089656746  # معرف مدير البوت على تيليجرام (@Mavdiii)
+
+# Rasterization settings for operations that render PDF pages to images
+RASTER_DPI = 200
+# Number of pages rendered per pdf2image call; bounds peak memory regardless of document length
+RASTER_CHUNK_SIZE = 4
+
+# Worker processes shared by all page-parallel work (rasterizing, OCR, layout extraction), and
+# how they are started: "forkserver" or "spawn", never a fork of the multithreaded bot process
+PROCESS_POOL_WORKERS = os.cpu_count() or 1
+PROCESS_POOL_START_METHOD = "forkserver"
+
+# Parallel rasterization: page ranges in flight per document (bounds the rendered pages
+# waiting to be consumed) and pages handed to each worker task
+RASTER_WORKERS = PROCESS_POOL_WORKERS
+RASTER_PAGES_PER_TASK = 8
+
+# OCR of pages without a text layer: tesseract languages ("+"-separated), rendering resolution,
+# page ranges in flight per document, and the number of non-space characters below which a page counts as scanned
+OCR_LANGUAGES = "ara+eng"
+OCR_DPI = 300
+OCR_WORKERS = RASTER_WORKERS
+OCR_MIN_TEXT_CHARS = 10
+
+# PDF to PowerPoint slide images: rendering resolution, JPEG quality, and the number of
+# colors up to which a page is stored as a lossless palette PNG instead of a JPEG
+PPT_DPI = 150
+PPT_JPEG_QUALITY = 80
+PPT_PNG_MAX_COLORS = 256
+
+# Office documents to PDF with headless LibreOffice: soffice executable, instances kept running,
+# conversions after which an instance is restarted, seconds allowed for an instance to start and
+# for one conversion, and the directory of the instances' profiles
+OFFICE_BINARY = os.environ.get("OFFICE_BINARY", "soffice")
+# Used to keep instances running when LibreOffice's Python bridge (python3-uno) cannot be
+# imported by the bot's Python: pip install unoserver, with the system Python that has uno
+UNOSERVER_BINARY = os.environ.get("UNOSERVER_BINARY", "unoserver")
+UNOCONVERT_BINARY = os.environ.get("UNOCONVERT_BINARY", "unoconvert")
+OFFICE_WORKERS = 2
+OFFICE_MAX_JOBS = 200
+OFFICE_START_TIMEOUT = 60
+OFFICE_CONVERT_TIMEOUT = 120
+OFFICE_PROFILE_DIR = os.path.join(TEMP_DIR, "office_profiles")
+
+# Parallel text layout extraction (PDF to Excel): page ranges in flight per document and pages handed to each worker task
+LAYOUT_WORKERS = RASTER_WORKERS
+LAYOUT_PAGES_PER_TASK = 16
+
+# Cache of OCR results per rendered page: SQLite file, total size of the cached texts, and
+# seconds a process waits for another one OCRing the same page before doing it itself
+OCR_CACHE_DB_PATH = os.path.join(TEMP_DIR, "ocr_cache.sqlite3")
+OCR_CACHE_MAX_BYTES = 256 * 1024 * 1024
+OCR_CACHE_WAIT = 300
+
+# Threads writing the parts of a split document (the source is read once, in the calling thread)
+SPLIT_WORKERS = 4
+
+# Open PDF documents (memory-mapped, parsed lazily) kept for reuse between a handler and later operations
+DOCUMENT_CACHE_SIZE = 64
+
+# Background job queue: SQLite file that survives restarts, worker threads, per-user concurrency,
+# and seconds a running job stays leased to its process without renewal before it is queued again
+JOB_DB_PATH = os.path.join(TEMP_DIR, "jobs.sqlite3")
+JOB_WORKERS = 4
+JOB_PER_USER_LIMIT = 1
+JOB_LEASE = 60
+
+# On-disk cache of operation results, keyed by input content, operation and parameters
+RESULT_CACHE_DIR = os.path.join(TEMP_DIR, "result_cache")
+RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+RESULT_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # Entries unused for a week are removed
+RESULT_CACHE_EVICT_INTERVAL = 10 * 60  # Seconds between full scans of the cache directory
+
+# Index of already uploaded artifacts (content hash -> Telegram file_id)
+FILE_ID_DB_PATH = os.path.join(TEMP_DIR, "file_ids.sqlite3")
+
+# Outgoing message rate limits (Telegram allows about 30 messages/s per bot and 1 message/s per chat)
+SEND_GLOBAL_RATE = 25
+SEND_CHAT_RATE = 1
+SEND_CHAT_BURST = 3
+# Times a request is retried after a flood-wait (RetryAfter) error
+SEND_MAX_RETRIES = 3
+
+# Multi-file results are sent as media groups of up to 10 documents, or as one ZIP
+# archive when there are more than DELIVERY_ZIP_THRESHOLD files
+MEDIA_GROUP_SIZE = 10
+DELIVERY_ZIP_THRESHOLD = 30
+# Largest file a bot may upload (50MB); bigger archives fall back to media groups
+DELIVERY_MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+# How the bot receives updates: "polling" (getUpdates loop) or "webhook" (Telegram posts
+# updates to the Flask app). Conversation state (context.user_data) lives in the bot process,
+# so webhook mode must be served by a single web worker process, e.g.
+# gunicorn --workers 1 --threads 8 wsgi:app; a second worker refuses to start
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Public base URL of the Flask app (e.g. https://example.com); the webhook is registered
+# at WEBHOOK_URL + WEBHOOK_PATH when set
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = "/telegram/webhook"
+# Compared with the X-Telegram-Bot-Api-Secret-Token header of incoming updates; required in
+# webhook mode (1-256 characters: A-Z, a-z, 0-9, _ and -), e.g. python -c "import secrets; print(secrets.token_urlsafe(32))"
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+# Held by the process serving the webhook, so a second one cannot start
+WEBHOOK_LOCK_PATH = os.path.join(TEMP_DIR, "webhook.lock")
+# Attempts to reach Telegram (getMe) when the webhook process starts, the first waiting
+# this many seconds and each next one twice as long
+WEBHOOK_STARTUP_ATTEMPTS = 6
+WEBHOOK_STARTUP_DELAY = 2
+# Bot API base URL; can point to a local fake Telegram server for testing
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# Per-user settings: SQLite file, number of users kept in memory, and seconds between
+# batched writes of changed users
+USER_STATE_DB_PATH = os.path.join(TEMP_DIR, "user_state.sqlite3")
+USER_STATE_CACHE_SIZE = 10000
+USER_STATE_FLUSH_INTERVAL = 2
+
+# User activity is buffered in memory and saved to the users table every ACTIVITY_FLUSH_INTERVAL
+# seconds; the cached user count is recounted from the database every USER_COUNT_REFRESH_INTERVAL seconds
+ACTIVITY_FLUSH_INTERVAL = 10
+USER_COUNT_REFRESH_INTERVAL = 300
+
+# Admin broadcasts: progress file, users read per batch (one checkpoint per batch), sending
+# threads, seconds between progress updates, seconds without a checkpoint after which
+# another bot process takes over an interrupted broadcast, and failed attempts (retried with
+# a doubling delay) after which a broadcast is given up
+BROADCAST_DB_PATH = os.path.join(TEMP_DIR, "broadcasts.sqlite3")
+BROADCAST_BATCH_SIZE = 500
+BROADCAST_WORKERS = 8
+BROADCAST_PROGRESS_INTERVAL = 10
+BROADCAST_STALE_AFTER = 120
+BROADCAST_MAX_ATTEMPTS = 5
+
+# Database connection pool (the database URL itself comes from DATABASE_URL):
+# connections kept open, extra connections allowed under load, seconds to wait for a free
+# connection, seconds after which a connection is replaced, and a liveness check before use
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no")
\ No newline at end of file
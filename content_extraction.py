@@ -1,10 +1,16 @@
 import os
 import logging
 import tempfile
+import multiprocessing
 from uuid import uuid4
+from functools import lru_cache, partial
 from PIL import Image
 from PyPDF2 import PdfReader
 from io import BytesIO
+from documents import open_document
+from ocr_cache import get_ocr_cache, page_key
+from result_cache import cached_result, skip_caching
+from config import OCR_LANGUAGES, OCR_DPI, OCR_WORKERS, OCR_MIN_TEXT_CHARS
 
 # Try to import pytesseract for OCR if available
 try:
@@ -15,6 +21,7 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+@cached_result('pdf_path')
 def extract_images(pdf_path, output_dir):
     """
     Extract images from a PDF file.
@@ -51,39 +58,105 @@ def extract_images(pdf_path, output_dir):
         logger.error(f"Error extracting images from PDF: {str(e)}")
         raise Exception(f"فشل في استخراج الصور من PDF: {str(e)}")
 
-def extract_text(pdf_path):
+def has_text_layer(text):
+    """Whether text extracted from a page is enough to skip OCR for it."""
+    return len(''.join(text.split())) >= OCR_MIN_TEXT_CHARS
+
+@lru_cache(maxsize=None)
+def _tesseract_languages(languages):
+    """Keep the requested tesseract languages that are installed (None: tesseract's default)."""
+    try:
+        installed = set(pytesseract.get_languages(config=''))
+    except Exception as e:
+        logger.warning(f"Could not list tesseract languages: {str(e)}")
+        return languages
+    
+    requested = languages.split('+')
+    available = [lang for lang in requested if lang in installed]
+    if len(available) < len(requested):
+        logger.warning(f"Tesseract languages not installed: {', '.join(set(requested) - installed)}")
+    return '+'.join(available) or None
+
+def _ocr_page(lang, dpi, index, image):
+    """Worker task: OCR one rendered page, unless the same page image was OCRed before."""
+    cache = get_ocr_cache()
+    key = page_key(image, lang, dpi)
+    text = cache.claim(key)
+    if text is not None:
+        return text
+    
+    if multiprocessing.parent_process() is not None:
+        # Pages are already OCRed in parallel; tesseract's own threads would compete for the same cores
+        os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    try:
+        text = pytesseract.image_to_string(image, lang=lang)
+    except Exception:
+        cache.release(key)
+        raise
+    cache.put(key, text)
+    return text
+
+def iter_page_texts(pdf_path, languages=OCR_LANGUAGES, dpi=OCR_DPI, workers=OCR_WORKERS):
     """
-    Extract text from a PDF file.
+    Extract the text of each page of a PDF, running OCR only on pages without a text layer.
+    
+    The text layer of every page is read first; pages with (almost) no text are then
+    rendered and OCRed by a pool of worker processes, and their text replaces the
+    text layer. Pages already OCRed (same image, languages and DPI) are taken from the
+    OCR cache. Texts are yielded in page order as soon as they are available.
     
     Args:
         pdf_path: Path to the PDF file
+        languages: Tesseract languages, e.g. "ara+eng"
+        dpi: Resolution pages are rendered at for OCR
+        workers: Number of OCR worker processes
         
-    Returns:
-        Extracted text as a string
+    Yields:
+        Tuples of (page_index, text), page_index being 0-based
     """
-    try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        
-        for page in reader.pages:
-            text += page.extract_text() + "\n\n"
+    with open_document(pdf_path) as reader:
+        texts = [page.extract_text() for page in reader.pages]
+    
+    scanned = [i for i, text in enumerate(texts) if not has_text_layer(text)]
+    ocr_texts = None
+    if scanned and TESSERACT_AVAILABLE:
+        from rasterizer import map_page_images
         
-        # If no text was extracted and OCR is available, try OCR
-        if not text.strip() and TESSERACT_AVAILABLE:
+        ocr = partial(_ocr_page, _tesseract_languages(languages), dpi)
+        ocr_texts = map_page_images(pdf_path, ocr, dpi=dpi, workers=workers, pages=scanned)
+    elif scanned:
+        # Scanned pages keep their (empty) text layer; don't cache that as the document's text
+        skip_caching()
+    
+    scanned = set(scanned)
+    for index, text in enumerate(texts):
+        if index in scanned and ocr_texts is not None:
             try:
-                # Convert PDF to images and perform OCR
-                from pdf2image import convert_from_path
-                
-                text = ""
-                images = convert_from_path(pdf_path)
-                
-                for image in images:
-                    text += pytesseract.image_to_string(image) + "\n\n"
+                text = next(ocr_texts)
             except Exception as ocr_error:
                 logger.error(f"OCR error: {str(ocr_error)}")
-                # Continue with empty text if OCR fails
+                # Continue with the text layer of the remaining pages if OCR fails,
+                # without caching the result so the document is OCRed again next time
+                ocr_texts.close()
+                ocr_texts = None
+                skip_caching()
+        yield index, text
+
+@cached_result('pdf_path')
+def extract_text(pdf_path, languages=OCR_LANGUAGES, dpi=OCR_DPI):
+    """
+    Extract text from a PDF file.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        languages: Tesseract languages used for scanned pages, e.g. "ara+eng"
+        dpi: Resolution scanned pages are rendered at for OCR
         
-        return text
+    Returns:
+        Extracted text as a string
+    """
+    try:
+        return "".join(text + "\n\n" for _, text in iter_page_texts(pdf_path, languages, dpi))
     
     except Exception as e:
         logger.error(f"Error extracting text from PDF: {str(e)}")
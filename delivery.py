@@ -0,0 +1,259 @@
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import zipfile
+import threading
+from uuid import uuid4
+from contextlib import ExitStack
+from telegram import InputMediaDocument
+from telegram.error import BadRequest
+from result_cache import file_digest
+from rate_limiter import get_send_rate_limiter
+from config import FILE_ID_DB_PATH, MEDIA_GROUP_SIZE, DELIVERY_ZIP_THRESHOLD, DELIVERY_MAX_UPLOAD_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Maximum length of a Telegram text message chunk
+TEXT_CHUNK_SIZE = 4000
+
+# Seconds allowed for a single upload request (a media group carries up to 10 files)
+UPLOAD_TIMEOUT = 120
+
+# Fixed timestamp for archive members, so the same files always give the same ZIP
+# (and its file_id can be reused)
+ARCHIVE_DATE = (1980, 1, 1, 0, 0, 0)
+# Already compressed formats are stored in archives as-is
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.zip', '.docx', '.xlsx', '.pptx'}
+
+class FileIdIndex:
+    """
+    Persistent map from artifact content hash to the Telegram file_id of its first upload.
+
+    The filename is part of the key because a document sent by file_id keeps the
+    name it was uploaded with.
+    """
+
+    def __init__(self, db_path=FILE_ID_DB_PATH):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS file_ids ('
+            'digest TEXT NOT NULL, '
+            'filename TEXT NOT NULL, '
+            'file_id TEXT NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'PRIMARY KEY (digest, filename))'
+        )
+
+    def get(self, digest, filename):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT file_id FROM file_ids WHERE digest = ? AND filename = ?', (digest, filename)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, digest, filename, file_id):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO file_ids (digest, filename, file_id, created_at) VALUES (?, ?, ?, ?)',
+                (digest, filename, file_id, time.time())
+            )
+
+    def forget(self, digest, filename):
+        with self._lock:
+            self._db.execute('DELETE FROM file_ids WHERE digest = ? AND filename = ?', (digest, filename))
+
+_file_id_index = None
+_file_id_index_lock = threading.Lock()
+
+def get_file_id_index():
+    """Return the shared file_id index, opening it on first use."""
+    global _file_id_index
+    with _file_id_index_lock:
+        if _file_id_index is None:
+            _file_id_index = FileIdIndex()
+        return _file_id_index
+
+def send_message(bot, chat_id, text, **kwargs):
+    """Send a text message within the rate limits."""
+    return get_send_rate_limiter().call(bot.send_message, chat_id=chat_id, text=text, **kwargs)
+
+def send_document(bot, chat_id, path, filename=None, caption=''):
+    """
+    Send a file as a document, reusing the file_id of an earlier upload of the same content.
+
+    Args:
+        bot: Telegram bot
+        chat_id: Chat to send the document to
+        path: Path to the file
+        filename: Name shown to the user (defaults to the file's basename)
+        caption: Caption of the message
+
+    Returns:
+        The sent message
+    """
+    filename = filename or os.path.basename(path)
+    index = get_file_id_index()
+    limiter = get_send_rate_limiter()
+    digest = file_digest(path)
+
+    file_id = index.get(digest, filename)
+    if file_id:
+        try:
+            return limiter.call(bot.send_document, chat_id=chat_id, document=file_id, caption=caption)
+        except BadRequest as e:
+            # The file_id is no longer valid; upload the file again
+            logger.warning(f"Stale file_id for {filename}: {str(e)}")
+            index.forget(digest, filename)
+
+    with open(path, 'rb') as file:
+        message = limiter.call(
+            bot.send_document, chat_id=chat_id, document=file, filename=filename,
+            caption=caption, timeout=UPLOAD_TIMEOUT
+        )
+
+    if message is not None and message.document is not None:
+        index.put(digest, filename, message.document.file_id)
+    return message
+
+def _send_media_group(bot, chat_id, items, digests, file_ids):
+    """Send one media group of documents, uploading the items without a file_id."""
+    index = get_file_id_index()
+    with ExitStack() as stack:
+        media = []
+        for (path, filename, caption), file_id in zip(items, file_ids):
+            document = file_id or stack.enter_context(open(path, 'rb'))
+            media.append(InputMediaDocument(document, caption=caption, filename=filename))
+        messages = get_send_rate_limiter().call(
+            bot.send_media_group, chat_id=chat_id, media=media,
+            timeout=UPLOAD_TIMEOUT, messages=len(media)
+        )
+
+    for (path, filename, _), digest, message in zip(items, digests, messages or []):
+        if message is not None and message.document is not None:
+            index.put(digest, filename, message.document.file_id)
+    return messages
+
+def send_document_group(bot, chat_id, items):
+    """
+    Send up to MEDIA_GROUP_SIZE files as a single album of documents.
+
+    Args:
+        bot: Telegram bot
+        chat_id: Chat to send the documents to
+        items: List of (path, filename, caption) tuples
+
+    Returns:
+        List of sent messages
+    """
+    if len(items) == 1:
+        path, filename, caption = items[0]
+        return [send_document(bot, chat_id, path, filename=filename, caption=caption)]
+
+    index = get_file_id_index()
+    digests = [file_digest(path) for path, _, _ in items]
+    file_ids = [index.get(digest, filename) for digest, (_, filename, _) in zip(digests, items)]
+
+    if any(file_ids):
+        try:
+            return _send_media_group(bot, chat_id, items, digests, file_ids)
+        except BadRequest as e:
+            # At least one file_id is no longer valid; upload the whole group again
+            logger.warning(f"Stale file_id in media group: {str(e)}")
+            for digest, (_, filename, _), file_id in zip(digests, items, file_ids):
+                if file_id:
+                    index.forget(digest, filename)
+
+    return _send_media_group(bot, chat_id, items, digests, [None] * len(items))
+
+def build_archive(paths, names, archive_path):
+    """
+    Pack files into a ZIP archive, streaming each file into it.
+
+    Args:
+        paths: Paths of the files to pack
+        names: Names of the files inside the archive
+        archive_path: Path of the archive to write
+
+    Returns:
+        Path to the archive
+    """
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        for path, name in zip(paths, names):
+            info = zipfile.ZipInfo(name, date_time=ARCHIVE_DATE)
+            info.external_attr = 0o644 << 16
+            if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    return archive_path
+
+def deliver_documents(bot, chat_id, paths, delivery):
+    """
+    Send a list of result files.
+
+    Files go out as media groups of up to MEDIA_GROUP_SIZE documents. More than
+    DELIVERY_ZIP_THRESHOLD files are packed into one ZIP archive instead, unless
+    the archive would be too big to upload.
+    """
+    total = len(paths)
+    names = [delivery['filename'].format(n=i + 1, total=total) for i in range(total)]
+    captions = [delivery.get('caption', '').format(n=i + 1, total=total) for i in range(total)]
+
+    if delivery.get('intro'):
+        send_message(bot, chat_id, delivery['intro'].format(total=total))
+
+    if total > DELIVERY_ZIP_THRESHOLD and sum(os.path.getsize(p) for p in paths) < DELIVERY_MAX_UPLOAD_SIZE:
+        archive_name = delivery.get('archive', 'files.zip')
+        archive_path = os.path.join(os.path.dirname(paths[0]), f"{uuid4().hex}_{archive_name}")
+        try:
+            build_archive(paths, names, archive_path)
+            send_document(
+                bot, chat_id, archive_path, filename=archive_name,
+                caption=delivery.get('archive_caption', '').format(total=total)
+            )
+        finally:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+    else:
+        items = list(zip(paths, names, captions))
+        for start in range(0, total, MEDIA_GROUP_SIZE):
+            send_document_group(bot, chat_id, items[start:start + MEDIA_GROUP_SIZE])
+
+    if delivery.get('outro'):
+        send_message(bot, chat_id, delivery['outro'])
+
+def deliver_result(bot, job, result):
+    """
+    Send the result of a job back to the user.
+
+    The 'delivery' entry of the job params decides how:
+        {'kind': 'document', 'filename': ..., 'caption': ...} for a single file
+        {'kind': 'documents', 'filename': ..., 'caption': ..., 'intro': ..., 'outro': ...,
+         'archive': ..., 'archive_caption': ...}
+            for a list of files; {n} and {total} are substituted in each template and
+            'archive' names the ZIP used for long lists (see deliver_documents)
+        {'kind': 'text', 'prefix': ...} for extracted text, split into message-sized chunks
+    """
+    delivery = job.params.get('delivery', {})
+    kind = delivery.get('kind', 'document')
+
+    if kind == 'text':
+        text = result
+        if len(text) > TEXT_CHUNK_SIZE:
+            chunks = [text[i:i+TEXT_CHUNK_SIZE] for i in range(0, len(text), TEXT_CHUNK_SIZE)]
+            for i, chunk in enumerate(chunks):
+                send_message(bot, job.chat_id, f'جزء {i+1} من {len(chunks)}:\n\n{chunk}')
+        else:
+            send_message(bot, job.chat_id, f"{delivery.get('prefix', '')}{text}")
+
+    elif kind == 'documents':
+        deliver_documents(bot, job.chat_id, result, delivery)
+
+    else:
+        send_document(bot, job.chat_id, result, filename=delivery.get('filename'), caption=delivery.get('caption', ''))
@@ -0,0 +1,350 @@
+import io
+import os
+import re
+import mmap
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from functools import partial
+from contextlib import contextmanager
+from PyPDF2 import PdfReader, DocumentInformation
+from PyPDF2.generic import DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject, read_object
+from config import DOCUMENT_CACHE_SIZE
+from process_pool import imap_tasks
+
+logger = logging.getLogger(__name__)
+
+# What a quick look at a PDF tells: number of pages, whether it is encrypted, and its
+# Info dictionary (a PyPDF2 DocumentInformation, None when absent or encrypted)
+DocumentInfo = namedtuple('DocumentInfo', ['page_count', 'encrypted', 'metadata'])
+
+# Bytes at the end of the file searched for the startxref keyword
+PROBE_TAIL_SIZE = 1024
+
+_XREF_SUBSECTION = re.compile(rb'[ \t\r\n]*(\d+)[ \t]+(\d+)[ \t]*(?:\r\n|\r|\n)')
+_XREF_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+_TRAILER = re.compile(rb'[ \t\r\n]*trailer[ \t\r\n]*')
+_OBJECT_HEADER = re.compile(rb'[ \t\r\n]*(\d+)[ \t\r\n]+(\d+)[ \t\r\n]+obj[ \t\r\n]*')
+
+class _DocumentHandle:
+    """An open PDF: the reader over a memory map of the file, and the lock serializing its use."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # The map stays valid after the file is closed (or deleted)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Only the trailer and cross-reference table are parsed here; objects are read when first used
+        self.reader = PdfReader(self.map)
+        self.lock = threading.RLock()
+
+_handles = OrderedDict()
+_handles_lock = threading.Lock()
+
+def _handle_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+def _get_handle(path):
+    key = _handle_key(path)
+    with _handles_lock:
+        handle = _handles.get(key)
+        if handle is not None:
+            _handles.move_to_end(key)
+            return handle
+
+    handle = _DocumentHandle(path)
+    with _handles_lock:
+        # Another thread may have opened the same file meanwhile; keep the first handle
+        handle = _handles.setdefault(key, handle)
+        _handles.move_to_end(key)
+        while len(_handles) > DOCUMENT_CACHE_SIZE:
+            _handles.popitem(last=False)
+    return handle
+
+@contextmanager
+def open_document(path):
+    """
+    Give exclusive use of the shared PdfReader of a PDF file.
+
+    Readers are cached per (path, size, modification time), so the file is parsed
+    once for the handler that receives it and the operations that run on it later;
+    objects resolved by one of them (page tree, fonts, ...) are reused by the next.
+    The file is memory-mapped rather than read into memory. A PdfReader is not
+    thread-safe, so its lock is held for the duration of the with block.
+
+    Args:
+        path: Path to the PDF file
+
+    Yields:
+        The PdfReader of the file
+    """
+    handle = _get_handle(path)
+    with handle.lock:
+        yield handle.reader
+
+class _ProbeError(Exception):
+    """Raised when the file does not have the structure the probe expects."""
+
+class _Probe:
+    """
+    Reads single objects of a PDF through its cross-reference sections.
+
+    Only the sections themselves (a few bytes per subsection for a table) and the
+    objects asked for are read from the memory-mapped file. Objects are parsed with
+    PyPDF2's object parser; their indirect references resolve through the probe.
+    """
+
+    # Read by PyPDF2's parser: fail instead of guessing on malformed objects
+    strict = True
+
+    def __init__(self, data):
+        self.data = data
+        self.sections = []
+        self.trailer = None
+        self._objects = {}
+        self._object_streams = {}
+        self._read_sections()
+
+    def _read_sections(self):
+        """Load the chain of cross-reference sections, newest first, starting at startxref."""
+        matches = re.findall(rb'startxref\s+(\d+)', self.data[-PROBE_TAIL_SIZE:])
+        if not matches:
+            raise _ProbeError("startxref not found")
+        offset, seen = int(matches[-1]), set()
+
+        while offset is not None:
+            if offset in seen or offset >= len(self.data):
+                raise _ProbeError("bad cross-reference offset")
+            seen.add(offset)
+            if self.data[offset:offset + 4] == b'xref':
+                section, trailer = self._read_table(offset + 4)
+                self.sections.append(section)
+                if '/XRefStm' in trailer:
+                    # Hybrid file: objects missing from the table are in the stream
+                    self.sections.append(self._read_stream(int(trailer['/XRefStm']))[0])
+            else:
+                section, trailer = self._read_stream(offset)
+                self.sections.append(section)
+            if self.trailer is None:
+                self.trailer = trailer
+            prev = trailer.raw_get('/Prev') if '/Prev' in trailer else None
+            offset = int(prev) if prev is not None else None
+
+    def _read_table(self, pos):
+        """
+        Index a cross-reference table without reading its entries.
+
+        Returns:
+            Tuple of (list of (first number, count, offset of the first entry), trailer)
+        """
+        subsections = []
+        while True:
+            match = _XREF_SUBSECTION.match(self.data, pos)
+            if match is None:
+                break
+            start, count = int(match.group(1)), int(match.group(2))
+            subsections.append((start, count, match.end()))
+            # Entries are exactly 20 bytes long
+            pos = match.end() + 20 * count
+
+        match = _TRAILER.match(self.data, pos)
+        if match is None:
+            raise _ProbeError("trailer not found")
+        self.data.seek(match.end())
+        trailer = read_object(self.data, self)
+        if not isinstance(trailer, DictionaryObject):
+            raise _ProbeError("bad trailer")
+        return ('table', subsections), trailer
+
+    def _read_stream(self, offset):
+        """Decode a cross-reference stream. Returns ({number: entry}, stream dictionary)."""
+        stream = self._parse_at(offset, None)
+        if not isinstance(stream, StreamObject) or stream.get('/Type') != '/XRef':
+            raise _ProbeError("bad cross-reference stream")
+        widths = [int(w) for w in stream['/W']]
+        index = [int(i) for i in stream.get('/Index', [0, stream['/Size']])]
+        data = stream.get_data()
+        if len(data) < sum(widths) * sum(index[1::2]):
+            raise _ProbeError("truncated cross-reference stream")
+
+        entries = {}
+        pos = 0
+        for start, count in zip(index[0::2], index[1::2]):
+            for number in range(start, start + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], 'big'))
+                    pos += width
+                kind = fields[0] if widths[0] else 1
+                if kind == 0:
+                    entries[number] = ('free',)
+                elif kind == 1:
+                    entries[number] = ('offset', fields[1], fields[2])
+                elif kind == 2:
+                    entries[number] = ('compressed', fields[1], fields[2])
+        return ('stream', entries), stream
+
+    def _find(self, number):
+        for kind, section in self.sections:
+            if kind == 'stream':
+                entry = section.get(number)
+                if entry is not None:
+                    return entry
+                continue
+            for start, count, pos in section:
+                if start <= number < start + count:
+                    match = _XREF_ENTRY.match(self.data, pos + 20 * (number - start))
+                    if match is None:
+                        raise _ProbeError("bad cross-reference entry")
+                    if match.group(3) == b'f':
+                        return ('free',)
+                    return ('offset', int(match.group(1)), int(match.group(2)))
+        return ('free',)
+
+    def _parse_at(self, offset, ref):
+        """Parse the object whose "n g obj" header is at offset."""
+        match = _OBJECT_HEADER.match(self.data, offset)
+        if match is None:
+            raise _ProbeError("object header not found")
+        if ref is not None and (int(match.group(1)), int(match.group(2))) != (ref.idnum, ref.generation):
+            raise _ProbeError("cross-reference entry points to another object")
+        self.data.seek(match.end())
+        return read_object(self.data, self)
+
+    def _object_stream(self, number):
+        """Return (parsed header {object number: offset}, decoded data) of an object stream."""
+        if number not in self._object_streams:
+            stream = self.get_object(IndirectObject(number, 0, self))
+            if not isinstance(stream, StreamObject) or stream.get('/Type') != '/ObjStm':
+                raise _ProbeError("bad object stream")
+            data = stream.get_data()
+            first = int(stream['/First'])
+            numbers = [int(n) for n in data[:first].split()]
+            offsets = {numbers[i]: first + numbers[i + 1] for i in range(0, len(numbers) - 1, 2)}
+            self._object_streams[number] = (offsets, data)
+        return self._object_streams[number]
+
+    def get_object(self, ref):
+        """Resolve an indirect reference (called by PyPDF2 through IndirectObject.get_object)."""
+        key = (ref.idnum, ref.generation)
+        if key not in self._objects:
+            entry = self._find(ref.idnum)
+            if entry[0] == 'free':
+                obj = None
+            elif entry[0] == 'offset':
+                obj = self._parse_at(entry[1], ref)
+            else:
+                offsets, data = self._object_stream(entry[1])
+                if ref.idnum not in offsets:
+                    raise _ProbeError("object missing from its object stream")
+                stream = io.BytesIO(data)
+                stream.seek(offsets[ref.idnum])
+                obj = read_object(stream, self)
+            self._objects[key] = obj
+        return self._objects[key]
+
+    def info(self):
+        encrypted = '/Encrypt' in self.trailer
+        pages = self.trailer['/Root']['/Pages']
+        count = pages['/Count']
+        if not isinstance(count, NumberObject) or count < 0:
+            raise _ProbeError("bad page count")
+
+        metadata = None
+        # Strings of an encrypted document are encrypted too
+        if not encrypted and '/Info' in self.trailer:
+            info = self.trailer['/Info']
+            if isinstance(info, DictionaryObject):
+                metadata = DocumentInformation()
+                for key, value in info.items():
+                    if isinstance(value, IndirectObject):
+                        value = value.get_object()
+                    if value is not None:
+                        metadata[NameObject(key)] = value
+        return DocumentInfo(int(count), encrypted, metadata)
+
+def probe_document(path):
+    """
+    Return the page count, encryption status and metadata of a PDF file.
+
+    Only the end of the file, its cross-reference sections and the catalog, page
+    tree root and Info dictionary are read, so a large file costs a few kilobytes
+    of I/O. Files the probe cannot make sense of (damaged, or with the catalog in
+    an encrypted object stream) are parsed fully instead.
+
+    Args:
+        path: Path to the PDF file
+
+    Returns:
+        DocumentInfo
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _Probe(data).info()
+        finally:
+            data.close()
+    except OSError:
+        raise
+    except Exception as e:
+        logger.info(f"Probe of {os.path.basename(path)} failed, parsing it fully: {str(e)}")
+
+    with open_document(path) as reader:
+        encrypted = reader.is_encrypted
+        return DocumentInfo(len(reader.pages), encrypted, None if encrypted else reader.metadata)
+
+def get_page_count(path):
+    """Return the number of pages of a PDF file."""
+    return probe_document(path).page_count
+
+def _process_page_range(path, func, page_range):
+    """Worker task: apply func to a range of pages, with a reader of the worker's own."""
+    # The shared readers (and their locks) of the parent process are not used in a worker
+    reader = _DocumentHandle(path).reader
+    return [func(index, reader.pages[index]) for index in range(*page_range)]
+
+def map_pages(path, func, workers, pages_per_task):
+    """
+    Apply a function to every page of a PDF, using a pool of worker processes.
+
+    The document is split into ranges of pages_per_task pages; each worker of the
+    shared process pool parses a range with its own reader. Only a few ranges are
+    handed out ahead of the caller. Results are yielded in page order.
+
+    Args:
+        path: Path to the PDF file
+        func: Picklable callable (page_index, PyPDF2 PageObject) -> picklable result
+        workers: Number of page ranges in flight at a time; 1 runs in the current process
+        pages_per_task: Number of pages handed to a worker at a time
+
+    Yields:
+        func's result for each page, in page order
+    """
+    total_pages = get_page_count(path)
+    pages_per_task = max(1, int(pages_per_task))
+    ranges = [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+    workers = min(max(1, int(workers)), len(ranges))
+
+    if workers <= 1:
+        with open_document(path) as reader:
+            for index, page in enumerate(reader.pages):
+                yield func(index, page)
+        return
+
+    for results in imap_tasks(partial(_process_page_range, path, func), ranges, workers):
+        yield from results
+
+def forget_documents(directory):
+    """Drop the cached handles of the files inside a directory (e.g. when a user's files are deleted)."""
+    prefix = os.path.join(os.path.abspath(directory), '')
+    with _handles_lock:
+        for key in [key for key in _handles if key[0].startswith(prefix)]:
+            del _handles[key]
+
+def forget_document(path):
+    """Drop the cached handles of one file (e.g. when it is deleted)."""
+    path = os.path.abspath(path)
+    with _handles_lock:
+        for key in [key for key in _handles if key[0] == path]:
+            del _handles[key]
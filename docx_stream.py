@@ -0,0 +1,144 @@
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# Fixed timestamp for package members, so the same content always gives the same file
+ARCHIVE_DATE = (1980, 1, 1, 0, 0, 0)
+
+# Characters not allowed in XML 1.0 (PDF text sometimes contains them)
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+
+PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+def _heading_style(level, size):
+    return (
+        f'<w:style w:type="paragraph" w:styleId="Heading{level}">'
+        f'<w:name w:val="heading {level}"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:qFormat/>'
+        f'<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/><w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+        f'<w:rPr><w:b/><w:bCs/><w:sz w:val="{size}"/><w:szCs w:val="{size}"/></w:rPr>'
+        '</w:style>'
+    )
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:styles xmlns:w="{_W}">'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/>'
+    '<w:pPr><w:spacing w:after="120"/></w:pPr><w:rPr><w:sz w:val="22"/><w:szCs w:val="22"/></w:rPr></w:style>'
+    + _heading_style(1, 32) + _heading_style(2, 28) + _heading_style(3, 24) +
+    '</w:styles>'
+)
+
+DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:document xmlns:w="{_W}"><w:body>'
+)
+
+# A4 portrait, 2.5 cm margins
+DOCUMENT_END = (
+    '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+    '<w:pgMar w:top="1417" w:right="1417" w:bottom="1417" w:left="1417" w:header="708" w:footer="708" w:gutter="0"/>'
+    '</w:sectPr></w:body></w:document>'
+)
+
+PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+def paragraph_xml(text, level=0, rtl=False):
+    """
+    WordprocessingML of one paragraph.
+
+    Args:
+        text: Paragraph text
+        level: 0 for body text, 1-3 for headings
+        rtl: Right-to-left paragraph (Arabic)
+    """
+    properties = ''
+    if level:
+        properties += f'<w:pStyle w:val="Heading{level}"/>'
+    if rtl:
+        properties += '<w:bidi/>'
+    text = escape(_INVALID_XML.sub('', text))
+    return (
+        f'<w:p>{f"<w:pPr>{properties}</w:pPr>" if properties else ""}'
+        f'<w:r>{"<w:rPr><w:rtl/></w:rPr>" if rtl else ""}<w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+    )
+
+class DocxStreamWriter:
+    """
+    Writes a .docx file paragraph by paragraph.
+
+    The fixed package parts are written first and word/document.xml is then
+    streamed into the ZIP file as content is added, so no document model is held
+    in memory: only what was added since the last flush.
+    """
+
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        for name, data in (
+            ('[Content_Types].xml', CONTENT_TYPES),
+            ('_rels/.rels', PACKAGE_RELS),
+            ('word/_rels/document.xml.rels', DOCUMENT_RELS),
+            ('word/styles.xml', STYLES),
+        ):
+            self._zip.writestr(zipfile.ZipInfo(name, ARCHIVE_DATE), data, zipfile.ZIP_DEFLATED)
+
+        info = zipfile.ZipInfo('word/document.xml', ARCHIVE_DATE)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self._document = self._zip.open(info, 'w', force_zip64=True)
+        self._parts = [DOCUMENT_START]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_paragraph(self, text, level=0, rtl=False):
+        self._parts.append(paragraph_xml(text, level, rtl))
+
+    def add_page_break(self):
+        self._parts.append(PAGE_BREAK)
+
+    def flush(self):
+        """Compress the content added so far into the file."""
+        if self._parts:
+            self._document.write(''.join(self._parts).encode('utf-8'))
+            self._parts = []
+
+    def close(self):
+        if self._zip is None:
+            return
+        self._parts.append(DOCUMENT_END)
+        self.flush()
+        self._document.close()
+        self._zip.close()
+        self._zip = None
@@ -1,29 +1,48 @@
 import os
+import re
 import logging
-import tempfile
+from io import BytesIO
+from functools import partial
 from uuid import uuid4
 from PIL import Image
-from pdf2image import convert_from_path
-from PyPDF2 import PdfReader, PdfWriter
+from collections import Counter
+from config import RASTER_DPI, LAYOUT_WORKERS, LAYOUT_PAGES_PER_TASK, PPT_DPI, PPT_JPEG_QUALITY, PPT_PNG_MAX_COLORS
+from documents import open_document, map_pages
+from office_converter import convert_to_pdf
+from docx_stream import DocxStreamWriter
+from image_pdf import ImagePdfWriter
+from rasterizer import map_page_images
+from result_cache import cached_result
+from text_layout import page_text_runs, group_lines, group_paragraphs, body_size, group_blocks, table_rows, line_text
 
 # For Document conversions
+# These imports might not be available; we'll handle exceptions when using them.
+# Each library is imported on its own, so one missing library does not disable the others.
 try:
-    # Import libraries for document conversions
-    import docx
-    from docx2pdf import convert as docx_to_pdf
-    import openpyxl
     from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+except ImportError:
+    pass
+
+try:
     from pptx import Presentation
-    # These imports might not be available; we'll handle exceptions when using them
 except ImportError:
     pass
 
 logger = logging.getLogger(__name__)
 
+# Cell texts written to Excel as numbers: 1234, -12.5, 1,234.50 (not codes with leading zeros like 007)
+_NUMBER = re.compile(r'-?(0|[1-9]\d{0,2}(,\d{3})+|[1-9]\d*)(\.\d+)?')
+
+@cached_result('photo_paths')
 def photos_to_pdf(photo_paths, output_dir):
     """
     Convert photos to a PDF file.
     
+    Each photo is written as a page as soon as it is read, so memory use does not
+    grow with the number of photos; JPEG photos are embedded as they are, without
+    being decoded or re-compressed.
+    
     Args:
         photo_paths: List of paths to the photos
         output_dir: Directory to save the result
@@ -32,30 +51,14 @@ def photos_to_pdf(photo_paths, output_dir):
         Path to the generated PDF
     """
     try:
-        images = []
-        first_image = None
-        
-        for photo_path in photo_paths:
-            img = Image.open(photo_path)
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-            
-            if first_image is None:
-                first_image = img
-                images.append(img)
-            else:
-                images.append(img)
-        
-        if not images:
+        if not photo_paths:
             raise ValueError("لم يتم تقديم أي صور للتحويل.")
         
         output_path = os.path.join(output_dir, f"converted_photos_{uuid4().hex}.pdf")
         
-        # Save the first image as PDF with the rest appended
-        if len(images) == 1:
-            images[0].save(output_path, "PDF")
-        else:
-            images[0].save(output_path, "PDF", save_all=True, append_images=images[1:])
+        with ImagePdfWriter(output_path) as writer:
+            for photo_path in photo_paths:
+                writer.add_image(photo_path)
         
         return output_path
     
@@ -63,38 +66,44 @@ def photos_to_pdf(photo_paths, output_dir):
         logger.error(f"Error converting photos to PDF: {str(e)}")
         raise Exception(f"فشل في تحويل الصور إلى PDF: {str(e)}")
 
-def pdf_to_images(pdf_path, output_dir):
+def _save_page_image(output_dir, index, img):
+    """Save a rendered page image as PNG and return its path."""
+    img_path = os.path.join(output_dir, f"page_{index + 1}_{uuid4().hex}.png")
+    img.save(img_path, "PNG")
+    return img_path
+
+@cached_result('pdf_path')
+def pdf_to_images(pdf_path, output_dir, dpi=RASTER_DPI):
     """
     Convert a PDF file to images.
     
+    Pages are rendered and saved in parallel worker processes, a few pages at a time,
+    so memory use does not grow with the page count.
+    
     Args:
         pdf_path: Path to the PDF file
         output_dir: Directory to save the result
+        dpi: Rendering resolution
         
     Returns:
-        List of paths to the generated images
+        List of paths to the generated images, in page order
     """
     try:
-        images = convert_from_path(pdf_path)
-        
-        result_paths = []
-        for i, img in enumerate(images):
-            img_path = os.path.join(output_dir, f"page_{i + 1}_{uuid4().hex}.png")
-            img.save(img_path, "PNG")
-            result_paths.append(img_path)
-        
-        return result_paths
+        return list(map_page_images(pdf_path, partial(_save_page_image, output_dir), dpi=dpi))
     
     except Exception as e:
         logger.error(f"Error converting PDF to images: {str(e)}")
         raise Exception(f"فشل في تحويل PDF إلى صور: {str(e)}")
 
+@cached_result('pdf_path')
 def pdf_to_word(pdf_path, output_dir):
     """
     Convert a PDF file to a Word document.
     
-    This is a simplified implementation. For production use,
-    consider a dedicated PDF-to-Word conversion API.
+    The positioned text of each page is grouped into lines, paragraphs and headings
+    (by font size relative to the body text), and written straight into the .docx
+    file one page at a time, so memory use does not grow with the page count.
+    Layout beyond paragraphs (columns, tables, images) is not reproduced.
     
     Args:
         pdf_path: Path to the PDF file
@@ -104,18 +113,19 @@ def pdf_to_word(pdf_path, output_dir):
         Path to the generated Word document
     """
     try:
-        # Create a new Word document
-        doc = docx.Document()
-        
-        # Extract text from the PDF
-        reader = PdfReader(pdf_path)
-        
-        for page in reader.pages:
-            text = page.extract_text()
-            doc.add_paragraph(text)
-        
         output_path = os.path.join(output_dir, f"converted_to_word_{uuid4().hex}.docx")
-        doc.save(output_path)
+        # Font sizes seen so far, to tell headings from body text
+        sizes = Counter()
+        
+        with open_document(pdf_path) as reader, DocxStreamWriter(output_path) as document:
+            for index, page in enumerate(reader.pages):
+                if index:
+                    document.add_page_break()
+                
+                lines = group_lines(page_text_runs(page))
+                for paragraph in group_paragraphs(lines, body_size(lines, sizes)):
+                    document.add_paragraph(paragraph.text, paragraph.level, paragraph.rtl)
+                document.flush()
         
         return output_path
     
@@ -123,12 +133,45 @@ def pdf_to_word(pdf_path, output_dir):
         logger.error(f"Error converting PDF to Word: {str(e)}")
         raise Exception(f"فشل في تحويل PDF إلى Word: {str(e)}")
 
+def _excel_value(text):
+    """Cell value for extracted text: a number when it reads as one, else the text."""
+    if text is None:
+        return None
+    if _NUMBER.fullmatch(text):
+        return float(text.replace(',', ''))
+    return ILLEGAL_CHARACTERS_RE.sub('', text)
+
+def _excel_page_rows(index, page):
+    """
+    Worker task: lay a page out as sheet rows.
+    
+    Returns:
+        Tuple of (whether the page is mostly right-to-left, list of rows of cell values)
+    """
+    lines = group_lines(page_text_runs(page))
+    rows = []
+    previous = None
+    for block in group_blocks(lines):
+        # An empty row around each table
+        if previous is not None and 'table' in (previous, block.kind):
+            rows.append([])
+        if block.kind == 'table':
+            rows.extend([_excel_value(value) for value in row] for row in table_rows(block))
+        else:
+            rows.extend([_excel_value(line_text(line))] for line in block.lines)
+        previous = block.kind
+    return sum(line.rtl for line in lines) * 2 > len(lines), rows
+
+@cached_result('pdf_path')
 def pdf_to_excel(pdf_path, output_dir):
     """
     Convert a PDF file to an Excel document.
     
-    This is a simplified implementation. For production use,
-    consider a dedicated PDF-to-Excel conversion API.
+    Each page becomes a sheet. Lines whose text is aligned in columns are laid out
+    as tables, one cell per column (numbers as numeric cells); other lines go to
+    column A. Pages are laid out in parallel worker processes, and the workbook is
+    written in openpyxl's write-only mode, which streams rows to disk instead of
+    keeping cell objects, so memory use does not grow with the size of the document.
     
     Args:
         pdf_path: Path to the PDF file
@@ -138,21 +181,15 @@ def pdf_to_excel(pdf_path, output_dir):
         Path to the generated Excel document
     """
     try:
-        # Create a new Excel workbook
-        wb = Workbook()
-        ws = wb.active
-        
-        # Extract text from the PDF
-        reader = PdfReader(pdf_path)
+        wb = Workbook(write_only=True)
         
-        row = 1
-        for page in reader.pages:
-            text = page.extract_text()
-            lines = text.split('\n')
-            
-            for line in lines:
-                ws.cell(row=row, column=1, value=line)
-                row += 1
+        pages = map_pages(pdf_path, _excel_page_rows, LAYOUT_WORKERS, LAYOUT_PAGES_PER_TASK)
+        for index, (rtl, rows) in enumerate(pages):
+            ws = wb.create_sheet(f"صفحة {index + 1}")
+            if rtl:
+                ws.sheet_view.rightToLeft = True
+            for row in rows:
+                ws.append(row)
         
         output_path = os.path.join(output_dir, f"converted_to_excel_{uuid4().hex}.xlsx")
         wb.save(output_path)
@@ -163,40 +200,66 @@ def pdf_to_excel(pdf_path, output_dir):
         logger.error(f"Error converting PDF to Excel: {str(e)}")
         raise Exception(f"فشل في تحويل PDF إلى Excel: {str(e)}")
 
-def pdf_to_ppt(pdf_path, output_dir):
+def _encode_slide_image(quality, index, img):
+    """
+    Worker task: compress a rendered page for a slide.
+    
+    Pages with few colors (text, diagrams) are stored as palette PNGs, which keep
+    them sharp and small; photos and gradients as JPEGs.
+    
+    Returns:
+        Tuple of (encoded image bytes, (width, height) in pixels)
+    """
+    buffer = BytesIO()
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    colors = img.getcolors(maxcolors=PPT_PNG_MAX_COLORS)
+    if colors is not None:
+        if img.mode == 'RGB':
+            img = img.convert('P', palette=Image.ADAPTIVE, colors=len(colors))
+        img.save(buffer, 'PNG', optimize=True)
+    else:
+        img.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue(), img.size
+
+@cached_result('pdf_path')
+def pdf_to_ppt(pdf_path, output_dir, dpi=PPT_DPI, quality=PPT_JPEG_QUALITY):
     """
     Convert a PDF file to a PowerPoint presentation.
     
-    This is a simplified implementation. For production use,
-    consider a dedicated PDF-to-PowerPoint conversion API.
+    Each page becomes a slide showing the rendered page. Pages are rendered and
+    compressed in parallel worker processes, a few at a time, and the compressed
+    images go straight from memory into the presentation. The slides take the
+    aspect ratio of the first page; other pages are fitted and centered.
     
     Args:
         pdf_path: Path to the PDF file
         output_dir: Directory to save the result
+        dpi: Rendering resolution of the slide images
+        quality: JPEG quality (1-95) of pages stored as JPEG
         
     Returns:
         Path to the generated PowerPoint document
     """
     try:
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
         # Create a new PowerPoint presentation
         prs = Presentation()
+        blank_layout = prs.slide_layouts[6]
         
-        # Add each image as a slide
-        for img in images:
-            # Save image temporarily
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp:
-                img_path = temp.name
-                img.save(img_path, 'PNG')
+        for index, (data, (width, height)) in enumerate(
+            map_page_images(pdf_path, partial(_encode_slide_image, quality), dpi=dpi)
+        ):
+            if index == 0:
+                prs.slide_height = int(prs.slide_width * height / width)
             
-            # Add a slide with the image
-            slide = prs.slides.add_slide(prs.slide_layouts[6])  # Blank layout
-            slide.shapes.add_picture(img_path, 0, 0, prs.slide_width, prs.slide_height)
-            
-            # Clean up temp file
-            os.unlink(img_path)
+            # Fit the page into the slide, keeping its proportions
+            scale = min(prs.slide_width / width, prs.slide_height / height)
+            picture_width, picture_height = int(width * scale), int(height * scale)
+            slide = prs.slides.add_slide(blank_layout)
+            slide.shapes.add_picture(
+                BytesIO(data), (prs.slide_width - picture_width) // 2, (prs.slide_height - picture_height) // 2,
+                picture_width, picture_height
+            )
         
         output_path = os.path.join(output_dir, f"converted_to_ppt_{uuid4().hex}.pptx")
         prs.save(output_path)
@@ -207,6 +270,7 @@ def pdf_to_ppt(pdf_path, output_dir):
         logger.error(f"Error converting PDF to PowerPoint: {str(e)}")
         raise Exception(f"فشل في تحويل PDF إلى PowerPoint: {str(e)}")
 
+@cached_result('word_path')
 def word_to_pdf(word_path, output_dir):
     """
     Convert a Word document to PDF.
@@ -220,7 +284,7 @@ def word_to_pdf(word_path, output_dir):
     """
     try:
         output_path = os.path.join(output_dir, f"converted_from_word_{uuid4().hex}.pdf")
-        docx_to_pdf(word_path, output_path)
+        convert_to_pdf(word_path, output_path)
         
         return output_path
     
@@ -228,13 +292,11 @@ def word_to_pdf(word_path, output_dir):
         logger.error(f"Error converting Word to PDF: {str(e)}")
         raise Exception(f"فشل في تحويل Word إلى PDF: {str(e)}")
 
+@cached_result('excel_path')
 def excel_to_pdf(excel_path, output_dir):
     """
     Convert an Excel document to PDF.
     
-    This is a simplified implementation. For production use,
-    consider a dedicated Excel-to-PDF conversion API.
-    
     Args:
         excel_path: Path to the Excel document
         output_dir: Directory to save the result
@@ -243,23 +305,8 @@ def excel_to_pdf(excel_path, output_dir):
         Path to the generated PDF
     """
     try:
-        # This is a placeholder for actual Excel-to-PDF conversion
-        # In a real implementation, you would use a library like win32com.client on Windows
-        # or a cloud-based conversion API
-        
-        # For now, we'll just create a simple PDF with text about the Excel file
         output_path = os.path.join(output_dir, f"converted_from_excel_{uuid4().hex}.pdf")
-        
-        # Create a writer for the PDF
-        writer = PdfWriter()
-        
-        # Create a new page
-        from PyPDF2.generic import RectangleObject
-        page = writer.add_blank_page(width=612, height=792)
-        
-        # Add a note that this is a placeholder
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        convert_to_pdf(excel_path, output_path)
         
         return output_path
     
@@ -267,13 +314,11 @@ def excel_to_pdf(excel_path, output_dir):
         logger.error(f"Error converting Excel to PDF: {str(e)}")
         raise Exception(f"فشل في تحويل Excel إلى PDF: {str(e)}")
 
+@cached_result('ppt_path')
 def ppt_to_pdf(ppt_path, output_dir):
     """
     Convert a PowerPoint presentation to PDF.
     
-    This is a simplified implementation. For production use,
-    consider a dedicated PowerPoint-to-PDF conversion API.
-    
     Args:
         ppt_path: Path to the PowerPoint presentation
         output_dir: Directory to save the result
@@ -282,23 +327,8 @@ def ppt_to_pdf(ppt_path, output_dir):
         Path to the generated PDF
     """
     try:
-        # This is a placeholder for actual PowerPoint-to-PDF conversion
-        # In a real implementation, you would use a library like win32com.client on Windows
-        # or a cloud-based conversion API
-        
-        # For now, we'll just create a simple PDF with text about the PowerPoint file
         output_path = os.path.join(output_dir, f"converted_from_ppt_{uuid4().hex}.pdf")
-        
-        # Create a writer for the PDF
-        writer = PdfWriter()
-        
-        # Create a new page
-        from PyPDF2.generic import RectangleObject
-        page = writer.add_blank_page(width=612, height=792)
-        
-        # Write the PDF
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        convert_to_pdf(ppt_path, output_path)
         
         return output_path
     
@@ -2,21 +2,25 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 import os
 import re
-from PyPDF2 import PdfReader, PdfWriter
+from documents import get_page_count
 from utils import create_temp_dir, clean_temp_files
-from config import MAX_FILE_SIZE
+from config import MAX_FILE_SIZE, DELIVERY_ZIP_THRESHOLD
+
+def submit_job(update: Update, operation, input_paths, params=None):
+    """Queue heavy work (or the sending of a cached result) for the background workers and tell the user their place in line."""
+    from task_queue import get_task_queue
+    
+    _, position = get_task_queue().submit(
+        update.effective_user.id, update.effective_chat.id, operation, input_paths, params
+    )
+    # الموضع 0 يعني أن النتيجة كانت محفوظة مسبقاً وسيتم إرسالها دون تنفيذ العملية مرة أخرى
+    if position:
+        update.effective_message.reply_text(f'تمت إضافة طلبك إلى قائمة الانتظار. ترتيبك في القائمة: {position}')
 
 def start(update: Update, context: CallbackContext):
     """Send a message when the command /start is issued."""
-    # تتبع المستخدمين وإشعار المدير بالمستخدمين الجدد
-    from user_tracking import get_or_create_user, notify_admin_new_user
-    
-    user = update.effective_user
-    is_new_user = get_or_create_user(user)
-    
-    # إرسال إشعار للمدير إذا كان المستخدم جديد
-    if is_new_user:
-        notify_admin_new_user(context.bot, user)
+    # تسجيل المستخدم وإشعار المدير بالمستخدمين الجدد يتم في متتبع النشاط
+    # (user_tracking.record_activity) مع كل تحديث، وليس هنا
     
     keyboard = [
         [
@@ -94,113 +98,75 @@ def handle_document(update: Update, context: CallbackContext):
     
     # تحويل PDF إلى صور
     elif current_operation == 'pdf_to_images':
-        try:
-            from file_conversions import pdf_to_images
-            output_dir = create_temp_dir(user_id)
-            image_paths = pdf_to_images(file_path, output_dir)
-            
-            # إرسال جميع الصور بغض النظر عن عددها
-            update.message.reply_text(f'الملف يحتوي على {len(image_paths)} صفحة. جاري إرسال الصور...')
-            # نرسل كل الصور كملفات منفصلة
-            for i, img_path in enumerate(image_paths):
-                with open(img_path, 'rb') as img_file:
-                    update.message.reply_document(
-                        document=img_file,
-                        filename=f'page_{i+1}.png',
-                        caption=f'صفحة {i+1} من {len(image_paths)}'
-                    )
-            
-            update.message.reply_text('تم تحويل ملف PDF إلى صور بنجاح!')
-        except Exception as e:
-            update.message.reply_text(f'حدث خطأ أثناء تحويل PDF إلى صور: {str(e)}')
+        # نرسل الصور في مجموعات (أو في ملف مضغوط إذا كانت كثيرة) بعد انتهاء المعالجة في الخلفية
+        submit_job(update, 'pdf_to_images', [file_path], {'delivery': {
+            'kind': 'documents',
+            'filename': 'page_{n}.png',
+            'caption': 'صفحة {n} من {total}',
+            'intro': 'الملف يحتوي على {total} صفحة. جاري إرسال الصور...',
+            'outro': 'تم تحويل ملف PDF إلى صور بنجاح!',
+            'archive': 'pages.zip',
+            'archive_caption': 'صور الصفحات ({total} صورة)',
+            'error': 'حدث خطأ أثناء تحويل PDF إلى صور'
+        }})
     
     # تحويل PDF إلى Word
     elif current_operation == 'pdf_to_word':
-        try:
-            from file_conversions import pdf_to_word
-            output_dir = create_temp_dir(user_id)
-            output_path = pdf_to_word(file_path, output_dir)
-            
-            with open(output_path, 'rb') as doc_file:
-                update.message.reply_document(
-                    document=doc_file,
-                    filename=os.path.basename(output_path),
-                    caption='تم تحويل ملف PDF إلى Word بنجاح'
-                )
-        except Exception as e:
-            update.message.reply_text(f'حدث خطأ أثناء تحويل PDF إلى Word: {str(e)}')
+        submit_job(update, 'pdf_to_word', [file_path], {'delivery': {
+            'caption': 'تم تحويل ملف PDF إلى Word بنجاح',
+            'error': 'حدث خطأ أثناء تحويل PDF إلى Word'
+        }})
     
     # تحويل PDF إلى Excel
     elif current_operation == 'pdf_to_excel':
-        try:
-            from file_conversions import pdf_to_excel
-            output_dir = create_temp_dir(user_id)
-            output_path = pdf_to_excel(file_path, output_dir)
-            
-            with open(output_path, 'rb') as excel_file:
-                update.message.reply_document(
-                    document=excel_file,
-                    filename=os.path.basename(output_path),
-                    caption='تم تحويل ملف PDF إلى Excel بنجاح'
-                )
-        except Exception as e:
-            update.message.reply_text(f'حدث خطأ أثناء تحويل PDF إلى Excel: {str(e)}')
+        submit_job(update, 'pdf_to_excel', [file_path], {'delivery': {
+            'caption': 'تم تحويل ملف PDF إلى Excel بنجاح',
+            'error': 'حدث خطأ أثناء تحويل PDF إلى Excel'
+        }})
     
     # تحويل PDF إلى PowerPoint
     elif current_operation == 'pdf_to_ppt':
-        try:
-            from file_conversions import pdf_to_ppt
-            output_dir = create_temp_dir(user_id)
-            output_path = pdf_to_ppt(file_path, output_dir)
-            
-            with open(output_path, 'rb') as ppt_file:
-                update.message.reply_document(
-                    document=ppt_file,
-                    filename=os.path.basename(output_path),
-                    caption='تم تحويل ملف PDF إلى PowerPoint بنجاح'
-                )
-        except Exception as e:
-            update.message.reply_text(f'حدث خطأ أثناء تحويل PDF إلى PowerPoint: {str(e)}')
+        submit_job(update, 'pdf_to_ppt', [file_path], {'delivery': {
+            'caption': 'تم تحويل ملف PDF إلى PowerPoint بنجاح',
+            'error': 'حدث خطأ أثناء تحويل PDF إلى PowerPoint'
+        }})
     
     # تحويل Word إلى PDF
     elif current_operation == 'word_to_pdf':
-        try:
-            from file_conversions import word_to_pdf
-            output_dir = create_temp_dir(user_id)
-            output_path = word_to_pdf(file_path, output_dir)
-            
-            with open(output_path, 'rb') as pdf_file:
-                update.message.reply_document(
-                    document=pdf_file,
-                    filename=os.path.basename(output_path),
-                    caption='تم تحويل ملف Word إلى PDF بنجاح'
-                )
-        except Exception as e:
-            update.message.reply_text(f'حدث خطأ أثناء تحويل Word إلى PDF: {str(e)}')
+        submit_job(update, 'word_to_pdf', [file_path], {'delivery': {
+            'caption': 'تم تحويل ملف Word إلى PDF بنجاح',
+            'error': 'حدث خطأ أثناء تحويل Word إلى PDF'
+        }})
+    
+    # تحويل Excel إلى PDF
+    elif current_operation == 'excel_to_pdf':
+        submit_job(update, 'excel_to_pdf', [file_path], {'delivery': {
+            'caption': 'تم تحويل ملف Excel إلى PDF بنجاح',
+            'error': 'حدث خطأ أثناء تحويل Excel إلى PDF'
+        }})
+    
+    # تحويل PowerPoint إلى PDF
+    elif current_operation == 'ppt_to_pdf':
+        submit_job(update, 'ppt_to_pdf', [file_path], {'delivery': {
+            'caption': 'تم تحويل العرض التقديمي إلى PDF بنجاح',
+            'error': 'حدث خطأ أثناء تحويل PowerPoint إلى PDF'
+        }})
             
     # استخراج النص من PDF
     elif current_operation == 'extract_text':
-        try:
-            from content_extraction import extract_text
-            text = extract_text(file_path)
-            
-            # إذا كان النص طويلاً، نقسمه إلى أجزاء
-            if len(text) > 4000:
-                chunks = [text[i:i+4000] for i in range(0, len(text), 4000)]
-                for i, chunk in enumerate(chunks):
-                    update.message.reply_text(f'جزء {i+1} من {len(chunks)}:\n\n{chunk}')
-            else:
-                update.message.reply_text(f'النص المستخرج:\n\n{text}')
-        except Exception as e:
-            update.message.reply_text(f'حدث خطأ أثناء استخراج النص: {str(e)}')
+        # إذا كان النص طويلاً، يتم تقسيمه إلى أجزاء عند الإرسال
+        languages = context.user_data.get('ocr_languages')
+        submit_job(update, 'extract_text', [file_path], {'languages': languages, 'delivery': {
+            'kind': 'text',
+            'prefix': 'النص المستخرج:\n\n',
+            'error': 'حدث خطأ أثناء استخراج النص'
+        }})
             
     # حذف صفحات من PDF
     elif current_operation == 'delete_pages':
         try:
             # قراءة عدد صفحات الملف
-            with open(file_path, 'rb') as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                num_pages = len(pdf_reader.pages)
+            num_pages = get_page_count(file_path)
             
             update.message.reply_text(f'تم استلام ملف PDF مكون من {num_pages} صفحة')
             
@@ -222,9 +188,7 @@ def handle_document(update: Update, context: CallbackContext):
             
             if add_pages_step == 'original_pdf':
                 # قراءة عدد صفحات الملف الأصلي
-                with open(file_path, 'rb') as pdf_file:
-                    pdf_reader = PdfReader(pdf_file)
-                    num_pages = len(pdf_reader.pages)
+                num_pages = get_page_count(file_path)
                 
                 update.message.reply_text(f'تم استلام الملف الأصلي المكون من {num_pages} صفحة')
                 
@@ -244,13 +208,50 @@ def handle_document(update: Update, context: CallbackContext):
         except Exception as e:
             update.message.reply_text(f'حدث خطأ أثناء تحضير الملفات لإضافة الصفحات: {str(e)}')
     
+    # تحويل كل صفحة إلى ملف مستقل
+    elif current_operation == 'split_pages':
+        try:
+            num_pages = get_page_count(file_path)
+            
+            if num_pages > DELIVERY_ZIP_THRESHOLD:
+                # الصفحات الكثيرة تكتب مباشرة في ملف مضغوط واحد بدلاً من ملفات منفصلة
+                submit_job(update, 'split_pages', [file_path], {'archive': True, 'delivery': {
+                    'filename': 'pages.zip',
+                    'caption': f'صفحات الملف ({num_pages} ملف)',
+                    'error': 'حدث خطأ أثناء تقسيم الملف إلى صفحات'
+                }})
+            else:
+                submit_job(update, 'split_pages', [file_path], {'delivery': {
+                    'kind': 'documents',
+                    'filename': 'page_{n}.pdf',
+                    'caption': 'صفحة {n} من {total}',
+                    'error': 'حدث خطأ أثناء تقسيم الملف إلى صفحات'
+                }})
+        except Exception as e:
+            update.message.reply_text(f'حدث خطأ أثناء تحضير الملف للتقسيم: {str(e)}')
+    
+    # بدء سلسلة تعديلات على ملف واحد
+    elif current_operation == 'pipeline':
+        try:
+            from pipeline import DocumentPipeline
+            
+            # قراءة عدد صفحات الملف مرة واحدة فقط؛ التعديلات التالية تتم على نموذج الملف في الذاكرة
+            num_pages = get_page_count(file_path)
+            
+            context.user_data['pipeline'] = DocumentPipeline(file_path, num_pages)
+            update.message.reply_text(
+                f'تم استلام ملف PDF مكون من {num_pages} صفحة.\n'
+                'استخدم الأوامر /rotate و /delete_pages و /reorder و /add_numbers و /watermark '
+                'بالترتيب الذي تريده، ثم أرسل /done لاستلام الملف بعد كل التعديلات.'
+            )
+        except Exception as e:
+            update.message.reply_text(f'حدث خطأ أثناء تحضير الملف للتعديل: {str(e)}')
+    
     # تقسيم ملف PDF
     elif current_operation == 'split':
         try:
             # قراءة عدد صفحات الملف
-            with open(file_path, 'rb') as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                num_pages = len(pdf_reader.pages)
+            num_pages = get_page_count(file_path)
             
             update.message.reply_text(f'تم استلام ملف PDF مكون من {num_pages} صفحة')
             
@@ -322,8 +323,12 @@ def handle_text(update: Update, context: CallbackContext):
     """Handle text messages"""
     text = update.message.text
     
+    # إذا كان المستخدم ينفذ خطوة من سلسلة تعديلات
+    if context.user_data.get('pipeline_step') and _active_pipeline(context) is not None:
+        _handle_pipeline_text(update, context, text)
+    
     # إذا كان المستخدم في مرحلة انتظار موضع إضافة الصفحات
-    if context.user_data.get('add_pages_awaiting_position'):
+    elif context.user_data.get('add_pages_awaiting_position'):
         try:
             # التحقق من صحة الرقم المدخل
             if not text.isdigit():
@@ -348,19 +353,12 @@ def handle_text(update: Update, context: CallbackContext):
                 return
             
             # إضافة الصفحات في الموضع المحدد
-            from pdf_operations import add_pages_to_pdf
-            output_dir = create_temp_dir(update.effective_user.id)
-            
             update.message.reply_text(f'جاري إضافة الصفحات بعد الصفحة رقم {position}...')
-            output_path = add_pages_to_pdf(original_pdf, pages_pdf, output_dir, position=position)
-            
-            # إرسال الملف النهائي
-            with open(output_path, 'rb') as file:
-                update.message.reply_document(
-                    document=file,
-                    filename='document_with_added_image.pdf',
-                    caption=f'تم إضافة الصورة بعد الصفحة رقم {position} بنجاح'
-                )
+            submit_job(update, 'add_pages', [original_pdf, pages_pdf], {'position': position, 'delivery': {
+                'filename': 'document_with_added_image.pdf',
+                'caption': f'تم إضافة الصورة بعد الصفحة رقم {position} بنجاح',
+                'error': 'حدث خطأ أثناء إضافة الصفحات'
+            }})
             
             # تنظيف البيانات
             context.user_data.clear()
@@ -394,19 +392,12 @@ def handle_text(update: Update, context: CallbackContext):
             update.message.reply_text(f'تم استلام أرقام الصفحات: {valid_pages}. جاري حذف الصفحات...')
             
             # إجراء الحذف الفعلي
-            from pdf_operations import delete_pages
             file_path = context.user_data.get('delete_file')
-            output_dir = create_temp_dir(update.effective_user.id)
-            
-            result_file = delete_pages(file_path, valid_pages, output_dir)
-            
-            # إرسال الملف النهائي
-            with open(result_file, 'rb') as file:
-                update.message.reply_document(
-                    document=file,
-                    filename='document_with_deleted_pages.pdf',
-                    caption=f'تم حذف {len(valid_pages)} صفحة/صفحات بنجاح'
-                )
+            submit_job(update, 'delete_pages', [file_path], {'pages': valid_pages, 'delivery': {
+                'filename': 'document_with_deleted_pages.pdf',
+                'caption': f'تم حذف {len(valid_pages)} صفحة/صفحات بنجاح',
+                'error': 'حدث خطأ أثناء حذف الصفحات'
+            }})
             
             # تنظيف البيانات
             context.user_data.clear()
@@ -439,23 +430,17 @@ def handle_text(update: Update, context: CallbackContext):
             
             update.message.reply_text(f'تم استلام نقاط التقسيم: {valid_points}. جاري تقسيم الملف...')
             
-            # إجراء التقسيم الفعلي
-            from pdf_operations import split_pdf
+            # إجراء التقسيم الفعلي وإرسال الملفات المقسمة
             file_path = context.user_data.get('split_file')
-            output_dir = create_temp_dir(update.effective_user.id)
-            
-            result_files = split_pdf(file_path, valid_points, output_dir)
-            
-            # إرسال الملفات المقسمة
-            update.message.reply_text(f'تم تقسيم الملف إلى {len(result_files)} أجزاء. جاري إرسال الأجزاء...')
-            
-            for i, path in enumerate(result_files):
-                with open(path, 'rb') as file:
-                    update.message.reply_document(
-                        document=file,
-                        filename=f'part_{i+1}.pdf',
-                        caption=f'الجزء {i+1} من {len(result_files)}'
-                    )
+            submit_job(update, 'split', [file_path], {'split_points': valid_points, 'delivery': {
+                'kind': 'documents',
+                'filename': 'part_{n}.pdf',
+                'caption': 'الجزء {n} من {total}',
+                'intro': 'تم تقسيم الملف إلى {total} أجزاء. جاري إرسال الأجزاء...',
+                'archive': 'parts.zip',
+                'archive_caption': 'أجزاء الملف ({total} جزء)',
+                'error': 'حدث خطأ أثناء تقسيم الملف'
+            }})
             
             # تنظيف البيانات
             context.user_data.clear()
@@ -468,55 +453,143 @@ def handle_text(update: Update, context: CallbackContext):
     else:
         update.message.reply_text('لا أفهم هذه الرسالة. استخدم /help لمعرفة الأوامر المتاحة.')
 
+def _parse_page_numbers(text):
+    """Parse comma-separated page numbers such as "1,3,5", ignoring anything that is not a number."""
+    return [int(part.strip()) for part in text.split(',') if part.strip().isdigit()]
+
+def _handle_pipeline_text(update, context, text):
+    """Apply the edit the user was asked for to the in-memory document of the session."""
+    pipeline = context.user_data['pipeline']
+    step = context.user_data.pop('pipeline_step')
+    
+    try:
+        if step == 'rotate':
+            # الصيغة: الزاوية ثم أرقام الصفحات اختيارياً، مثل "90" أو "90 1,3"
+            parts = text.split(None, 1)
+            if not parts or parts[0] not in ('90', '180', '270'):
+                update.message.reply_text('الزاوية يجب أن تكون 90 أو 180 أو 270. أرسل /rotate للمحاولة مرة أخرى.')
+                return
+            pages = _parse_page_numbers(parts[1]) if len(parts) > 1 else 'all'
+            pipeline.rotate(int(parts[0]), pages or 'all')
+            done_text = 'تم تدوير الصفحات'
+        
+        elif step == 'delete_pages':
+            pages = _parse_page_numbers(text)
+            if not pages:
+                update.message.reply_text('لم يتم إدخال أرقام صفحات صالحة. أرسل /delete_pages للمحاولة مرة أخرى.')
+                return
+            pipeline.delete_pages(pages)
+            done_text = f'تم حذف {len(set(pages))} صفحة/صفحات'
+        
+        elif step == 'reorder':
+            pages = _parse_page_numbers(text)
+            if not pages:
+                update.message.reply_text('لم يتم إدخال أرقام صفحات صالحة. أرسل /reorder للمحاولة مرة أخرى.')
+                return
+            pipeline.reorder(pages)
+            done_text = 'تم ترتيب الصفحات'
+        
+        else:
+            pipeline.add_watermark(text.strip())
+            done_text = 'تمت إضافة العلامة المائية'
+    
+    except ValueError as e:
+        update.message.reply_text(str(e))
+        return
+    
+    update.message.reply_text(
+        f'✅ {done_text}. الملف الآن {len(pipeline)} صفحة.\n'
+        'يمكنك تنفيذ تعديل آخر أو إرسال /done لاستلام الملف.'
+    )
+
+def _active_pipeline(context):
+    """
+    Return the document of the user's /pipeline session, or None.
+    
+    A session left for another command (e.g. /pipeline then /merge) is no longer active.
+    """
+    if context.user_data.get('current_operation') != 'pipeline':
+        return None
+    return context.user_data.get('pipeline')
+
+def _start_pipeline_step(update, context, step, prompt):
+    """
+    Ask for the input of an edit when the user has an active /pipeline session.
+    
+    Returns:
+        True if the command was taken over by the session
+    """
+    if _active_pipeline(context) is None:
+        return False
+    
+    context.user_data['pipeline_step'] = step
+    update.message.reply_text(prompt)
+    return True
+
 def handle_done(update: Update, context: CallbackContext):
     """Handle completion of multi-file operations"""
     user_id = update.effective_user.id
     current_operation = context.user_data.get('current_operation')
+    # الملفات المؤقتة تحذف بعد انتهاء المهمة إذا تمت إضافتها إلى قائمة الانتظار
+    job_submitted = False
     
     if current_operation == 'merge' and 'merge_files' in context.user_data:
         merge_files = context.user_data['merge_files']
         if len(merge_files) > 1:
-            from pdf_operations import merge_pdfs
-            output_dir = create_temp_dir(user_id)
-            output_path = merge_pdfs(merge_files, output_dir)
-            
-            # إرسال الملف المدمج
-            with open(output_path, 'rb') as file:
-                update.message.reply_document(
-                    document=file,
-                    filename='merged_document.pdf',
-                    caption='تم دمج ملفات PDF بنجاح'
-                )
+            # دمج الملفات وإرسال الملف المدمج
+            submit_job(update, 'merge', merge_files, {'cleanup': True, 'delivery': {
+                'filename': 'merged_document.pdf',
+                'caption': 'تم دمج ملفات PDF بنجاح',
+                'error': 'حدث خطأ أثناء دمج الملفات'
+            }})
+            job_submitted = True
         else:
             update.message.reply_text('يجب إرسال ملفين على الأقل للدمج.')
     elif current_operation == 'photo_to_pdf' and 'photos' in context.user_data:
         photos = context.user_data['photos']
         if len(photos) > 0:
-            from file_conversions import photos_to_pdf
-            output_dir = create_temp_dir(user_id)
-            output_path = photos_to_pdf(photos, output_dir)
-            
-            # إرسال ملف PDF المنشأ من الصور
-            with open(output_path, 'rb') as file:
-                update.message.reply_document(
-                    document=file,
-                    filename='photos_to_pdf.pdf',
-                    caption='تم تحويل الصور إلى PDF بنجاح'
-                )
+            # تحويل الصور وإرسال ملف PDF المنشأ منها
+            submit_job(update, 'photo_to_pdf', photos, {'cleanup': True, 'delivery': {
+                'filename': 'photos_to_pdf.pdf',
+                'caption': 'تم تحويل الصور إلى PDF بنجاح',
+                'error': 'حدث خطأ أثناء تحويل الصور إلى PDF'
+            }})
+            job_submitted = True
         else:
             update.message.reply_text('لم يتم استلام أي صور للتحويل.')
+    elif current_operation == 'pipeline' and 'pipeline' in context.user_data:
+        pipeline = context.user_data['pipeline']
+        if pipeline.steps:
+            # حفظ الملف مرة واحدة بعد كل التعديلات وإرساله
+            model = pipeline.to_dict()
+            submit_job(update, 'pipeline', model['sources'], {'pages': model['pages'], 'cleanup': True, 'delivery': {
+                'filename': 'edited_document.pdf',
+                'caption': f'تم تنفيذ {pipeline.steps} تعديل/تعديلات على الملف بنجاح',
+                'error': 'حدث خطأ أثناء حفظ التعديلات'
+            }})
+            job_submitted = True
+        else:
+            update.message.reply_text('لم يتم تنفيذ أي تعديل على الملف.')
     else:
         update.message.reply_text('تم إكمال العملية!')
     
     # تنظيف البيانات والملفات المؤقتة
     context.user_data.clear()
-    clean_temp_files(user_id)
+    if not job_submitted:
+        _clean_temp_files_if_idle(user_id)
+
+def _clean_temp_files_if_idle(user_id):
+    """Clean up the user's temporary files unless queued jobs still need them."""
+    from task_queue import get_task_queue
+    
+    if get_task_queue().pending_count(user_id) == 0:
+        clean_temp_files(user_id)
 
 def cancel(update: Update, context: CallbackContext):
     """Cancel current operation"""
     context.user_data.clear()
     update.message.reply_text('تم إلغاء العملية الحالية')
-    clean_temp_files(update.effective_user.id)
+    _clean_temp_files_if_idle(update.effective_user.id)
 
 def button_callback(update: Update, context: CallbackContext):
     """Handle button presses"""
@@ -546,19 +619,12 @@ def button_callback(update: Update, context: CallbackContext):
                 return
             
             # إضافة الصفحات في بداية الملف
-            from pdf_operations import add_pages_to_pdf
-            output_dir = create_temp_dir(query.from_user.id)
-            
             query.message.reply_text('جاري إضافة الصفحات في بداية الملف...')
-            output_path = add_pages_to_pdf(original_pdf, pages_pdf, output_dir, position='start')
-            
-            # إرسال الملف النهائي
-            with open(output_path, 'rb') as file:
-                query.message.reply_document(
-                    document=file,
-                    filename='document_with_added_pages.pdf',
-                    caption='تم إضافة الصفحات في بداية الملف بنجاح'
-                )
+            submit_job(update, 'add_pages', [original_pdf, pages_pdf], {'position': 'start', 'delivery': {
+                'filename': 'document_with_added_pages.pdf',
+                'caption': 'تم إضافة الصفحات في بداية الملف بنجاح',
+                'error': 'حدث خطأ أثناء إضافة الصفحات'
+            }})
             
             # تنظيف البيانات
             context.user_data.clear()
@@ -579,19 +645,12 @@ def button_callback(update: Update, context: CallbackContext):
                 return
             
             # إضافة الصفحات في نهاية الملف
-            from pdf_operations import add_pages_to_pdf
-            output_dir = create_temp_dir(query.from_user.id)
-            
             query.message.reply_text('جاري إضافة الصفحات في نهاية الملف...')
-            output_path = add_pages_to_pdf(original_pdf, pages_pdf, output_dir, position='end')
-            
-            # إرسال الملف النهائي
-            with open(output_path, 'rb') as file:
-                query.message.reply_document(
-                    document=file,
-                    filename='document_with_added_pages.pdf',
-                    caption='تم إضافة الصفحات في نهاية الملف بنجاح'
-                )
+            submit_job(update, 'add_pages', [original_pdf, pages_pdf], {'position': 'end', 'delivery': {
+                'filename': 'document_with_added_pages.pdf',
+                'caption': 'تم إضافة الصفحات في نهاية الملف بنجاح',
+                'error': 'حدث خطأ أثناء إضافة الصفحات'
+            }})
             
             # تنظيف البيانات
             context.user_data.clear()
@@ -615,6 +674,7 @@ def button_callback(update: Update, context: CallbackContext):
             "`/delete_pages` \- حذف صفحات معينة من الملف\n"
             "`/reorder` \- إعادة ترتيب الصفحات يدويًا\n"
             "`/rotate` \- تدوير صفحة أو مجموعة صفحات وتغيير الزوايا\n"
+            "`/pipeline` \- تنفيذ عدة تعديلات على نفس الملف واستلامه مرة واحدة\n"
         )
         query.message.reply_text(help_text, parse_mode='MarkdownV2')
     
@@ -683,18 +743,34 @@ def add_pages_command(update: Update, context: CallbackContext):
     context.user_data['add_pages_step'] = 'original_pdf'
     update.message.reply_text('أرسل ملف PDF الأصلي الذي تريد إضافة صفحات إليه')
 
+def pipeline_command(update: Update, context: CallbackContext):
+    """Handler for running several edits on one PDF and sending the result once"""
+    context.user_data.clear()
+    context.user_data['current_operation'] = 'pipeline'
+    update.message.reply_text('أرسل ملف PDF لتنفيذ عدة تعديلات عليه. سيتم إرسال الملف مرة واحدة بعد كل التعديلات عند إرسال /done')
+
 def delete_pages_command(update: Update, context: CallbackContext):
     """Handler for deleting pages from PDF"""
+    if _start_pipeline_step(update, context, 'delete_pages', 'أدخل أرقام الصفحات التي تريد حذفها، مفصولة بفواصل (مثال: 1,3,5)'):
+        return
     context.user_data['current_operation'] = 'delete_pages'
     update.message.reply_text('أرسل ملف PDF لحذف صفحات منه')
 
 def reorder_command(update: Update, context: CallbackContext):
     """Handler for reordering pages in PDF"""
+    if _start_pipeline_step(update, context, 'reorder', 'أدخل أرقام الصفحات بالترتيب الجديد، مفصولة بفواصل (مثال: 3,1,2)'):
+        return
     context.user_data['current_operation'] = 'reorder'
     update.message.reply_text('أرسل ملف PDF لإعادة ترتيب صفحاته')
 
 def rotate_command(update: Update, context: CallbackContext):
     """Handler for rotating pages in PDF"""
+    if _start_pipeline_step(
+        update, context, 'rotate',
+        'أدخل زاوية التدوير (90 أو 180 أو 270)، ويمكنك إضافة أرقام الصفحات بعدها (مثال: 90 1,3). '
+        'بدون أرقام يتم تدوير كل الصفحات.'
+    ):
+        return
     context.user_data['current_operation'] = 'rotate'
     update.message.reply_text('أرسل ملف PDF لتدوير صفحاته')
 
@@ -747,7 +823,14 @@ def extract_images_command(update: Update, context: CallbackContext):
 
 def extract_text_command(update: Update, context: CallbackContext):
     """Handler for extracting text from PDF"""
+    # لغات التعرف الضوئي على الصفحات الممسوحة ضوئياً، مثال: /extract_text ara+eng
+    languages = context.args[0].lower() if context.args else None
+    if languages and not re.fullmatch(r'[a-z_]+(\+[a-z_]+)*', languages):
+        update.message.reply_text('صيغة اللغات غير صحيحة، مثال: /extract_text ara+eng')
+        return
+    
     context.user_data['current_operation'] = 'extract_text'
+    context.user_data['ocr_languages'] = languages
     update.message.reply_text('أرسل ملف PDF لاستخراج النص منه')
 
 # File editing
@@ -773,11 +856,19 @@ def add_link_command(update: Update, context: CallbackContext):
 
 def add_numbers_command(update: Update, context: CallbackContext):
     """Handler for adding page numbers to PDF"""
+    pipeline = _active_pipeline(context)
+    if pipeline is not None:
+        # لا يحتاج الترقيم إلى مدخلات، فيتم تطبيقه مباشرة على الملف في الذاكرة
+        pipeline.add_page_numbers()
+        update.message.reply_text('✅ تم ترقيم الصفحات. يمكنك تنفيذ تعديل آخر أو إرسال /done لاستلام الملف.')
+        return
     context.user_data['current_operation'] = 'add_numbers'
     update.message.reply_text('أرسل ملف PDF لإضافة أرقام الصفحات إليه')
 
 def watermark_command(update: Update, context: CallbackContext):
     """Handler for adding watermark to PDF"""
+    if _start_pipeline_step(update, context, 'watermark', 'أدخل نص العلامة المائية'):
+        return
     context.user_data['current_operation'] = 'watermark'
     update.message.reply_text('أرسل ملف PDF لإضافة علامة مائية إليه')
 
@@ -0,0 +1,143 @@
+import os
+import zlib
+import shutil
+from PIL import Image, ImageOps
+
+# EXIF orientations that are plain rotations, and the page rotation (clockwise) showing them upright
+EXIF_ROTATIONS = {1: 0, 3: 180, 6: 90, 8: 270}
+EXIF_ORIENTATION_TAG = 0x0112
+
+# JPEG color modes a PDF can show without decoding the image
+JPEG_COLOR_SPACES = {'L': '/DeviceGray', 'RGB': '/DeviceRGB', 'CMYK': '/DeviceCMYK'}
+
+# Bytes copied at a time from a JPEG file into the PDF
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class ImagePdfWriter:
+    """
+    Writes a PDF with one image per page, a page at a time.
+
+    Each image and its page are written to the file as soon as they are added,
+    so memory use does not depend on the number of images. JPEG files are copied
+    into the PDF as they are (DCTDecode), without decoding or re-compressing
+    them; other images, and images with transparency, are decoded and stored
+    losslessly (FlateDecode). Pages are the size of the image at 72 DPI.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        # Object number -> offset in the file; 1 is the catalog and 2 the page tree root
+        self._offsets = {}
+        self._next_number = 3
+        self._pages = []
+        self._file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def _new_number(self):
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def _write_object(self, number, body):
+        self._offsets[number] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1'))
+
+    def _write_stream(self, number, dictionary, data=None, source=None, length=None):
+        """Write a stream object from bytes, or by copying length bytes from an open file."""
+        if data is not None:
+            length = len(data)
+        self._offsets[number] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n<< {dictionary} /Length {length} >>\nstream\n".encode('latin-1'))
+        if data is not None:
+            self._file.write(data)
+        else:
+            shutil.copyfileobj(source, self._file, COPY_CHUNK_SIZE)
+        self._file.write(b"\nendstream\nendobj\n")
+
+    def add_image(self, path):
+        """Add an image file as a new page."""
+        with Image.open(path) as img:
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            if img.format == 'JPEG' and img.mode in JPEG_COLOR_SPACES and orientation in EXIF_ROTATIONS:
+                self._add_jpeg(path, img, EXIF_ROTATIONS[orientation])
+            else:
+                self._add_decoded(img)
+
+    def _add_jpeg(self, path, img, rotation):
+        width, height = img.size
+        dictionary = (
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {JPEG_COLOR_SPACES[img.mode]} /BitsPerComponent 8 /Filter /DCTDecode"
+        )
+        if img.mode == 'CMYK' and 'adobe' in img.info:
+            # Photoshop writes CMYK JPEGs with inverted values
+            dictionary += " /Decode [1 0 1 0 1 0 1 0]"
+
+        number = self._new_number()
+        with open(path, 'rb') as source:
+            self._write_stream(number, dictionary, source=source, length=os.path.getsize(path))
+        self._add_page(number, width, height, rotation)
+
+    def _add_decoded(self, img):
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+            # Transparent areas are shown on white paper
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, 'white')
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        elif img.mode in ('1', 'L', 'I', 'I;16', 'F'):
+            img = img.convert('L')
+        elif img.mode != 'CMYK':
+            img = img.convert('RGB')
+
+        color_space = JPEG_COLOR_SPACES[img.mode]
+        width, height = img.size
+        data = zlib.compress(img.tobytes(), 6)
+        number = self._new_number()
+        self._write_stream(
+            number,
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode",
+            data=data
+        )
+        del data
+        self._add_page(number, width, height, 0)
+
+    def _add_page(self, image_number, width, height, rotation):
+        content_number = self._new_number()
+        self._write_stream(content_number, '', data=f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode('latin-1'))
+
+        page_number = self._new_number()
+        self._write_object(
+            page_number,
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /XObject << /Im0 {image_number} 0 R >> >> "
+            f"/Contents {content_number} 0 R" + (f" /Rotate {rotation}" if rotation else "") + " >>"
+        )
+        self._pages.append(page_number)
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table, and close the file."""
+        if self._file.closed:
+            return
+        kids = ' '.join(f"{number} 0 R" for number in self._pages)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>")
+        self._write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self._file.tell()
+        lines = [f"xref\n0 {self._next_number}\n", "0000000000 65535 f\r\n"]
+        lines.extend(f"{self._offsets[number]:010d} 00000 n\r\n" for number in range(1, self._next_number))
+        lines.append(f"trailer\n<< /Size {self._next_number} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        self._file.write(''.join(lines).encode('latin-1'))
+        self._file.close()
@@ -1,8 +1,11 @@
 
-from flask import Flask
-from bot import create_bot
+from flask import Flask, request, abort
+from bot import create_bot, create_webhook_bot, feed_update, is_authentic_update
+from config import BOT_MODE, WEBHOOK_PATH
 import threading
 
+# Database tables are not created here (several workers may import this module);
+# create them once when deploying with: python models.py
 app = Flask(__name__)
 
 @app.route('/')
@@ -12,9 +15,23 @@ def home():
 def run_bot():
     bot = create_bot()
 
-# تشغيل البوت في thread منفصل
-bot_thread = threading.Thread(target=run_bot)
-bot_thread.start()
+if BOT_MODE == 'webhook':
+    # Telegram posts updates to this route; no getUpdates loop runs in this mode.
+    # Serve it with a single worker process (see BOT_MODE in config.py)
+    updater = create_webhook_bot()
+
+    @app.route(WEBHOOK_PATH, methods=['POST'])
+    def webhook():
+        if not is_authentic_update(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+            abort(403)
+        if not feed_update(updater, request.get_json(force=True)):
+            # Telegram retries updates that were not answered with a 2xx status
+            return 'Dispatcher not running', 503
+        return 'OK'
+else:
+    # تشغيل البوت في thread منفصل
+    bot_thread = threading.Thread(target=run_bot)
+    bot_thread.start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=3000)
@@ -1,5 +1,6 @@
 import logging
 from bot import create_bot
+from models import init_db
 
 # Configure logging
 logging.basicConfig(
@@ -10,6 +11,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 if __name__ == '__main__':
+    # Create missing database tables
+    init_db()
+    
     # Create and run the bot
     bot = create_bot()
     logger.info("Bot started successfully!")
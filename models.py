@@ -1,14 +1,52 @@
 import os
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, create_engine, inspect
+import threading
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
-engine = create_engine(DATABASE_URL)
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
+
+# المحرك يُنشأ عند أول استخدام وليس عند استيراد الملف، حتى يكون بدء التشغيل سريعاً
+_engine = None
+_engine_lock = threading.Lock()
+_session_factory = sessionmaker()
+
+def get_engine():
+    """
+    إرجاع محرك قاعدة البيانات المشترك، وإنشاؤه عند أول استدعاء
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                options = {
+                    # التحقق من الاتصال قبل استخدامه حتى لا تفشل الطلبات بسبب اتصالات أغلقها الخادم
+                    'pool_pre_ping': DB_POOL_PRE_PING,
+                    'pool_recycle': DB_POOL_RECYCLE,
+                }
+                # SQLite لا يستخدم مجمع اتصالات بحجم محدد
+                if make_url(DATABASE_URL).get_backend_name() != 'sqlite':
+                    options.update(
+                        pool_size=DB_POOL_SIZE,
+                        max_overflow=DB_MAX_OVERFLOW,
+                        pool_timeout=DB_POOL_TIMEOUT,
+                    )
+                engine = create_engine(DATABASE_URL, **options)
+                _session_factory.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+def Session():
+    """
+    فتح جلسة جديدة (مع إنشاء المحرك عند أول استخدام)
+    """
+    get_engine()
+    return _session_factory()
 
 class User(Base):
     __tablename__ = 'users'
@@ -26,8 +64,12 @@ class User(Base):
     def __repr__(self):
         return f"<User(id={self.user_id}, username={self.username})>"
 
-# فحص إذا كان الجدول موجود قبل محاولة إنشائه
-inspector = inspect(engine)
-if not inspector.has_table('users'):
-    # إنشاء الجداول في قاعدة البيانات
-    Base.metadata.create_all(engine)
\ No newline at end of file
+def init_db():
+    """
+    إنشاء الجداول غير الموجودة في قاعدة البيانات
+    (يتم استدعاؤها مرة واحدة عند بدء التشغيل، أو بتشغيل: python models.py)
+    """
+    Base.metadata.create_all(get_engine())
+
+if __name__ == '__main__':
+    init_db()
\ No newline at end of file
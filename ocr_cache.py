@@ -0,0 +1,163 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from config import OCR_CACHE_DB_PATH, OCR_CACHE_MAX_BYTES, OCR_CACHE_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks while another process OCRs the same page
+POLL_INTERVAL = 0.2
+
+STAT_NAMES = ('hits', 'misses', 'stores', 'evictions')
+
+def page_key(image, languages, dpi):
+    """
+    Build the cache key of a rendered page: an exact hash of its pixels, the languages and the DPI.
+
+    Args:
+        image: PIL image of the page
+        languages: Tesseract languages the page is read with
+        dpi: Resolution the page was rendered at
+
+    Returns:
+        Hex digest identifying the OCR result
+    """
+    sha = hashlib.sha256()
+    sha.update(f"{image.mode}:{image.width}x{image.height}:{languages}:{dpi}:".encode('utf-8'))
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+class OcrCache:
+    """
+    Persistent cache of OCR results, shared by the OCR worker processes.
+
+    A process about to OCR a page first claims its key. Other processes asking
+    for the same page meanwhile wait for the result instead of running tesseract
+    on it too, so identical pages (within a document or across documents) are
+    OCRed once. Least recently used entries are removed when the texts exceed
+    max_bytes. Hit/miss counters are stored with the entries so that the counts
+    of all worker processes add up.
+    """
+
+    def __init__(self, db_path=OCR_CACHE_DB_PATH, max_bytes=OCR_CACHE_MAX_BYTES, wait=OCR_CACHE_WAIT):
+        self.max_bytes = max_bytes
+        self.wait = wait
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # text is NULL while the page is being OCRed by the process that claimed it
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS ocr_results ('
+            'key TEXT PRIMARY KEY, '
+            'text TEXT, '
+            'size INTEGER NOT NULL DEFAULT 0, '
+            'last_used REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS ocr_results_last_used ON ocr_results (last_used)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS ocr_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _count(self, name, amount=1):
+        self._db.execute(
+            'INSERT INTO ocr_stats (name, value) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value',
+            (name, amount)
+        )
+
+    def claim(self, key):
+        """
+        Return the cached text of a page, or None after reserving the page for the caller.
+
+        A caller that gets None must OCR the page and then call put (or release if it fails).
+        A claim older than the wait time is considered abandoned and is taken over.
+        """
+        deadline = time.time() + self.wait
+        while True:
+            with self._lock:
+                now = time.time()
+                row = self._db.execute('SELECT text, last_used FROM ocr_results WHERE key = ?', (key,)).fetchone()
+                if row is not None and row[0] is not None:
+                    self._db.execute('UPDATE ocr_results SET last_used = ? WHERE key = ?', (now, key))
+                    self._count('hits')
+                    return row[0]
+
+                if row is None:
+                    claimed = self._db.execute(
+                        'INSERT OR IGNORE INTO ocr_results (key, text, last_used) VALUES (?, NULL, ?)', (key, now)
+                    ).rowcount
+                elif now >= deadline or now - row[1] > self.wait:
+                    claimed = self._db.execute(
+                        'UPDATE ocr_results SET last_used = ? WHERE key = ? AND text IS NULL AND last_used = ?',
+                        (now, key, row[1])
+                    ).rowcount
+                else:
+                    claimed = 0
+
+                if claimed:
+                    self._count('misses')
+                    return None
+            time.sleep(POLL_INTERVAL)
+
+    def put(self, key, text):
+        """Store the OCR result of a claimed page and evict old entries if the cache is full."""
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO ocr_results (key, text, size, last_used) VALUES (?, ?, ?, ?)',
+                (key, text, len(text.encode('utf-8')), time.time())
+            )
+            self._count('stores')
+            self._evict()
+
+    def release(self, key):
+        """Give up a claim without a result, so the next caller OCRs the page."""
+        with self._lock:
+            self._db.execute('DELETE FROM ocr_results WHERE key = ? AND text IS NULL', (key,))
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM ocr_results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        stale = []
+        for key, size in self._db.execute(
+            'SELECT key, size FROM ocr_results WHERE text IS NOT NULL ORDER BY last_used'
+        ):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._db.executemany('DELETE FROM ocr_results WHERE key = ?', stale)
+        self._count('evictions', len(stale))
+
+    def stats(self):
+        """Return the hit/miss counters of all processes, the hit rate, and the size of the cache."""
+        with self._lock:
+            stats = dict.fromkeys(STAT_NAMES, 0)
+            stats.update(self._db.execute('SELECT name, value FROM ocr_stats').fetchall())
+            stats['entries'], stats['bytes'] = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_results WHERE text IS NOT NULL'
+            ).fetchone()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+_ocr_cache = None
+_ocr_cache_pid = None
+_ocr_cache_lock = threading.Lock()
+
+def get_ocr_cache():
+    """Return the OCR cache of this process, opening it on first use."""
+    global _ocr_cache, _ocr_cache_pid
+    with _ocr_cache_lock:
+        # A worker process forked from a process that had the cache open needs its own connection
+        if _ocr_cache is None or _ocr_cache_pid != os.getpid():
+            _ocr_cache = OcrCache()
+            _ocr_cache_pid = os.getpid()
+        return _ocr_cache
+
+def get_ocr_cache_stats():
+    """Return the OCR cache statistics (see OcrCache.stats)."""
+    return get_ocr_cache().stats()
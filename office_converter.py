@@ -0,0 +1,304 @@
+import os
+import time
+import queue
+import atexit
+import shutil
+import signal
+import socket
+import logging
+import threading
+import subprocess
+from config import (
+    OFFICE_BINARY, OFFICE_WORKERS, OFFICE_MAX_JOBS, OFFICE_START_TIMEOUT,
+    OFFICE_CONVERT_TIMEOUT, OFFICE_PROFILE_DIR, UNOSERVER_BINARY, UNOCONVERT_BINARY
+)
+
+# LibreOffice's Python-UNO bridge (python3-uno); usually only importable by the system
+# Python, or with LibreOffice's program directory on PYTHONPATH
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    UNO_AVAILABLE = True
+except ImportError:
+    UNO_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# PDF export filter for each kind of office document
+PDF_FILTERS = {
+    '.doc': 'writer_pdf_Export', '.docx': 'writer_pdf_Export', '.odt': 'writer_pdf_Export',
+    '.rtf': 'writer_pdf_Export', '.txt': 'writer_pdf_Export',
+    '.xls': 'calc_pdf_Export', '.xlsx': 'calc_pdf_Export', '.ods': 'calc_pdf_Export', '.csv': 'calc_pdf_Export',
+    '.ppt': 'impress_pdf_Export', '.pptx': 'impress_pdf_Export', '.odp': 'impress_pdf_Export',
+}
+
+def _properties(**values):
+    result = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        result.append(prop)
+    return tuple(result)
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _port_open(port):
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+def converter_mode():
+    """
+    How office documents are converted on this host.
+
+    Returns:
+        'uno' when LibreOffice's Python bridge can be imported (instances are driven
+        directly), 'unoserver' when the unoserver/unoconvert commands are installed
+        (each instance runs behind a unoserver listener), or None when neither is
+        available and no instance can be kept running
+    """
+    if UNO_AVAILABLE:
+        return 'uno'
+    if shutil.which(UNOSERVER_BINARY) and shutil.which(UNOCONVERT_BINARY):
+        return 'unoserver'
+    return None
+
+class OfficeWorker:
+    """
+    One headless LibreOffice instance with a profile of its own, kept running between conversions.
+
+    In 'uno' mode the instance listens on a local socket and documents are loaded
+    and exported through the UNO bridge. In 'unoserver' mode a unoserver process
+    owns the instance and each conversion is a unoconvert call to it, a small
+    client that starts in a fraction of LibreOffice's startup time. Either way a
+    conversion costs no LibreOffice startup.
+    """
+
+    def __init__(self, index, mode):
+        self.index = index
+        self.mode = mode
+        self.profile_dir = os.path.join(OFFICE_PROFILE_DIR, f"worker_{index}")
+        self.process = None
+        self.desktop = None
+        self.port = None
+        # Conversions done by the running instance
+        self.jobs = 0
+
+    def _base_command(self):
+        return [
+            OFFICE_BINARY, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+            '--nolockcheck', f"-env:UserInstallation=file://{os.path.abspath(self.profile_dir)}",
+        ]
+
+    def start(self):
+        """Start the instance and wait until it accepts conversions."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self.mode == 'uno':
+            self._start_uno()
+        else:
+            self._start_unoserver()
+        self.jobs = 0
+        logger.info(f"Office worker {self.index} started ({self.mode}, pid {self.process.pid}, port {self.port})")
+
+    def _start_uno(self):
+        self.port = _free_port()
+        connection = f"socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+        self.process = subprocess.Popen(
+            self._base_command() + [f"--accept={connection}"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context
+        )
+        deadline = time.time() + OFFICE_START_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(f"uno:{connection}")
+                break
+            except Exception:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError("LibreOffice did not start")
+                time.sleep(0.25)
+
+        self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+
+    def _start_unoserver(self):
+        self.port = _free_port()
+        self.process = subprocess.Popen(
+            [
+                UNOSERVER_BINARY, '--interface', '127.0.0.1', '--port', str(self.port),
+                '--uno-port', str(_free_port()), '--executable', shutil.which(OFFICE_BINARY) or OFFICE_BINARY,
+                '--user-installation', os.path.abspath(self.profile_dir),
+            ],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+        # unoserver opens its port once LibreOffice is up and connected
+        deadline = time.time() + OFFICE_START_TIMEOUT
+        while not _port_open(self.port):
+            if self.process.poll() is not None or time.time() > deadline:
+                self.stop()
+                raise RuntimeError("unoserver did not start")
+            time.sleep(0.25)
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def convert(self, source_path, output_path, pdf_filter):
+        """Convert a document to PDF, starting the instance first if needed."""
+        if not self.running():
+            self.start()
+
+        if self.mode == 'uno':
+            self._convert_with_uno(source_path, output_path, pdf_filter)
+        else:
+            self._convert_with_unoserver(source_path, output_path, pdf_filter)
+        self.jobs += 1
+
+    def _convert_with_uno(self, source_path, output_path, pdf_filter):
+        # A document that hangs LibreOffice gets the instance killed; the UNO call then fails
+        watchdog = threading.Timer(OFFICE_CONVERT_TIMEOUT, self.process.kill)
+        watchdog.start()
+        try:
+            document = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(os.path.abspath(source_path)), '_blank', 0,
+                _properties(Hidden=True, ReadOnly=True)
+            )
+            if document is None:
+                raise RuntimeError("LibreOffice could not open the document")
+            try:
+                document.storeToURL(
+                    uno.systemPathToFileUrl(os.path.abspath(output_path)), _properties(FilterName=pdf_filter)
+                )
+            finally:
+                document.close(True)
+        finally:
+            watchdog.cancel()
+
+    def _convert_with_unoserver(self, source_path, output_path, pdf_filter):
+        # A timeout fails the conversion, and the pool then restarts the hung instance
+        result = subprocess.run(
+            [
+                UNOCONVERT_BINARY, '--host', '127.0.0.1', '--port', str(self.port),
+                '--convert-to', 'pdf', '--filter', pdf_filter,
+                os.path.abspath(source_path), os.path.abspath(output_path),
+            ],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            timeout=OFFICE_CONVERT_TIMEOUT
+        )
+        if result.returncode:
+            logger.warning(f"unoconvert failed: {result.stderr.decode(errors='replace').strip()}")
+            raise RuntimeError(f"unoconvert exited with status {result.returncode}")
+        if not os.path.exists(output_path):
+            raise RuntimeError("LibreOffice did not produce a PDF")
+
+    def stop(self):
+        """Stop the instance (it is started again by the next conversion)."""
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            if self.mode == 'unoserver' and self.process.poll() is None:
+                # Stops unoserver and the LibreOffice it started (same session)
+                try:
+                    os.killpg(self.process.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except OSError:
+                    self.process.kill()
+                self.process.wait()
+            self.process = None
+        self.jobs = 0
+
+class OfficePool:
+    """
+    Pool of LibreOffice workers shared by the conversion jobs.
+
+    A conversion waits for an idle worker. A worker is restarted after
+    max_jobs conversions (LibreOffice's memory use grows over time) and after a
+    failed conversion, in case the instance crashed or was killed.
+    """
+
+    def __init__(self, mode, workers=OFFICE_WORKERS, max_jobs=OFFICE_MAX_JOBS):
+        self.mode = mode
+        self.max_jobs = max_jobs
+        self._workers = [OfficeWorker(i, mode) for i in range(workers)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def convert(self, source_path, output_path):
+        """
+        Convert an office document (Word, Excel, PowerPoint, OpenDocument...) to PDF.
+
+        Args:
+            source_path: Path to the document
+            output_path: Path of the PDF to write
+        """
+        pdf_filter = PDF_FILTERS.get(os.path.splitext(source_path)[1].lower())
+        if pdf_filter is None:
+            raise ValueError("نوع الملف غير مدعوم للتحويل إلى PDF")
+        if self.mode is None:
+            raise RuntimeError("تحويل مستندات Office غير متاح حالياً على الخادم")
+
+        worker = self._idle.get()
+        try:
+            worker.convert(source_path, output_path, pdf_filter)
+        except Exception:
+            worker.stop()
+            raise
+        finally:
+            if worker.jobs >= self.max_jobs:
+                worker.stop()
+            self._idle.put(worker)
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+
+_office_pool = None
+_office_pool_lock = threading.Lock()
+
+def get_office_pool():
+    """Return the shared office worker pool; its instances are stopped at exit."""
+    global _office_pool
+    with _office_pool_lock:
+        if _office_pool is None:
+            mode = converter_mode()
+            if mode is None:
+                logger.error(
+                    "Office to PDF conversion is disabled: install LibreOffice's Python bridge "
+                    f"(python3-uno) or unoserver ({UNOSERVER_BINARY}/{UNOCONVERT_BINARY} on PATH)"
+                )
+            else:
+                logger.info(f"Office to PDF conversion uses {OFFICE_WORKERS} warm LibreOffice instances ({mode})")
+            _office_pool = OfficePool(mode)
+            atexit.register(_office_pool.close)
+        return _office_pool
+
+def start_office_converter():
+    """Check at startup how office documents can be converted, and log it (instances start on first use)."""
+    get_office_pool()
+
+def convert_to_pdf(source_path, output_path):
+    """Convert an office document to PDF with the shared worker pool."""
+    get_office_pool().convert(source_path, output_path)
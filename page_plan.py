@@ -0,0 +1,663 @@
+import io
+import os
+import re
+import shutil
+import logging
+import zipfile
+from collections import namedtuple, deque
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject,
+    NullObject, NumberObject, StreamObject
+)
+
+from documents import open_document
+from config import SPLIT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# A run of pages copied, in order, from one of the source documents.
+# source is an index into the list of sources (0 is the document being edited),
+# pages a range, list or slice of 0-based page indices in that source (a slice is
+# taken from all the pages of the source, e.g. slice(3, None)), and rotate the
+# degrees added to each page's rotation: one number for the whole run, or a
+# dict {page index: degrees} for some of its pages.
+PageRun = namedtuple('PageRun', ['source', 'pages', 'rotate'], defaults=[0])
+
+# Page attributes a page inherits from its ancestors in the page tree
+INHERITABLE_ATTRIBUTES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+# Bytes at the end of the file searched for the startxref keyword
+TAIL_SIZE = 2048
+
+# Fixed timestamp of archive members (as in delivery.build_archive), so equal parts give equal archives
+ARCHIVE_DATE = (1980, 1, 1, 0, 0, 0)
+
+class _NotIncremental(Exception):
+    """Raised when a document cannot be edited with an incremental update."""
+
+
+def _run_angle(run, index):
+    if isinstance(run.rotate, dict):
+        return run.rotate.get(index, 0)
+    return run.rotate
+
+
+def resolve_plan(plan, page_counts):
+    """
+    Validate a page plan and flatten it.
+
+    Args:
+        plan: List of PageRun
+        page_counts: Number of pages of each source
+
+    Returns:
+        List of (source, page index, degrees) tuples in output order
+    """
+    entries = []
+    for run in plan:
+        count = page_counts[run.source]
+        indices = range(count)[run.pages] if isinstance(run.pages, slice) else run.pages
+        for index in indices:
+            if index < 0 or index >= count:
+                raise ValueError(f"رقم الصفحة {index + 1} خارج النطاق. الملف يحتوي على {count} صفحة فقط.")
+            entries.append((run.source, index, _run_angle(run, index) % 360))
+    return entries
+
+
+def _walk_page_tree(reader):
+    """
+    List the pages of a document without flattening it in the reader.
+
+    Returns:
+        Tuple of (reference of the root /Pages node, list of (page reference,
+        parent reference, attributes inherited from the ancestors))
+    """
+    root_ref = reader.trailer['/Root'].get_object().raw_get('/Pages')
+    if not isinstance(root_ref, IndirectObject):
+        raise _NotIncremental("page tree root is not an indirect object")
+
+    pages = []
+    # Depth-first, keeping document order; each node carries its own copy of the inherited attributes
+    stack = [(root_ref, None, {})]
+    while stack:
+        ref, parent, inherited = stack.pop()
+        if not isinstance(ref, IndirectObject):
+            raise _NotIncremental("page tree node is not an indirect object")
+        node = ref.get_object()
+        if node.get('/Type') == '/Pages' or '/Kids' in node:
+            inherited = dict(inherited)
+            for attr in INHERITABLE_ATTRIBUTES:
+                if attr in node:
+                    inherited[attr] = node.raw_get(attr)
+            for kid in reversed(node['/Kids']):
+                stack.append((kid, ref, inherited))
+        else:
+            pages.append((ref, parent, inherited))
+    return root_ref, pages
+
+
+def _find_startxref(path):
+    """
+    Return (offset, kind) of the last cross-reference section, kind being 'table' or 'stream'.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - TAIL_SIZE))
+        tail = f.read()
+        matches = re.findall(rb'startxref\s+(\d+)\s+%%EOF', tail)
+        if not matches:
+            raise _NotIncremental("startxref not found")
+        offset = int(matches[-1])
+        f.seek(offset)
+        head = f.read(32)
+
+    if head.startswith(b'xref'):
+        return offset, 'table'
+    if re.match(rb'\d+\s+\d+\s+obj', head):
+        return offset, 'stream'
+    raise _NotIncremental("startxref does not point to a cross-reference section")
+
+
+class _ObjectImporter:
+    """
+    Copies objects from another document into the update, giving them new object numbers.
+
+    Each source object is copied once however many pages use it, so shared fonts and
+    images are not duplicated. Pages that are not being inserted (e.g. link targets)
+    are replaced by null instead of pulling in the rest of their document.
+    """
+
+    def __init__(self, next_number):
+        self.next_number = next_number
+        self.mapping = {}
+        self.queue = deque()
+
+    def register(self, source, ref):
+        """Reserve a new object number for a source object (used for the inserted pages)."""
+        key = (source, ref.idnum, ref.generation)
+        if key not in self.mapping:
+            self.mapping[key] = IndirectObject(self.next_number, 0, None)
+            self.next_number += 1
+        return self.mapping[key]
+
+    def reference(self, source, ref):
+        key = (source, ref.idnum, ref.generation)
+        if key in self.mapping:
+            return self.mapping[key]
+        target = ref.get_object()
+        if isinstance(target, DictionaryObject) and target.get('/Type') in ('/Page', '/Pages'):
+            return NullObject()
+        new_ref = self.register(source, ref)
+        self.queue.append((source, ref, new_ref))
+        return new_ref
+
+    def copy(self, source, obj):
+        """Return a copy of a direct object with its references translated."""
+        if isinstance(obj, IndirectObject):
+            return self.reference(source, obj)
+        if isinstance(obj, StreamObject):
+            stream = obj.__class__()
+            stream._data = obj._data
+            for key, value in obj.items():
+                if key != '/Length':
+                    stream[key] = self.copy(source, value)
+            return stream
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject((key, self.copy(source, value)) for key, value in obj.items())
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.copy(source, value) for value in obj)
+        return obj
+
+    def drain(self):
+        """Copy every object reachable from what was copied so far. Yields (number, object)."""
+        while self.queue:
+            source, ref, new_ref = self.queue.popleft()
+            yield new_ref.idnum, self.copy(source, ref.get_object())
+
+
+def _write_object(f, number, generation, obj):
+    offset = f.tell()
+    f.write(f"{number} {generation} obj\n".encode('ascii'))
+    obj.write_to_stream(f, None)
+    f.write(b"\nendobj\n")
+    return offset
+
+
+def _subsections(numbers):
+    """Group sorted object numbers into runs of consecutive numbers."""
+    runs = []
+    for number in numbers:
+        if runs and number == runs[-1][0] + runs[-1][1]:
+            runs[-1][1] += 1
+        else:
+            runs.append([number, 1])
+    return runs
+
+
+def _trailer_entries(trailer, size, prev):
+    entries = DictionaryObject({
+        NameObject('/Size'): NumberObject(size),
+        NameObject('/Root'): trailer.raw_get('/Root'),
+        NameObject('/Prev'): NumberObject(prev),
+    })
+    for key in ('/Info', '/ID'):
+        if key in trailer:
+            entries[NameObject(key)] = trailer.raw_get(key)
+    return entries
+
+
+def _object_count(reader):
+    """Return the /Size of a document (PyPDF2 drops it from the trailer of xref-stream files)."""
+    if '/Size' in reader.trailer:
+        return int(reader.trailer['/Size'])
+    numbers = [num for table in reader.xref.values() for num in table]
+    numbers.extend(reader.xref_objStm)
+    return max(numbers, default=0) + 1
+
+def _write_incremental(base_path, readers, plan, output_path):
+    """
+    Write the plan as an incremental update appended to a copy of the base document.
+
+    Only the page tree root, the pages whose attributes or parent change and the
+    objects of pages inserted from other documents are written; everything else
+    stays byte-for-byte in the original part of the file.
+    """
+    base = readers[0]
+    if any(reader.is_encrypted for reader in readers):
+        raise _NotIncremental("encrypted document")
+    if '/XRefStm' in base.trailer:
+        raise _NotIncremental("hybrid cross-reference file")
+
+    prev_offset, xref_kind = _find_startxref(base_path)
+    trees = [_walk_page_tree(reader) for reader in readers]
+    root_ref, _ = trees[0]
+    entries = resolve_plan(plan, [len(pages) for _, pages in trees])
+    if len(set((source, index) for source, index, _ in entries)) != len(entries):
+        raise _NotIncremental("a page is used more than once")
+
+    root = root_ref.get_object()
+    importer = _ObjectImporter(_object_count(base))
+    updated = {}
+    kids = ArrayObject()
+
+    # Reserve numbers for all inserted pages first, so references between them (e.g. annotation /P) resolve
+    for source, index, _ in entries:
+        if source != 0:
+            importer.register(source, trees[source][1][index][0])
+
+    for source, index, angle in entries:
+        ref, parent, inherited = trees[source][1][index]
+
+        if source == 0:
+            same_parent = parent.idnum == root_ref.idnum and parent.generation == root_ref.generation
+            if same_parent and not angle:
+                kids.append(ref)
+                continue
+            page = DictionaryObject(ref.get_object())
+            if not same_parent:
+                for attr, value in inherited.items():
+                    if attr not in page:
+                        page[NameObject(attr)] = value
+            number, generation = ref.idnum, ref.generation
+        else:
+            new_ref = importer.register(source, ref)
+            original = DictionaryObject(ref.get_object())
+            for attr, value in inherited.items():
+                if attr not in original:
+                    original[NameObject(attr)] = value
+            original.pop('/Parent', None)
+            page = importer.copy(source, original)
+            # Do not let the new parent's inheritable attributes apply to a foreign page
+            if '/Rotate' in root and '/Rotate' not in page:
+                page[NameObject('/Rotate')] = NumberObject(0)
+            if '/Resources' in root and '/Resources' not in page:
+                page[NameObject('/Resources')] = DictionaryObject()
+            if '/CropBox' in root and '/CropBox' not in page and '/MediaBox' in page:
+                page[NameObject('/CropBox')] = page['/MediaBox']
+            number, generation, ref = new_ref.idnum, 0, new_ref
+
+        page[NameObject('/Parent')] = root_ref
+        if angle:
+            # A page without its own /Rotate shows the rotation inherited from the page tree
+            rotation = page['/Rotate'] if '/Rotate' in page else inherited.get('/Rotate', NumberObject(0)).get_object()
+            page[NameObject('/Rotate')] = NumberObject((int(rotation) + angle) % 360)
+        updated[number] = (generation, page)
+        kids.append(ref)
+
+    new_root = DictionaryObject(root)
+    new_root[NameObject('/Kids')] = kids
+    new_root[NameObject('/Count')] = NumberObject(len(kids))
+    updated[root_ref.idnum] = (root_ref.generation, new_root)
+
+    for number, obj in importer.drain():
+        updated[number] = (0, obj)
+
+    shutil.copyfile(base_path, output_path)
+    with open(output_path, 'ab') as f:
+        f.write(b"\n")
+        offsets = {number: _write_object(f, number, generation, obj)
+                   for number, (generation, obj) in sorted(updated.items())}
+
+        if xref_kind == 'table':
+            xref_offset = f.tell()
+            # Entry 0 (head of the free list) first, as readers expect every section to start at 0
+            f.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+            for start, count in _subsections(sorted(offsets)):
+                f.write(f"{start} {count}\n".encode('ascii'))
+                for number in range(start, start + count):
+                    f.write(f"{offsets[number]:010d} {updated[number][0]:05d} n\r\n".encode('ascii'))
+            f.write(b"trailer\n")
+            _trailer_entries(base.trailer, importer.next_number, prev_offset).write_to_stream(f, None)
+        else:
+            # The original uses a cross-reference stream, so the update must use one too
+            xref_number = importer.next_number
+            xref_offset = f.tell()
+            offsets[xref_number] = xref_offset
+            updated[xref_number] = (0, None)
+            width = max(4, (xref_offset.bit_length() + 7) // 8)
+            rows = [b'\x00' + bytes(width) + b'\xff\xff']
+            index = ArrayObject([NumberObject(0), NumberObject(1)])
+            for start, count in _subsections(sorted(offsets)):
+                index.extend([NumberObject(start), NumberObject(count)])
+                for number in range(start, start + count):
+                    rows.append(b'\x01' + offsets[number].to_bytes(width, 'big') +
+                                updated[number][0].to_bytes(2, 'big'))
+            xref = DecodedStreamObject()
+            xref.set_data(b''.join(rows))
+            xref.update(_trailer_entries(base.trailer, xref_number + 1, prev_offset))
+            xref[NameObject('/Type')] = NameObject('/XRef')
+            xref[NameObject('/W')] = ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)])
+            xref[NameObject('/Index')] = index
+            _write_object(f, xref_number, 0, xref)
+
+        f.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+
+    return output_path
+
+
+def _write_full(readers, entries, output_path):
+    """Write the plan as a new document in a single pass over the selected pages."""
+    writer = PdfWriter()
+    # PdfWriter copies each source object once, so resources shared by several pages are written once
+    for source, index, angle in entries:
+        page = writer.add_page(readers[source].pages[index])
+        if angle:
+            page.rotate(angle)
+
+    with open(output_path, "wb") as output_file:
+        writer.write(output_file)
+    return output_path
+
+
+def _open_sources(stack, sources):
+    """Return a reader for each source, opening file paths through the shared document handles."""
+    return [s if isinstance(s, PdfReader) else stack.enter_context(open_document(s)) for s in sources]
+
+
+def apply_page_plan(sources, plan, output_path, incremental=True):
+    """
+    Build a PDF from a declarative page plan.
+
+    When incremental is True and the first source is a file path, the result is the
+    original file with an incremental update appended: only the page tree and the
+    changed or inserted pages are written, so the time taken depends on the change
+    rather than on the size of the document. Otherwise (or if the document does not
+    allow it, e.g. it is encrypted or uses a page twice) a new file is written.
+
+    Args:
+        sources: List of PDF paths or PdfReader objects; source 0 is the document being edited
+        plan: List of PageRun describing the output pages in order
+        output_path: Path to write the result to
+        incremental: Whether an incremental update may be used
+
+    Returns:
+        Path to the resulting PDF
+    """
+    with ExitStack() as stack:
+        readers = _open_sources(stack, sources)
+
+        if incremental and not isinstance(sources[0], PdfReader):
+            try:
+                return _write_incremental(sources[0], readers, plan, output_path)
+            except _NotIncremental as e:
+                logger.info(f"Rewriting {os.path.basename(output_path)} instead of updating it: {str(e)}")
+
+        entries = resolve_plan(plan, [len(reader.pages) for reader in readers])
+        return _write_full(readers, entries, output_path)
+
+
+def _direct_references(obj):
+    """Return the indirect references found in a direct object (a stream's /Length excluded)."""
+    refs = []
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            refs.append(item)
+        elif isinstance(item, DictionaryObject):
+            for key, value in item.items():
+                if not (key == '/Length' and isinstance(item, StreamObject)):
+                    stack.append(value)
+        elif isinstance(item, ArrayObject):
+            stack.extend(item)
+    return refs
+
+
+def _serialize(obj):
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+class _SharedObject:
+    """An object of the source document, serialized once for all the parts that use it."""
+
+    __slots__ = ('generation', 'obj', 'data', 'children', 'is_page')
+
+    def __init__(self, ref, obj, data, children, is_page):
+        self.generation = ref.generation
+        self.obj = obj
+        # None when the object refers to pages, which only some parts contain
+        self.data = data
+        self.children = children
+        self.is_page = is_page
+
+
+class _PartSplitter:
+    """
+    Builds documents made of some pages of one source document.
+
+    Objects keep their object numbers from the source, so an object referenced by
+    several parts (fonts, images, shared content) is identical in all of them: it is
+    read and serialized once and its bytes are reused for every part. Only page
+    dictionaries, the page tree root and the catalog are written per part.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.root_ref, self.page_list = _walk_page_tree(reader)
+        self.size = _object_count(reader)
+        self.header = reader.pdf_header.encode('latin-1') if isinstance(reader.pdf_header, str) else reader.pdf_header
+        self._objects = {}
+        info = reader.trailer.raw_get('/Info') if '/Info' in reader.trailer else None
+        self.info_ref = info if isinstance(info, IndirectObject) else None
+
+    def _load(self, ref):
+        """Read an object and register it, without serializing it yet."""
+        obj = ref.get_object()
+        if obj is None:
+            obj = NullObject()
+        is_page = isinstance(obj, DictionaryObject) and (obj.get('/Type') in ('/Page', '/Pages') or '/Kids' in obj)
+        children = [] if is_page else _direct_references(obj)
+        shared = self._objects[ref.idnum] = _SharedObject(ref, obj, None, children, is_page)
+        return shared
+
+    def _shared(self, ref):
+        shared = self._objects.get(ref.idnum)
+        if shared is not None:
+            return shared
+
+        # Depth-first with an explicit stack: chains of references (e.g. /Next of outline items)
+        # can be longer than the recursion limit. An object is serialized after its children
+        # have been read, once it is known whether it refers to pages
+        first = self._load(ref)
+        stack = [first]
+        while stack:
+            shared = stack[-1]
+            unread = False
+            for child in shared.children:
+                if child.idnum not in self._objects:
+                    stack.append(self._load(child))
+                    unread = True
+            if unread:
+                continue
+            stack.pop()
+            if not shared.is_page and not any(self._objects[child.idnum].is_page for child in shared.children):
+                shared.data = _serialize(shared.obj)
+        return first
+
+    def _without_other_pages(self, obj, kept):
+        """Copy an object, replacing references to pages outside the part with null."""
+        if isinstance(obj, IndirectObject):
+            if self._shared(obj).is_page and obj.idnum not in kept:
+                return NullObject()
+            return obj
+        if isinstance(obj, StreamObject):
+            stream = obj.__class__()
+            stream._data = obj._data
+            for key, value in obj.items():
+                if key != '/Length':
+                    stream[key] = self._without_other_pages(value, kept)
+            return stream
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject((key, self._without_other_pages(value, kept)) for key, value in obj.items())
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._without_other_pages(value, kept) for value in obj)
+        return obj
+
+    def part_objects(self, indices):
+        """
+        Return the objects of the part made of the given page indices.
+
+        Returns:
+            List of (object number, generation, serialized object) sorted by number
+        """
+        catalog_number, pages_number = self.size, self.size + 1
+        pages_ref = IndirectObject(pages_number, 0, None)
+        page_refs = [self.page_list[i][0] for i in indices]
+        kept = {ref.idnum for ref in page_refs}
+        objects = {}
+        stack = []
+
+        for ref, _, inherited in (self.page_list[i] for i in indices):
+            node = ref.get_object()
+            page = DictionaryObject((NameObject(key), value) for key, value in inherited.items())
+            page.update((key, node.raw_get(key)) for key in node if key != '/Parent')
+            page = self._without_other_pages(page, kept)
+            stack.extend(_direct_references(page))
+            page[NameObject('/Parent')] = pages_ref
+            objects[ref.idnum] = (ref.generation, _serialize(page))
+
+        if self.info_ref is not None:
+            stack.append(self.info_ref)
+
+        while stack:
+            ref = stack.pop()
+            if ref.idnum in objects:
+                continue
+            shared = self._shared(ref)
+            if shared.is_page:
+                continue
+            data = shared.data
+            if data is None:
+                data = _serialize(self._without_other_pages(shared.obj, kept))
+            objects[ref.idnum] = (shared.generation, data)
+            stack.extend(shared.children)
+
+        objects[pages_number] = (0, _serialize(DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(page_refs),
+            NameObject('/Count'): NumberObject(len(page_refs)),
+        })))
+        objects[catalog_number] = (0, _serialize(DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): pages_ref,
+        })))
+        return [(number,) + objects[number] for number in sorted(objects)]
+
+    def write_part(self, f, objects):
+        """Write a part returned by part_objects as a complete PDF file."""
+        f.write(self.header + b"\n%\xe2\xe3\xcf\xd3\n")
+        offsets = {}
+        for number, generation, data in objects:
+            offsets[number] = (f.tell(), generation)
+            f.write(f"{number} {generation} obj\n".encode('ascii'))
+            f.write(data)
+            f.write(b"\nendobj\n")
+
+        xref_offset = f.tell()
+        f.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+        for start, count in _subsections(sorted(offsets)):
+            f.write(f"{start} {count}\n".encode('ascii'))
+            for number in range(start, start + count):
+                offset, generation = offsets[number]
+                f.write(f"{offset:010d} {generation:05d} n\r\n".encode('ascii'))
+
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(self.size + 2),
+            NameObject('/Root'): IndirectObject(self.size, 0, None),
+        })
+        if self.info_ref is not None:
+            trailer[NameObject('/Info')] = self.info_ref
+        f.write(b"trailer\n")
+        trailer.write_to_stream(f, None)
+        f.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+
+    def part_bytes(self, objects):
+        buffer = io.BytesIO()
+        self.write_part(buffer, objects)
+        return buffer.getvalue()
+
+
+def _write_part_file(write, output_path):
+    with open(output_path, "wb") as output_file:
+        write(output_file)
+    return output_path
+
+
+def _part_bytes(write):
+    buffer = io.BytesIO()
+    write(buffer)
+    return buffer.getvalue()
+
+
+def _add_archive_member(archive, name, data):
+    info = zipfile.ZipInfo(name, date_time=ARCHIVE_DATE)
+    info.external_attr = 0o644 << 16
+    info.compress_type = zipfile.ZIP_DEFLATED
+    archive.writestr(info, data)
+
+
+def split_into_parts(source, groups, output_paths=None, archive_path=None, names=None, workers=SPLIT_WORKERS):
+    """
+    Write several documents, each made of some pages of one source document.
+
+    The source is parsed once and every object shared between parts is serialized
+    once; the parts are then assembled and written by a pool of threads, so the
+    work left per part is mostly writing bytes. With archive_path the parts are
+    streamed straight into one ZIP archive instead of separate files.
+
+    Args:
+        source: Path of the PDF file or an open PdfReader
+        groups: List of page index lists (0-based), one per part
+        output_paths: Paths of the parts (when writing separate files)
+        archive_path: Path of the ZIP archive to write the parts into
+        names: Names of the parts inside the archive
+        workers: Number of threads writing parts
+
+    Returns:
+        output_paths, or archive_path when the parts are archived
+    """
+    with ExitStack() as stack:
+        reader, = _open_sources(stack, [source])
+        for group in groups:
+            resolve_plan([PageRun(0, group)], [len(reader.pages)])
+
+        try:
+            if reader.is_encrypted:
+                raise _NotIncremental("encrypted document")
+            splitter = _PartSplitter(reader)
+        except _NotIncremental as e:
+            logger.info(f"Splitting with a full rewrite of each part: {str(e)}")
+            splitter = None
+
+        def prepare(group):
+            # Everything that reads the source runs in this thread; the pool only assembles and writes bytes
+            if splitter is None:
+                writer = PdfWriter()
+                for index in group:
+                    writer.add_page(reader.pages[index])
+                return writer.write
+            objects = splitter.part_objects(group)
+            return lambda f: splitter.write_part(f, objects)
+
+        workers = max(1, int(workers))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            if archive_path is None:
+                futures = [pool.submit(_write_part_file, prepare(group), path) for group, path in zip(groups, output_paths)]
+                return [future.result() for future in futures]
+
+            # Members are added in order as they are ready, holding at most a few parts in memory
+            with zipfile.ZipFile(archive_path, 'w') as archive:
+                pending = deque()
+                for name, group in zip(names, groups):
+                    pending.append((name, pool.submit(_part_bytes, prepare(group))))
+                    if len(pending) > 2 * workers:
+                        name, future = pending.popleft()
+                        _add_archive_member(archive, name, future.result())
+                for name, future in pending:
+                    _add_archive_member(archive, name, future.result())
+            return archive_path
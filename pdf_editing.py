@@ -4,25 +4,94 @@ from uuid import uuid4
 from PyPDF2 import PdfReader, PdfWriter
 from PIL import Image, ImageDraw, ImageFont
 import io
+from functools import lru_cache, partial
+from pdf_overlay import TextStamp, can_render_text, stamp_pdf
+from page_plan import split_into_parts
+from documents import get_page_count
+from rasterizer import map_page_images
+from result_cache import cached_result
 
 logger = logging.getLogger(__name__)
 
-def add_text_to_pdf(pdf_path, text, output_dir, page_num=0, position=(100, 100), font_size=12, color=(0, 0, 0)):
+def _page_image_to_pdf(transform, index, img):
+    """Apply a transform to a rendered page image and encode the result as a one-page PDF."""
+    img_byte_arr = io.BytesIO()
+    transform(index, img).save(img_byte_arr, format='PDF')
+    return img_byte_arr.getvalue()
+
+def _render_pages_to_pdf(pdf_path, transform, output_path):
+    """
+    Rasterize every page of a PDF, transform the page images and write them to a new PDF.
+    
+    Pages are rendered and transformed in parallel worker processes and reassembled
+    in their original order.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        transform: Picklable callable (page_index, PIL image) -> PIL image
+        output_path: Path to write the result to
+        
+    Returns:
+        Path to the resulting PDF
+    """
+    writer = PdfWriter()
+    
+    for page_bytes in map_page_images(pdf_path, partial(_page_image_to_pdf, transform)):
+        writer.add_page(PdfReader(io.BytesIO(page_bytes)).pages[0])
+    
+    with open(output_path, "wb") as output_file:
+        writer.write(output_file)
+    
+    return output_path
+
+@cached_result('pdf_path')
+def add_text_to_pdf(pdf_path, text, output_dir, page_num=0, position=(100, 100), font_size=12, color=(0, 0, 0),
+                    raster=False):
     """
     Add text to a PDF.
     
+    The text is drawn as a vector overlay on top of the original page. Text that the
+    built-in font cannot draw (e.g. Arabic) falls back to the raster renderer.
+    
     Args:
         pdf_path: Path to the PDF file
         text: Text to add
         output_dir: Directory to save the result
         page_num: Page number to add text to (0-based)
-        position: Position (x, y) to place the text
+        position: Position (x, y) to place the text, measured from the top-left corner
+            (points in vector mode, pixels in raster mode)
         font_size: Font size
         color: RGB color tuple
+        raster: Render the page to an image and draw on it instead of using an overlay
         
     Returns:
         Path to the modified PDF
     """
+    if raster or not can_render_text(text):
+        return _add_text_to_pdf_raster(pdf_path, text, output_dir, page_num, position, font_size, color)
+    
+    try:
+        reader = PdfReader(pdf_path)
+        
+        # Check valid page number
+        if page_num < 0 or page_num >= len(reader.pages):
+            page_num = 0  # Default to first page if invalid
+        
+        def stamps_for_page(i, width, height):
+            if i != page_num:
+                return None
+            x, y = position
+            return [TextStamp(text, x, height - y - font_size, font_size, color)]
+        
+        output_path = os.path.join(output_dir, f"text_added_{uuid4().hex}.pdf")
+        return stamp_pdf(reader, output_path, stamps_for_page)
+    
+    except Exception as e:
+        logger.error(f"Error adding text to PDF: {str(e)}")
+        raise Exception(f"فشل في إضافة النص إلى PDF: {str(e)}")
+
+def _add_text_to_pdf_raster(pdf_path, text, output_dir, page_num, position, font_size, color):
+    """Add text to a PDF by rendering the target page to an image."""
     try:
         # Using pdf2image to convert the page to an image
         from pdf2image import convert_from_path
@@ -77,6 +146,7 @@ def add_text_to_pdf(pdf_path, text, output_dir, page_num=0, position=(100, 100),
         logger.error(f"Error adding text to PDF: {str(e)}")
         raise Exception(f"فشل في إضافة النص إلى PDF: {str(e)}")
 
+@cached_result('pdf_path', 'image_path')
 def add_image_to_pdf(pdf_path, image_path, output_dir, page_num=0, position=(100, 100), size=(200, 200)):
     """
     Add an image to a PDF.
@@ -140,6 +210,7 @@ def add_image_to_pdf(pdf_path, image_path, output_dir, page_num=0, position=(100
         logger.error(f"Error adding image to PDF: {str(e)}")
         raise Exception(f"فشل في إضافة الصورة إلى PDF: {str(e)}")
 
+@cached_result('pdf_path')
 def add_note_to_pdf(pdf_path, note_text, output_dir, page_num=0, position=(100, 100)):
     """
     Add a note to a PDF.
@@ -191,6 +262,7 @@ def add_note_to_pdf(pdf_path, note_text, output_dir, page_num=0, position=(100,
         logger.error(f"Error adding note to PDF: {str(e)}")
         raise Exception(f"فشل في إضافة ملاحظة إلى PDF: {str(e)}")
 
+@cached_result('pdf_path')
 def add_link_to_pdf(pdf_path, link_data, output_dir):
     """
     Add a link to a PDF.
@@ -248,7 +320,25 @@ def add_link_to_pdf(pdf_path, link_data, output_dir):
         logger.error(f"Error adding link to PDF: {str(e)}")
         raise Exception(f"فشل في إضافة رابط إلى PDF: {str(e)}")
 
-def add_page_numbers(pdf_path, output_dir, position='bottom'):
+# Page number position mapping: (width, height, page index) -> (x, y) from the bottom-left corner
+PAGE_NUMBER_POSITIONS = {
+    'bottom': lambda w, h, i: (w // 2, 30),
+    'top': lambda w, h, i: (w // 2, h - 30),
+    'bottom-right': lambda w, h, i: (w - 50, 30),
+    'bottom-left': lambda w, h, i: (50, 30),
+    'top-right': lambda w, h, i: (w - 50, h - 30),
+    'top-left': lambda w, h, i: (50, h - 30)
+}
+
+def page_number_stamp(position, index, width, height):
+    """Build the overlay stamp numbering the page at index on a page of the given displayed size."""
+    # Default to bottom if position not recognized
+    pos_func = PAGE_NUMBER_POSITIONS.get(position, PAGE_NUMBER_POSITIONS['bottom'])
+    x, y = pos_func(width, height, index)
+    return TextStamp(str(index + 1), x, y, 14, align='center')
+
+@cached_result('pdf_path')
+def add_page_numbers(pdf_path, output_dir, position='bottom', raster=False):
     """
     Add page numbers to a PDF.
     
@@ -256,137 +346,149 @@ def add_page_numbers(pdf_path, output_dir, position='bottom'):
         pdf_path: Path to the PDF file
         output_dir: Directory to save the result
         position: Position of page numbers ('bottom', 'top', 'bottom-right', etc.)
+        raster: Render every page to an image and draw on it instead of using an overlay
         
     Returns:
         Path to the modified PDF
     """
+    if raster:
+        return _add_page_numbers_raster(pdf_path, output_dir, position)
+    
     try:
-        # Using pdf2image to convert pages to images
-        from pdf2image import convert_from_path
-        
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
-        # Position mapping
-        positions = {
-            'bottom': lambda w, h, i: (w // 2, 30),
-            'top': lambda w, h, i: (w // 2, h - 30),
-            'bottom-right': lambda w, h, i: (w - 50, 30),
-            'bottom-left': lambda w, h, i: (50, 30),
-            'top-right': lambda w, h, i: (w - 50, h - 30),
-            'top-left': lambda w, h, i: (50, h - 30)
-        }
-        
-        # Default to bottom if position not recognized
-        pos_func = positions.get(position, positions['bottom'])
-        
-        # Add page numbers to each image
-        for i, img in enumerate(images):
-            width, height = img.size
-            draw = ImageDraw.Draw(img)
-            
-            try:
-                font = ImageFont.truetype("arial.ttf", 14)
-            except IOError:
-                font = ImageFont.load_default()
-            
-            # Get position for this page
-            pos = pos_func(width, height, i)
-            
-            # Draw page number
-            draw.text(pos, str(i + 1), font=font, fill=(0, 0, 0))
-            
-            # Convert image to PDF
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PDF')
-            img_byte_arr.seek(0)
-            
-            # Add to writer
-            page_reader = PdfReader(img_byte_arr)
-            writer.add_page(page_reader.pages[0])
+        def stamps_for_page(i, width, height):
+            return [page_number_stamp(position, i, width, height)]
         
         output_path = os.path.join(output_dir, f"numbered_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
-        
-        return output_path
+        return stamp_pdf(pdf_path, output_path, stamps_for_page)
     
     except Exception as e:
         logger.error(f"Error adding page numbers to PDF: {str(e)}")
         raise Exception(f"فشل في إضافة أرقام الصفحات إلى PDF: {str(e)}")
 
-def add_watermark(pdf_path, watermark_text, output_dir, opacity=0.3):
+def _number_page_image(position, index, img):
+    """Draw the page number on a rendered page image."""
+    width, height = img.size
+    draw = ImageDraw.Draw(img)
+    
+    try:
+        font = ImageFont.truetype("arial.ttf", 14)
+    except IOError:
+        font = ImageFont.load_default()
+    
+    # Get position for this page (default to bottom if position not recognized)
+    pos_func = PAGE_NUMBER_POSITIONS.get(position, PAGE_NUMBER_POSITIONS['bottom'])
+    pos = pos_func(width, height, index)
+    
+    # Draw page number
+    draw.text(pos, str(index + 1), font=font, fill=(0, 0, 0))
+    return img
+
+def _add_page_numbers_raster(pdf_path, output_dir, position):
+    """Add page numbers to a PDF by rendering every page to an image."""
+    try:
+        output_path = os.path.join(output_dir, f"numbered_{uuid4().hex}.pdf")
+        return _render_pages_to_pdf(pdf_path, partial(_number_page_image, position), output_path)
+    
+    except Exception as e:
+        logger.error(f"Error adding page numbers to PDF: {str(e)}")
+        raise Exception(f"فشل في إضافة أرقام الصفحات إلى PDF: {str(e)}")
+
+def watermark_stamp(watermark_text, opacity, width, height):
+    """Build the overlay stamp of a watermark centered on a page of the given displayed size."""
+    font_size = 40
+    y = (height - font_size) / 2
+    return TextStamp(watermark_text, width / 2, y, font_size, opacity=opacity, align='center')
+
+@cached_result('pdf_path')
+def add_watermark(pdf_path, watermark_text, output_dir, opacity=0.3, raster=False):
     """
     Add a watermark to a PDF.
     
+    The watermark is drawn as a vector overlay on top of the original pages. Text that the
+    built-in font cannot draw (e.g. Arabic) falls back to the raster renderer.
+    
     Args:
         pdf_path: Path to the PDF file
         watermark_text: Text for the watermark
         output_dir: Directory to save the result
         opacity: Opacity of the watermark (0-1)
+        raster: Render every page to an image and draw on it instead of using an overlay
         
     Returns:
         Path to the modified PDF
     """
+    if raster or not can_render_text(watermark_text):
+        return _add_watermark_raster(pdf_path, watermark_text, output_dir, opacity)
+    
     try:
-        # Using pdf2image to convert pages to images
-        from pdf2image import convert_from_path
-        
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
-        for img in images:
-            # Create a transparent layer for the watermark
-            watermark = Image.new('RGBA', img.size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(watermark)
-            
-            try:
-                # Use a larger font for the watermark
-                font = ImageFont.truetype("arial.ttf", 40)
-            except IOError:
-                font = ImageFont.load_default()
-            
-            # Get text size
-            text_width, text_height = draw.textsize(watermark_text, font=font)
-            
-            # Calculate position to place the text in the center
-            x = (img.width - text_width) // 2
-            y = (img.height - text_height) // 2
-            
-            # Draw the watermark text
-            draw.text((x, y), watermark_text, font=font, fill=(0, 0, 0, int(255 * opacity)))
-            
-            # Apply the watermark to the image
-            img = Image.alpha_composite(img.convert('RGBA'), watermark)
-            img = img.convert('RGB')  # Convert back to RGB for PDF
-            
-            # Convert image to PDF
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PDF')
-            img_byte_arr.seek(0)
-            
-            # Add to writer
-            page_reader = PdfReader(img_byte_arr)
-            writer.add_page(page_reader.pages[0])
+        def stamps_for_page(i, width, height):
+            return [watermark_stamp(watermark_text, opacity, width, height)]
         
         output_path = os.path.join(output_dir, f"watermarked_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
-        
-        return output_path
+        return stamp_pdf(pdf_path, output_path, stamps_for_page)
+    
+    except Exception as e:
+        logger.error(f"Error adding watermark to PDF: {str(e)}")
+        raise Exception(f"فشل في إضافة علامة مائية إلى PDF: {str(e)}")
+
+def _watermark_page_image(watermark_text, opacity, index, img):
+    """Draw a centered watermark on a rendered page image."""
+    # Create a transparent layer for the watermark
+    watermark = Image.new('RGBA', img.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(watermark)
+    
+    try:
+        # Use a larger font for the watermark
+        font = ImageFont.truetype("arial.ttf", 40)
+    except IOError:
+        font = ImageFont.load_default()
+    
+    # Get text size
+    left, top, right, bottom = draw.textbbox((0, 0), watermark_text, font=font)
+    text_width, text_height = right - left, bottom - top
+    
+    # Calculate position to place the text in the center
+    x = (img.width - text_width) // 2
+    y = (img.height - text_height) // 2
+    
+    # Draw the watermark text
+    draw.text((x, y), watermark_text, font=font, fill=(0, 0, 0, int(255 * opacity)))
+    
+    # Apply the watermark to the image
+    img = Image.alpha_composite(img.convert('RGBA'), watermark)
+    return img.convert('RGB')  # Convert back to RGB for PDF
+
+def _add_watermark_raster(pdf_path, watermark_text, output_dir, opacity):
+    """Add a watermark to a PDF by rendering every page to an image."""
+    try:
+        output_path = os.path.join(output_dir, f"watermarked_{uuid4().hex}.pdf")
+        transform = partial(_watermark_page_image, watermark_text, opacity)
+        return _render_pages_to_pdf(pdf_path, transform, output_path)
     
     except Exception as e:
         logger.error(f"Error adding watermark to PDF: {str(e)}")
         raise Exception(f"فشل في إضافة علامة مائية إلى PDF: {str(e)}")
 
+@lru_cache(maxsize=4)
+def _load_background(background_path, size):
+    """Open a background image resized to a page size (cached per worker process)."""
+    with Image.open(background_path) as background:
+        return background.resize(size)
+
+def _background_page_image(background_path, index, img):
+    """Put a background image behind a rendered page image."""
+    # Resize background to match page size
+    bg = _load_background(background_path, img.size)
+    
+    # Create a new image with the background
+    new_img = Image.new('RGB', img.size)
+    new_img.paste(bg)
+    
+    # Paste the PDF content on top
+    new_img.paste(img, mask=img)
+    return new_img
+
+@cached_result('pdf_path', 'background_path')
 def change_background(pdf_path, background_path, output_dir):
     """
     Change the background of a PDF.
@@ -400,49 +502,18 @@ def change_background(pdf_path, background_path, output_dir):
         Path to the modified PDF
     """
     try:
-        # Using pdf2image to convert pages to images
-        from pdf2image import convert_from_path
-        
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
-        # Open background image
-        background = Image.open(background_path)
-        
-        for img in images:
-            # Resize background to match page size
-            bg = background.resize(img.size)
-            
-            # Create a new image with the background
-            new_img = Image.new('RGB', img.size)
-            new_img.paste(bg)
-            
-            # Paste the PDF content on top
-            new_img.paste(img, mask=img)
-            
-            # Convert image to PDF
-            img_byte_arr = io.BytesIO()
-            new_img.save(img_byte_arr, format='PDF')
-            img_byte_arr.seek(0)
-            
-            # Add to writer
-            page_reader = PdfReader(img_byte_arr)
-            writer.add_page(page_reader.pages[0])
-        
         output_path = os.path.join(output_dir, f"background_changed_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
-        
-        return output_path
+        return _render_pages_to_pdf(pdf_path, partial(_background_page_image, background_path), output_path)
     
     except Exception as e:
         logger.error(f"Error changing background of PDF: {str(e)}")
         raise Exception(f"فشل في تغيير خلفية PDF: {str(e)}")
 
+def _resize_page_image(size, index, img):
+    """Resize a rendered page image."""
+    return img.resize(size)
+
+@cached_result('pdf_path')
 def resize_pdf_pages(pdf_path, size, output_dir):
     """
     Resize pages in a PDF.
@@ -456,38 +527,18 @@ def resize_pdf_pages(pdf_path, size, output_dir):
         Path to the modified PDF
     """
     try:
-        # Using pdf2image to convert pages to images
-        from pdf2image import convert_from_path
-        
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
-        writer = PdfWriter()
-        
-        for img in images:
-            # Resize the image
-            resized_img = img.resize(size)
-            
-            # Convert image to PDF
-            img_byte_arr = io.BytesIO()
-            resized_img.save(img_byte_arr, format='PDF')
-            img_byte_arr.seek(0)
-            
-            # Add to writer
-            page_reader = PdfReader(img_byte_arr)
-            writer.add_page(page_reader.pages[0])
-        
         output_path = os.path.join(output_dir, f"resized_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
-        
-        return output_path
+        return _render_pages_to_pdf(pdf_path, partial(_resize_page_image, tuple(size)), output_path)
     
     except Exception as e:
         logger.error(f"Error resizing PDF pages: {str(e)}")
         raise Exception(f"فشل في تغيير حجم صفحات PDF: {str(e)}")
 
+def _rotate_page_image(index, img):
+    """Rotate a rendered page image by 90 degrees to change its orientation."""
+    return img.transpose(Image.ROTATE_90)
+
+@cached_result('pdf_path')
 def change_page_orientation(pdf_path, output_dir):
     """
     Change page orientation in a PDF (portrait <-> landscape).
@@ -500,38 +551,18 @@ def change_page_orientation(pdf_path, output_dir):
         Path to the modified PDF
     """
     try:
-        # Using pdf2image to convert pages to images
-        from pdf2image import convert_from_path
-        
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
-        writer = PdfWriter()
-        
-        for img in images:
-            # Rotate image by 90 degrees to change orientation
-            rotated_img = img.transpose(Image.ROTATE_90)
-            
-            # Convert image to PDF
-            img_byte_arr = io.BytesIO()
-            rotated_img.save(img_byte_arr, format='PDF')
-            img_byte_arr.seek(0)
-            
-            # Add to writer
-            page_reader = PdfReader(img_byte_arr)
-            writer.add_page(page_reader.pages[0])
-        
         output_path = os.path.join(output_dir, f"orientation_changed_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
-        
-        return output_path
+        return _render_pages_to_pdf(pdf_path, _rotate_page_image, output_path)
     
     except Exception as e:
         logger.error(f"Error changing page orientation: {str(e)}")
         raise Exception(f"فشل في تغيير اتجاه الصفحات: {str(e)}")
 
+def _crop_page_image(crop_box, index, img):
+    """Crop a rendered page image."""
+    return img.crop(crop_box)
+
+@cached_result('pdf_path')
 def crop_pages(pdf_path, crop_box, output_dir):
     """
     Crop pages in a PDF.
@@ -545,70 +576,46 @@ def crop_pages(pdf_path, crop_box, output_dir):
         Path to the modified PDF
     """
     try:
-        # Using pdf2image to convert pages to images
-        from pdf2image import convert_from_path
-        
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
-        writer = PdfWriter()
-        
-        for img in images:
-            # Crop the image
-            cropped_img = img.crop(crop_box)
-            
-            # Convert image to PDF
-            img_byte_arr = io.BytesIO()
-            cropped_img.save(img_byte_arr, format='PDF')
-            img_byte_arr.seek(0)
-            
-            # Add to writer
-            page_reader = PdfReader(img_byte_arr)
-            writer.add_page(page_reader.pages[0])
-        
         output_path = os.path.join(output_dir, f"cropped_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
-        
-        return output_path
+        return _render_pages_to_pdf(pdf_path, partial(_crop_page_image, tuple(crop_box)), output_path)
     
     except Exception as e:
         logger.error(f"Error cropping PDF pages: {str(e)}")
         raise Exception(f"فشل في قص صفحات PDF: {str(e)}")
 
-def split_pages_to_files(pdf_path, output_dir):
+@cached_result('pdf_path')
+def split_pages_to_files(pdf_path, output_dir, archive=False):
     """
     Split each page of a PDF into a separate file.
     
+    Fonts and images shared by several pages are serialized once and the files
+    are written in parallel (see page_plan.split_into_parts).
+    
     Args:
         pdf_path: Path to the PDF file
         output_dir: Directory to save the results
+        archive: Write the pages straight into one ZIP archive (page_1.pdf, page_2.pdf, ...)
+            instead of separate files
         
     Returns:
-        List of paths to the generated PDF files
+        List of paths to the generated PDF files, or the path to the archive
     """
     try:
-        reader = PdfReader(pdf_path)
-        result_paths = []
+        groups = [[i] for i in range(get_page_count(pdf_path))]
         
-        for i, page in enumerate(reader.pages):
-            writer = PdfWriter()
-            writer.add_page(page)
-            
-            output_path = os.path.join(output_dir, f"page_{i+1}_{uuid4().hex}.pdf")
-            
-            with open(output_path, "wb") as output_file:
-                writer.write(output_file)
-            
-            result_paths.append(output_path)
+        if archive:
+            archive_path = os.path.join(output_dir, f"pages_{uuid4().hex}.zip")
+            names = [f"page_{i + 1}.pdf" for i in range(len(groups))]
+            return split_into_parts(pdf_path, groups, archive_path=archive_path, names=names)
         
-        return result_paths
+        output_paths = [os.path.join(output_dir, f"page_{i + 1}_{uuid4().hex}.pdf") for i in range(len(groups))]
+        return split_into_parts(pdf_path, groups, output_paths)
     
     except Exception as e:
         logger.error(f"Error splitting PDF pages to files: {str(e)}")
         raise Exception(f"فشل في تقسيم صفحات PDF إلى ملفات: {str(e)}")
 
+@cached_result('pdf_path')
 def sort_pdf_pages(pdf_path, output_dir):
     """
     Sort pages in a PDF alphabetically based on content.
@@ -648,6 +655,7 @@ def sort_pdf_pages(pdf_path, output_dir):
         logger.error(f"Error sorting PDF pages: {str(e)}")
         raise Exception(f"فشل في فرز صفحات PDF: {str(e)}")
 
+@cached_result('pdf_path')
 def add_table_of_contents(pdf_path, output_dir):
     """
     Add a table of contents to a PDF based on text analysis.
@@ -725,6 +733,7 @@ def add_table_of_contents(pdf_path, output_dir):
         logger.error(f"Error adding table of contents to PDF: {str(e)}")
         raise Exception(f"فشل في إضافة فهرس إلى PDF: {str(e)}")
 
+@cached_result('pdf_path')
 def edit_pdf_metadata(pdf_path, metadata, output_dir):
     """
     Edit metadata in a PDF.
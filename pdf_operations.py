@@ -1,10 +1,14 @@
 import os
 import logging
 from uuid import uuid4
-from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2 import PdfWriter
+from documents import get_page_count
+from page_plan import PageRun, apply_page_plan, split_into_parts
+from result_cache import cached_result
 
 logger = logging.getLogger(__name__)
 
+@cached_result('pdf_files')
 def merge_pdfs(pdf_files, output_dir):
     """
     Merge multiple PDF files into one.
@@ -33,6 +37,7 @@ def merge_pdfs(pdf_files, output_dir):
         logger.error(f"Error merging PDFs: {str(e)}")
         raise Exception(f"فشل في دمج ملفات PDF: {str(e)}")
 
+@cached_result('pdf_path')
 def split_pdf(pdf_path, split_points, output_dir):
     """
     Split a PDF file at specified page numbers.
@@ -46,45 +51,23 @@ def split_pdf(pdf_path, split_points, output_dir):
         List of paths to the split PDFs
     """
     try:
-        reader = PdfReader(pdf_path)
-        total_pages = len(reader.pages)
+        total_pages = get_page_count(pdf_path)
         
-        # Convert page numbers to 0-based indices and sort
-        split_points = sorted([int(p) - 1 for p in split_points if 0 < int(p) <= total_pages])
+        # Each split point is the last page of a part (1-based), so it is also the 0-based start of the next part
+        split_points = sorted(set(int(p) for p in split_points if 0 < int(p) < total_pages))
         
-        # Add start and end points
-        split_ranges = []
-        start_page = 0
+        boundaries = [0] + split_points + [total_pages]
+        groups = [range(start, end) for start, end in zip(boundaries, boundaries[1:])]
+        output_paths = [os.path.join(output_dir, f"split_{i + 1}_{uuid4().hex}.pdf") for i in range(len(groups))]
         
-        for end_page in split_points:
-            split_ranges.append((start_page, end_page))
-            start_page = end_page
-        
-        # Add the last range
-        if start_page < total_pages:
-            split_ranges.append((start_page, total_pages - 1))
-        
-        result_paths = []
-        
-        for i, (start, end) in enumerate(split_ranges):
-            writer = PdfWriter()
-            
-            for page_num in range(start, end + 1):
-                writer.add_page(reader.pages[page_num])
-            
-            output_path = os.path.join(output_dir, f"split_{i + 1}_{uuid4().hex}.pdf")
-            
-            with open(output_path, "wb") as output_file:
-                writer.write(output_file)
-            
-            result_paths.append(output_path)
-        
-        return result_paths
+        # Parts are written as new files (in parallel) so they do not carry the rest of the document
+        return split_into_parts(pdf_path, groups, output_paths)
     
     except Exception as e:
         logger.error(f"Error splitting PDF: {str(e)}")
         raise Exception(f"فشل في تقسيم ملف PDF: {str(e)}")
 
+@cached_result('pdf_path')
 def delete_pages(pdf_path, pages_to_delete, output_dir):
     """
     Delete specified pages from a PDF.
@@ -98,20 +81,22 @@ def delete_pages(pdf_path, pages_to_delete, output_dir):
         Path to the resulting PDF
     """
     try:
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
+        total_pages = get_page_count(pdf_path)
         
-        # Convert to 0-based page indices
-        pages_to_delete = [int(p) - 1 for p in pages_to_delete]
+        # Convert to 0-based page indices; the kept pages are the ranges between deleted ones
+        pages_to_delete = sorted(set(int(p) - 1 for p in pages_to_delete if 0 < int(p) <= total_pages))
         
-        for i, page in enumerate(reader.pages):
-            if i not in pages_to_delete:
-                writer.add_page(page)
+        plan = []
+        start = 0
+        for page_num in pages_to_delete + [total_pages]:
+            if page_num > start:
+                plan.append(PageRun(0, range(start, page_num)))
+            start = page_num + 1
         
         output_path = os.path.join(output_dir, f"pages_deleted_{uuid4().hex}.pdf")
         
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        # Always rewritten: an incremental update would keep the deleted pages inside the file
+        apply_page_plan([pdf_path], plan, output_path, incremental=False)
         
         return output_path
     
@@ -119,6 +104,7 @@ def delete_pages(pdf_path, pages_to_delete, output_dir):
         logger.error(f"Error deleting pages: {str(e)}")
         raise Exception(f"فشل في حذف الصفحات: {str(e)}")
 
+@cached_result('pdf_path')
 def reorder_pages(pdf_path, new_order, output_dir):
     """
     Reorder pages in a PDF.
@@ -132,25 +118,11 @@ def reorder_pages(pdf_path, new_order, output_dir):
         Path to the reordered PDF
     """
     try:
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        # Convert to 0-based page indices
+        # Convert to 0-based page indices (page numbers are validated by the page plan)
         new_order = [int(p) - 1 for p in new_order]
         
-        # Validate page numbers
-        total_pages = len(reader.pages)
-        for page_num in new_order:
-            if page_num < 0 or page_num >= total_pages:
-                raise ValueError(f"رقم الصفحة {page_num + 1} خارج النطاق. الملف يحتوي على {total_pages} صفحة فقط.")
-        
-        for page_num in new_order:
-            writer.add_page(reader.pages[page_num])
-        
         output_path = os.path.join(output_dir, f"reordered_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        apply_page_plan([pdf_path], [PageRun(0, new_order)], output_path)
         
         return output_path
     
@@ -158,6 +130,7 @@ def reorder_pages(pdf_path, new_order, output_dir):
         logger.error(f"Error reordering pages: {str(e)}")
         raise Exception(f"فشل في إعادة ترتيب الصفحات: {str(e)}")
 
+@cached_result('pdf_path')
 def rotate_pages(pdf_path, angle, pages_to_rotate, output_dir):
     """
     Rotate pages in a PDF.
@@ -172,27 +145,15 @@ def rotate_pages(pdf_path, angle, pages_to_rotate, output_dir):
         Path to the rotated PDF
     """
     try:
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        total_pages = len(reader.pages)
-        
         # Handle 'all' case
         if pages_to_rotate == 'all':
-            pages_to_rotate = list(range(1, total_pages + 1))
-        
-        # Convert to 0-based page indices
-        pages_to_rotate = [int(p) - 1 for p in pages_to_rotate]
-        
-        for i, page in enumerate(reader.pages):
-            if i in pages_to_rotate:
-                page.rotate(angle)
-            writer.add_page(page)
+            rotation = angle
+        else:
+            # Convert to 0-based page indices
+            rotation = {int(p) - 1: angle for p in pages_to_rotate}
         
         output_path = os.path.join(output_dir, f"rotated_{uuid4().hex}.pdf")
-        
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        apply_page_plan([pdf_path], [PageRun(0, slice(None), rotation)], output_path)
         
         return output_path
     
@@ -200,6 +161,7 @@ def rotate_pages(pdf_path, angle, pages_to_rotate, output_dir):
         logger.error(f"Error rotating pages: {str(e)}")
         raise Exception(f"فشل في تدوير الصفحات: {str(e)}")
 
+@cached_result('original_pdf_path', 'pages_pdf_path')
 def add_pages_to_pdf(original_pdf_path, pages_pdf_path, output_dir, position='end'):
     """
     Add pages from one PDF to another PDF.
@@ -214,62 +176,27 @@ def add_pages_to_pdf(original_pdf_path, pages_pdf_path, output_dir, position='en
         Path to the modified PDF
     """
     try:
-        # قراءة ملفات PDF
-        original_pdf = PdfReader(original_pdf_path)
-        pages_pdf = PdfReader(pages_pdf_path)
-        
-        writer = PdfWriter()
-        
-        # تحويل موضع الإدراج (position) إلى النوع المناسب
-        position_type = type(position)
-        
+        # تحويل موضع الإدراج (position) إلى رقم الصفحة التي تُضاف الصفحات بعدها
+        # (None تعني نهاية الملف، والموضع الأكبر من عدد الصفحات يعني النهاية أيضاً)
         if position == 'start':
-            # إضافة الصفحات الجديدة أولاً
-            for page in pages_pdf.pages:
-                writer.add_page(page)
-            # ثم إضافة صفحات الملف الأصلي
-            for page in original_pdf.pages:
-                writer.add_page(page)
-        
+            pos = 0
         elif position == 'end':
-            # إضافة صفحات الملف الأصلي أولاً
-            for page in original_pdf.pages:
-                writer.add_page(page)
-            # ثم إضافة الصفحات الجديدة
-            for page in pages_pdf.pages:
-                writer.add_page(page)
-        
+            pos = None
         else:
             # تحويل النص إلى رقم إذا لزم الأمر
             if isinstance(position, str) and position.isdigit():
                 position = int(position)
             
-            # التحقق من المدى
-            if isinstance(position, int) and (position < 0 or position > len(original_pdf.pages)):
-                # إذا كان الموضع خارج النطاق، نضيف الصفحات في النهاية
-                for page in original_pdf.pages:
-                    writer.add_page(page)
-                for page in pages_pdf.pages:
-                    writer.add_page(page)
-            else:
-                # إضافة صفحات الملف الأصلي حتى موضع الإدراج (مع اعتبار أن position هو الآن int)
-                pos = int(position)  # تحويل مؤكد للرقم
-                for i in range(pos):
-                    writer.add_page(original_pdf.pages[i])
-                
-                # إضافة الصفحات الجديدة
-                for page in pages_pdf.pages:
-                    writer.add_page(page)
-                
-                # إضافة باقي صفحات الملف الأصلي
-                for i in range(pos, len(original_pdf.pages)):
-                    writer.add_page(original_pdf.pages[i])
+            pos = int(position)  # تحويل مؤكد للرقم
+            # إذا كان الموضع خارج النطاق، نضيف الصفحات في النهاية
+            if pos < 0:
+                pos = None
         
-        # حفظ النتيجة
-        output_path = os.path.join(output_dir, f"added_pages_{uuid4().hex}.pdf")
+        plan = [PageRun(0, slice(0, pos)), PageRun(1, slice(None)), PageRun(0, slice(pos, None))]
         
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        # حفظ النتيجة (كتحديث يُلحق بنهاية الملف الأصلي عندما يكون ذلك ممكناً)
+        output_path = os.path.join(output_dir, f"added_pages_{uuid4().hex}.pdf")
+        apply_page_plan([original_pdf_path, pages_pdf_path], plan, output_path)
         
         return output_path
         
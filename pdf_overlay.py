@@ -0,0 +1,250 @@
+import logging
+from collections import namedtuple
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject
+)
+from documents import open_document
+
+logger = logging.getLogger(__name__)
+
+# A single piece of text to stamp on a page.
+# x/y are in PDF points measured from the bottom-left corner of the page as it
+# is displayed (i.e. after /Rotate is applied); align is 'left', 'center' or 'right'.
+TextStamp = namedtuple(
+    'TextStamp',
+    ['text', 'x', 'y', 'font_size', 'color', 'opacity', 'align'],
+    defaults=[12, (0, 0, 0), 1.0, 'left']
+)
+
+# Resource names used by the overlay; prefixed to avoid clashing with the page's own resources
+FONT_NAME = '/StampF1'
+GSTATE_PREFIX = '/StampGS'
+
+# Helvetica glyph widths (1/1000 em) for WinAnsi codes 32-126, from the standard AFM metrics
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_DEFAULT_WIDTH = 556
+
+
+def can_render_text(text):
+    """Return True if the text can be drawn with the built-in (non-embedded) font."""
+    try:
+        text.encode('cp1252')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def measure_text(text, font_size):
+    """
+    Measure the width of a text string in points.
+
+    Args:
+        text: Text to measure
+        font_size: Font size in points
+
+    Returns:
+        Width of the text in points
+    """
+    total = 0
+    for byte in text.encode('cp1252', errors='replace'):
+        if 32 <= byte <= 126:
+            total += _HELVETICA_WIDTHS[byte - 32]
+        else:
+            total += _DEFAULT_WIDTH
+    return total * font_size / 1000.0
+
+
+def page_display_size(page):
+    """Return the (width, height) of a page as it is displayed, taking /Rotate into account."""
+    box = page.mediabox
+    width, height = float(box.width), float(box.height)
+    if page.get('/Rotate', 0) % 180 == 90:
+        return height, width
+    return width, height
+
+
+def _escape_pdf_string(raw):
+    """Escape bytes for use inside a PDF literal string."""
+    return raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _fmt(value):
+    """Format a number compactly for a content stream."""
+    return ('%.3f' % value).rstrip('0').rstrip('.')
+
+
+def _display_matrix(page):
+    """
+    Build the cm operator that maps displayed-page coordinates to the page's user space.
+
+    This keeps stamps upright on pages that carry a /Rotate entry.
+    """
+    box = page.mediabox
+    llx, lly = float(box.left), float(box.bottom)
+    width, height = float(box.width), float(box.height)
+    rotation = page.get('/Rotate', 0) % 360
+
+    if rotation == 90:
+        matrix = (0, 1, -1, 0, width + llx, lly)
+    elif rotation == 180:
+        matrix = (-1, 0, 0, -1, width + llx, height + lly)
+    elif rotation == 270:
+        matrix = (0, -1, 1, 0, llx, height + lly)
+    else:
+        matrix = (1, 0, 0, 1, llx, lly)
+
+    return ' '.join(_fmt(v) for v in matrix) + ' cm'
+
+
+class OverlayBuilder:
+    """
+    Stamps text overlays onto pages added to one PdfWriter.
+
+    The overlay objects (font, graphics states) are created once per writer and
+    shared by every page stamped through the builder.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._font_ref = None
+        self._open_ref = None
+        self._gstates = {}
+
+    def font_ref(self):
+        if self._font_ref is None:
+            font = DictionaryObject({
+                NameObject('/Type'): NameObject('/Font'),
+                NameObject('/Subtype'): NameObject('/Type1'),
+                NameObject('/BaseFont'): NameObject('/Helvetica'),
+                NameObject('/Encoding'): NameObject('/WinAnsiEncoding'),
+            })
+            self._font_ref = self.writer._add_object(font)
+        return self._font_ref
+
+    def gstate(self, opacity):
+        """Return (resource name, reference) of a graphics state with the given opacity."""
+        key = round(float(opacity), 3)
+        if key not in self._gstates:
+            gstate = DictionaryObject({
+                NameObject('/Type'): NameObject('/ExtGState'),
+                NameObject('/CA'): FloatObject(key),
+                NameObject('/ca'): FloatObject(key),
+            })
+            name = f"{GSTATE_PREFIX}{len(self._gstates) + 1}"
+            self._gstates[key] = (name, self.writer._add_object(gstate))
+        return self._gstates[key]
+
+    def stream_ref(self, data):
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return self.writer._add_object(stream)
+
+    def build_content(self, page, stamps):
+        """
+        Build the overlay content stream for a page.
+
+        Returns:
+            Tuple of (content bytes, dict of ExtGState resources used)
+        """
+        display_width, _ = page_display_size(page)
+        ops = ['Q', 'q', _display_matrix(page)]
+        gstates = {}
+
+        for stamp in stamps:
+            raw = stamp.text.encode('cp1252')
+            x = stamp.x
+            if stamp.align != 'left':
+                width = measure_text(stamp.text, stamp.font_size)
+                x -= width / 2 if stamp.align == 'center' else width
+            x = min(max(x, 0), display_width)
+
+            r, g, b = (c / 255.0 for c in stamp.color)
+            ops.append('q')
+            if stamp.opacity < 1:
+                name, ref = self.gstate(stamp.opacity)
+                gstates[name] = ref
+                ops.append(f"{name} gs")
+            ops.append(f"{_fmt(r)} {_fmt(g)} {_fmt(b)} rg")
+            ops.append(f"BT {FONT_NAME} {_fmt(stamp.font_size)} Tf {_fmt(x)} {_fmt(stamp.y)} Td")
+            ops.append('(' + _escape_pdf_string(raw).decode('latin-1') + ') Tj ET')
+            ops.append('Q')
+
+        ops.append('Q')
+        return '\n'.join(ops).encode('latin-1'), gstates
+
+    def apply(self, page, stamps):
+        """Append the stamps to a page already owned by the writer."""
+        content, gstates = self.build_content(page, stamps)
+
+        # Wrap the original content in q ... Q so its graphics state cannot leak into the stamp.
+        # The original streams are referenced as-is and never decoded or re-encoded.
+        contents = page.get('/Contents')
+        if self._open_ref is None:
+            self._open_ref = self.stream_ref(b'q')
+        new_contents = ArrayObject([self._open_ref])
+        if contents is not None:
+            contents = contents.get_object()
+            if isinstance(contents, ArrayObject):
+                new_contents.extend(contents)
+            else:
+                new_contents.append(page.raw_get('/Contents'))
+        new_contents.append(self.stream_ref(content))
+        page[NameObject('/Contents')] = new_contents
+
+        # Copy the resource dictionaries shallowly so resources shared between pages stay untouched
+        resources = DictionaryObject(page.get('/Resources', DictionaryObject()).get_object())
+        fonts = DictionaryObject(resources.get('/Font', DictionaryObject()).get_object())
+        fonts[NameObject(FONT_NAME)] = self.font_ref()
+        resources[NameObject('/Font')] = fonts
+        if gstates:
+            ext = DictionaryObject(resources.get('/ExtGState', DictionaryObject()).get_object())
+            for name, ref in gstates.items():
+                ext[NameObject(name)] = ref
+            resources[NameObject('/ExtGState')] = ext
+        page[NameObject('/Resources')] = resources
+
+
+def stamp_pdf(pdf_path, output_path, stamps_for_page):
+    """
+    Stamp vector text onto the pages of a PDF without rasterizing them.
+
+    Each stamped page gets one small extra content stream; the original page
+    content, fonts and images are copied untouched, so the text layer is kept
+    and the output stays about the size of the input.
+
+    Args:
+        pdf_path: Path to the PDF file (or an already open PdfReader)
+        output_path: Path to write the stamped PDF to
+        stamps_for_page: Callable (page_index, width, height) -> list of TextStamp
+            (or None to leave the page as is). Width and height are the displayed page size in points.
+
+    Returns:
+        Path to the stamped PDF
+    """
+    if not isinstance(pdf_path, PdfReader):
+        with open_document(pdf_path) as reader:
+            return stamp_pdf(reader, output_path, stamps_for_page)
+
+    reader = pdf_path
+    writer = PdfWriter()
+    builder = OverlayBuilder(writer)
+
+    for i, page in enumerate(reader.pages):
+        page = writer.add_page(page)
+        width, height = page_display_size(page)
+        stamps = stamps_for_page(i, width, height)
+        if stamps:
+            builder.apply(page, stamps)
+
+    with open(output_path, "wb") as output_file:
+        writer.write(output_file)
+
+    return output_path
@@ -0,0 +1,147 @@
+import os
+import logging
+from uuid import uuid4
+from contextlib import ExitStack
+from PyPDF2 import PdfWriter
+from PyPDF2.generic import NameObject, NumberObject
+from documents import open_document
+from pdf_overlay import OverlayBuilder, can_render_text, page_display_size
+from pdf_editing import page_number_stamp, watermark_stamp
+from result_cache import cached_result
+
+logger = logging.getLogger(__name__)
+
+class DocumentPipeline:
+    """
+    In-memory model of a document being edited by a chain of commands.
+
+    The model is a list of pages, each pointing at a page of a source file and
+    carrying the edits made to it so far (rotation and overlay stamps). Each
+    command only changes this list, so a whole chain of edits costs no PDF
+    parsing or writing until render_pipeline writes the result once.
+
+    The model is plain JSON data (see to_dict), so it can be queued as job parameters.
+    """
+
+    def __init__(self, source_path, num_pages):
+        self.sources = [source_path]
+        self.pages = [
+            {'source': 0, 'page': i, 'rotate': 0, 'stamps': []}
+            for i in range(num_pages)
+        ]
+        # Number of edits applied so far
+        self.steps = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        pipeline = cls.__new__(cls)
+        pipeline.sources = list(data['sources'])
+        pipeline.pages = [dict(page) for page in data['pages']]
+        pipeline.steps = data.get('steps', 0)
+        return pipeline
+
+    def to_dict(self):
+        return {'sources': list(self.sources), 'pages': self.pages, 'steps': self.steps}
+
+    def __len__(self):
+        return len(self.pages)
+
+    def _indices(self, page_numbers):
+        """Convert 1-based page numbers to indices, rejecting numbers outside the document."""
+        indices = []
+        for number in page_numbers:
+            number = int(number)
+            if not 1 <= number <= len(self.pages):
+                raise ValueError(f"رقم الصفحة {number} خارج نطاق الملف (1 - {len(self.pages)})")
+            indices.append(number - 1)
+        return indices
+
+    def rotate(self, angle, page_numbers='all'):
+        """Rotate pages clockwise by angle (a multiple of 90) degrees."""
+        if int(angle) % 90:
+            raise ValueError("زاوية التدوير يجب أن تكون من مضاعفات 90")
+        if page_numbers == 'all':
+            indices = range(len(self.pages))
+        else:
+            indices = set(self._indices(page_numbers))
+        for i in indices:
+            page = self.pages[i]
+            page['rotate'] = (page['rotate'] + int(angle)) % 360
+        self.steps += 1
+
+    def delete_pages(self, page_numbers):
+        """Remove pages (1-based page numbers)."""
+        deleted = set(self._indices(page_numbers))
+        if len(deleted) == len(self.pages):
+            raise ValueError("لا يمكن حذف جميع صفحات الملف")
+        self.pages = [page for i, page in enumerate(self.pages) if i not in deleted]
+        self.steps += 1
+
+    def reorder(self, new_order):
+        """Keep the pages listed in new_order (1-based page numbers), in that order."""
+        self.pages = [dict(self.pages[i], stamps=list(self.pages[i]['stamps'])) for i in self._indices(new_order)]
+        self.steps += 1
+
+    def add_page_numbers(self, position='bottom'):
+        """Number the pages in their current order."""
+        for i, page in enumerate(self.pages):
+            page['stamps'].append({'kind': 'number', 'index': i, 'position': position, 'rotate': page['rotate']})
+        self.steps += 1
+
+    def add_watermark(self, text, opacity=0.3):
+        """Add a centered text watermark to every page."""
+        if not can_render_text(text):
+            # The raster fallback of add_watermark would flatten the whole document
+            raise ValueError("لا يمكن إضافة علامة مائية بهذا النص ضمن سلسلة التعديلات، استخدم /watermark بشكل منفصل")
+        for page in self.pages:
+            page['stamps'].append({'kind': 'watermark', 'text': text, 'opacity': opacity, 'rotate': page['rotate']})
+        self.steps += 1
+
+def _stamp_for(spec, width, height):
+    if spec['kind'] == 'number':
+        return page_number_stamp(spec['position'], spec['index'], width, height)
+    return watermark_stamp(spec['text'], spec['opacity'], width, height)
+
+@cached_result('source_paths')
+def render_pipeline(source_paths, pages, output_dir):
+    """
+    Write the document described by a pipeline model in a single pass.
+
+    Every source is parsed once and each kept page is copied once; pages removed
+    by the chain are never copied, so nothing of them is left in the result.
+
+    Args:
+        source_paths: Paths of the source PDF files (DocumentPipeline.sources)
+        pages: Page list of the model (DocumentPipeline.pages)
+        output_dir: Directory to save the result
+
+    Returns:
+        Path to the edited PDF
+    """
+    try:
+        with ExitStack() as stack:
+            readers = [stack.enter_context(open_document(path)) for path in source_paths]
+            writer = PdfWriter()
+            builder = OverlayBuilder(writer)
+
+            for entry in pages:
+                page = writer.add_page(readers[entry['source']].pages[entry['page']])
+                original_rotation = page.get('/Rotate', 0)
+
+                # Stamps are drawn upright relative to the rotation the page had when they were added
+                for spec in entry['stamps']:
+                    page[NameObject('/Rotate')] = NumberObject((original_rotation + spec['rotate']) % 360)
+                    width, height = page_display_size(page)
+                    builder.apply(page, [_stamp_for(spec, width, height)])
+
+                page[NameObject('/Rotate')] = NumberObject((original_rotation + entry['rotate']) % 360)
+
+        output_path = os.path.join(output_dir, f"edited_{uuid4().hex}.pdf")
+        with open(output_path, "wb") as output_file:
+            writer.write(output_file)
+
+        return output_path
+
+    except Exception as e:
+        logger.error(f"Error rendering edit pipeline: {str(e)}")
+        raise Exception(f"فشل في حفظ التعديلات على الملف: {str(e)}")
@@ -0,0 +1,90 @@
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import PROCESS_POOL_WORKERS, PROCESS_POOL_START_METHOD
+
+logger = logging.getLogger(__name__)
+
+# Modules imported once by the fork server, so new workers start with them loaded
+PRELOAD_MODULES = ['documents', 'rasterizer']
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def _shutdown():
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+
+def get_process_pool():
+    """
+    Return the worker process pool shared by all jobs of this process, creating it on first use.
+
+    Workers are started by a fork server (or spawned), never forked from the bot
+    process itself: its job and dispatcher threads may hold locks at fork time,
+    which would stay locked forever in the child.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            context = multiprocessing.get_context(PROCESS_POOL_START_METHOD)
+            if PROCESS_POOL_START_METHOD == 'forkserver':
+                context.set_forkserver_preload(PRELOAD_MODULES)
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=context)
+            if _pool_pid is None:
+                atexit.register(_shutdown)
+            _pool_pid = os.getpid()
+            logger.info(f"Started a pool of {PROCESS_POOL_WORKERS} worker processes ({PROCESS_POOL_START_METHOD})")
+        return _pool
+
+def _discard_pool(pool):
+    """Drop a broken pool (e.g. a worker was killed) so the next call starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def imap_tasks(func, tasks, window):
+    """
+    Run func on each task in the shared worker pool, yielding the results in task order.
+
+    At most window tasks are submitted at a time: the next task is submitted when
+    the oldest result has been taken, so results not yet consumed never pile up
+    in memory. Tasks not started yet are cancelled if the caller stops early.
+
+    Args:
+        func: Picklable callable taking one task (a module-level function, optionally a functools.partial)
+        tasks: Iterable of picklable task arguments
+        window: Maximum number of tasks submitted and not yet consumed
+
+    Yields:
+        func's result for each task, in task order
+    """
+    pool = get_process_pool()
+    tasks = iter(tasks)
+    window = max(1, int(window))
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(pool.submit(func, task))
+            if len(pending) >= window:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for task in tasks:
+                pending.append(pool.submit(func, task))
+                break
+            yield result
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,106 @@
+import logging
+from functools import partial
+from documents import get_page_count
+from process_pool import imap_tasks
+from config import RASTER_DPI, RASTER_CHUNK_SIZE, RASTER_WORKERS, RASTER_PAGES_PER_TASK
+
+logger = logging.getLogger(__name__)
+
+def iter_page_images(pdf_path, dpi=RASTER_DPI, fmt='ppm', chunk_size=RASTER_CHUNK_SIZE,
+                     first_page=1, last_page=None):
+    """
+    Render the pages of a PDF to images, a few pages at a time.
+    
+    Pages are rendered in windows of chunk_size pages (first_page/last_page calls to
+    pdf2image), so only one window of bitmaps is held in memory at any time no matter
+    how many pages the document has.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        dpi: Rendering resolution
+        fmt: Image format used by pdf2image for the rendered pages ('ppm', 'png', 'jpeg')
+        chunk_size: Number of pages rendered per window
+        first_page: First page to render (1-based)
+        last_page: Last page to render (1-based, inclusive); defaults to the last page
+        
+    Yields:
+        Tuples of (page_index, PIL image), page_index being 0-based
+    """
+    from pdf2image import convert_from_path
+    
+    if last_page is None:
+        last_page = get_page_count(pdf_path)
+    chunk_size = max(1, int(chunk_size))
+    
+    for start in range(first_page, last_page + 1, chunk_size):
+        end = min(start + chunk_size - 1, last_page)
+        images = convert_from_path(pdf_path, dpi=dpi, fmt=fmt, first_page=start, last_page=end)
+        
+        for offset, image in enumerate(images):
+            yield start - 1 + offset, image
+            image.close()
+        
+        # Drop the window before rendering the next one
+        del images
+
+def split_page_ranges(total_pages, pages_per_task):
+    """Split pages 1..total_pages into consecutive (first_page, last_page) ranges."""
+    pages_per_task = max(1, int(pages_per_task))
+    return [(start, min(start + pages_per_task - 1, total_pages))
+            for start in range(1, total_pages + 1, pages_per_task)]
+
+def group_page_ranges(page_indices, pages_per_task):
+    """Group 0-based page indices into (first_page, last_page) ranges of consecutive pages (1-based)."""
+    pages_per_task = max(1, int(pages_per_task))
+    ranges = []
+    for index in sorted(set(page_indices)):
+        if ranges and ranges[-1][1] == index and ranges[-1][1] - ranges[-1][0] + 1 < pages_per_task:
+            ranges[-1] = (ranges[-1][0], index + 1)
+        else:
+            ranges.append((index + 1, index + 1))
+    return ranges
+
+def _process_page_range(pdf_path, func, dpi, page_range):
+    """Worker task: render one page range and apply func to every page in it."""
+    first_page, last_page = page_range
+    return [func(index, image)
+            for index, image in iter_page_images(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)]
+
+def map_page_images(pdf_path, func, dpi=RASTER_DPI, workers=RASTER_WORKERS, pages_per_task=RASTER_PAGES_PER_TASK,
+                    pages=None):
+    """
+    Render the pages of a PDF and apply a function to each, using a pool of worker processes.
+    
+    The pages are split into ranges of at most pages_per_task consecutive pages; each
+    worker of the shared process pool renders a range and applies func to every page.
+    Only a few ranges are handed out ahead of the caller, so the results waiting to be
+    consumed stay bounded however long the document is. Results are yielded in page order.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        func: Picklable callable (page_index, PIL image) -> picklable result. Use a
+            module-level function (optionally wrapped in functools.partial).
+        dpi: Rendering resolution
+        workers: Number of page ranges in flight at a time; 1 renders in the current process
+        pages_per_task: Number of pages handed to a worker at a time
+        pages: 0-based indices of the pages to render; None renders every page
+        
+    Yields:
+        func's result for each page, in page order
+    """
+    if pages is None:
+        ranges = split_page_ranges(get_page_count(pdf_path), pages_per_task)
+    else:
+        ranges = group_page_ranges(pages, pages_per_task)
+    if not ranges:
+        return
+    workers = min(max(1, int(workers)), len(ranges))
+    
+    if workers <= 1:
+        for first_page, last_page in ranges:
+            for index, image in iter_page_images(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page):
+                yield func(index, image)
+        return
+    
+    for results in imap_tasks(partial(_process_page_range, pdf_path, func, dpi), ranges, workers):
+        yield from results
@@ -0,0 +1,118 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from telegram.error import RetryAfter
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Number of per-chat buckets kept in memory; idle chats are dropped first
+MAX_TRACKED_CHATS = 10000
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`;
+    acquire() blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """Take tokens now, going into debt if needed, and return how long the caller has to wait."""
+        tokens = min(float(tokens), self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until the tokens are available."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+class SendRateLimiter:
+    """
+    Keeps outgoing Telegram requests under the bot-wide and per-chat flood limits.
+
+    One bucket is shared by all chats, plus one bucket per chat. Requests that
+    still get a RetryAfter error are retried after the delay Telegram asks for.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 chat_burst=SEND_CHAT_BURST, max_retries=SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id):
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                if len(self._chats) > MAX_TRACKED_CHATS:
+                    self._chats.popitem(last=False)
+            else:
+                self._chats.move_to_end(chat_id)
+            return bucket
+
+    def acquire(self, chat_id, messages=1):
+        """
+        Wait until a request to a chat may be sent.
+
+        Args:
+            chat_id: Target chat
+            messages: Number of messages the request produces (e.g. the size of a media group);
+                counted against the bot-wide limit, while the chat limit counts requests
+        """
+        delay = max(self._chat_bucket(chat_id).reserve(1), self.global_bucket.reserve(messages))
+        if delay > 0:
+            time.sleep(delay)
+
+    def call(self, func, messages=1, **kwargs):
+        """
+        Call a Bot method within the rate limits of the chat given in its chat_id argument.
+
+        Returns:
+            Whatever func returns
+        """
+        chat_id = kwargs['chat_id']
+        attempt = 0
+        while True:
+            self.acquire(chat_id, messages)
+            try:
+                return func(**kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(f"Flood limit hit for chat {chat_id}, retrying in {e.retry_after}s")
+                time.sleep(e.retry_after)
+
+_send_rate_limiter = None
+_send_rate_limiter_lock = threading.Lock()
+
+def get_send_rate_limiter():
+    """Return the rate limiter shared by everything that sends messages."""
+    global _send_rate_limiter
+    with _send_rate_limiter_lock:
+        if _send_rate_limiter is None:
+            _send_rate_limiter = SendRateLimiter()
+        return _send_rate_limiter
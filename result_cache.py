@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import logging
+import functools
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+from config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE, RESULT_CACHE_EVICT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Bump when the output of cached operations changes, so stale results are not served
+# (2: page plans, OCR, layout-based Word/Excel conversion, in-memory slides, direct image PDFs)
+CACHE_VERSION = 2
+
+META_FILE = 'meta.json'
+
+# Eviction frees space down to this fraction of the size cap, so the next stores
+# don't each trigger another scan of the cache directory
+EVICT_TARGET = 0.9
+
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+_stats_lock = threading.Lock()
+
+# (path, size, mtime_ns) -> sha256 hex digest, so a file is hashed only once;
+# the least recently used digests are dropped past FILE_HASHES_MAX entries
+FILE_HASHES_MAX = 4096
+_file_hashes = OrderedDict()
+_file_hashes_lock = threading.Lock()
+
+# Estimated size of the cache directory, kept up to date by put() between full scans
+_usage = {'bytes': None, 'scanned': 0.0}
+_usage_lock = threading.Lock()
+
+# Set by skip_caching() while a cached operation runs in this thread
+_local = threading.local()
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def get_cache_stats():
+    """Return a copy of the cache hit/miss counters."""
+    with _stats_lock:
+        return dict(_stats)
+
+def file_digest(path):
+    """Return the SHA-256 digest of a file's content."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        digest = _file_hashes.get(key)
+        if digest is not None:
+            _file_hashes.move_to_end(key)
+            return digest
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    with _file_hashes_lock:
+        _file_hashes[key] = digest
+        while len(_file_hashes) > FILE_HASHES_MAX:
+            _file_hashes.popitem(last=False)
+    return digest
+
+def make_key(operation, input_paths, params):
+    """
+    Build a cache key from input file contents, operation name and normalized parameters.
+
+    Args:
+        operation: Operation name
+        input_paths: List of input file paths; their content (not their names) is hashed
+        params: JSON-serializable parameters of the operation
+
+    Returns:
+        Hex digest identifying the result
+    """
+    payload = json.dumps({
+        'version': CACHE_VERSION,
+        'operation': operation,
+        'inputs': [file_digest(p) for p in input_paths],
+        'params': params,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _entry_dir(key):
+    return os.path.join(RESULT_CACHE_DIR, key[:2], key)
+
+def _copy_out(src, output_dir):
+    """Copy a cached artifact into output_dir (hard link when possible) and return the new path."""
+    name = os.path.basename(src)
+    dest = os.path.join(output_dir, name)
+    if os.path.exists(dest):
+        dest = os.path.join(output_dir, f"{uuid4().hex}_{name}")
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+    return dest
+
+def get(key, output_dir=None):
+    """
+    Look up a cached result.
+
+    File results are copied into output_dir so callers may move or delete them freely.
+
+    Returns:
+        The cached result, or None on a miss
+    """
+    entry = _entry_dir(key)
+    meta_path = os.path.join(entry, META_FILE)
+    try:
+        if time.time() - os.path.getmtime(meta_path) > RESULT_CACHE_MAX_AGE:
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        if meta['kind'] == 'value':
+            result = meta['value']
+        else:
+            paths = [_copy_out(os.path.join(entry, name), output_dir) for name in meta['files']]
+            result = paths[0] if meta['kind'] == 'path' else paths
+
+        # Mark the entry as recently used for LRU eviction
+        os.utime(meta_path)
+        return result
+    except (OSError, ValueError, KeyError):
+        return None
+
+def put(key, operation, result, is_file_result):
+    """Store the result of an operation in the cache."""
+    entry = _entry_dir(key)
+    if os.path.exists(entry):
+        return
+
+    tmp_entry = f"{entry}.{uuid4().hex}.tmp"
+    try:
+        os.makedirs(tmp_entry)
+        meta = {'operation': operation, 'created': time.time()}
+
+        if not is_file_result:
+            meta['kind'] = 'value'
+            meta['value'] = result
+        else:
+            paths = [result] if isinstance(result, str) else list(result)
+            meta['kind'] = 'path' if isinstance(result, str) else 'paths'
+            meta['files'] = []
+            for i, path in enumerate(paths):
+                # Prefix with the index so results with equal basenames cannot collide
+                name = f"{i}_{os.path.basename(path)}"
+                shutil.copyfile(path, os.path.join(tmp_entry, name))
+                meta['files'].append(name)
+
+        with open(os.path.join(tmp_entry, META_FILE), 'w') as f:
+            json.dump(meta, f)
+        size = sum(e.stat().st_size for e in os.scandir(tmp_entry))
+        os.replace(tmp_entry, entry)
+        _count('stores')
+    except (OSError, TypeError, ValueError) as e:
+        # Another worker may have stored the same entry first; either way the cache is optional
+        logger.warning(f"Could not cache result of {operation}: {str(e)}")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        return
+
+    _add_usage(size)
+
+def _add_usage(size):
+    """
+    Account for a newly stored entry, and scan the cache for eviction only when needed.
+
+    The directory is scanned when the estimated size goes over the cap, and every
+    RESULT_CACHE_EVICT_INTERVAL seconds to expire old entries and pick up entries
+    stored by other processes; other stores cost no directory walk.
+    """
+    with _usage_lock:
+        if (_usage['bytes'] is not None
+                and _usage['bytes'] + size <= RESULT_CACHE_MAX_BYTES
+                and time.time() - _usage['scanned'] < RESULT_CACHE_EVICT_INTERVAL):
+            _usage['bytes'] += size
+            return
+    evict()
+
+def evict():
+    """Remove entries unused for too long, then, if the cache is over its size cap, the least recently used ones."""
+    entries = []
+    total = 0
+    now = time.time()
+
+    if not os.path.isdir(RESULT_CACHE_DIR):
+        return
+
+    for prefix in os.listdir(RESULT_CACHE_DIR):
+        prefix_dir = os.path.join(RESULT_CACHE_DIR, prefix)
+        if not os.path.isdir(prefix_dir):
+            continue
+        for name in os.listdir(prefix_dir):
+            entry = os.path.join(prefix_dir, name)
+            try:
+                last_used = os.path.getmtime(os.path.join(entry, META_FILE))
+                size = sum(e.stat().st_size for e in os.scandir(entry))
+            except OSError:
+                continue
+            if now - last_used > RESULT_CACHE_MAX_AGE:
+                shutil.rmtree(entry, ignore_errors=True)
+                _count('evictions')
+                continue
+            entries.append((last_used, size, entry))
+            total += size
+
+    entries.sort()
+    if total > RESULT_CACHE_MAX_BYTES:
+        for _, size, entry in entries:
+            if total <= RESULT_CACHE_MAX_BYTES * EVICT_TARGET:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            _count('evictions')
+
+    with _usage_lock:
+        _usage['bytes'] = total
+        _usage['scanned'] = now
+
+def skip_caching():
+    """
+    Keep the result of the cached operation running in this thread out of the cache.
+
+    For operations that return a degraded result (e.g. text without OCR because
+    tesseract failed), so that a later call runs the operation again.
+    """
+    _local.skip = True
+
+def _paths_of(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+def cached_result(*input_args):
+    """
+    Cache the result of an operation on disk, keyed by input content, operation and parameters.
+
+    The decorated function must take its input files in the parameters named by
+    input_args (a path or a list of paths each). If it has an output_dir parameter its
+    result is a path or list of paths inside output_dir; otherwise the result itself
+    (e.g. extracted text) is cached. The wrapper also gets a cache_lookup(*args, **kwargs)
+    attribute that returns the cached result (or None) without running the operation.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        operation = f"{func.__module__}.{func.__name__}"
+        is_file_result = 'output_dir' in signature.parameters
+
+        def key_and_output_dir(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            output_dir = arguments.pop('output_dir', None)
+            input_paths = []
+            for name in input_args:
+                input_paths.extend(_paths_of(arguments.pop(name)))
+            return make_key(operation, input_paths, arguments), output_dir
+
+        def cache_lookup(*args, **kwargs):
+            try:
+                key, output_dir = key_and_output_dir(args, kwargs)
+            except (OSError, TypeError):
+                return None
+            result = get(key, output_dir)
+            if result is not None:
+                _count('hits')
+            return result
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                key, output_dir = key_and_output_dir(args, kwargs)
+            except (OSError, TypeError):
+                # Missing input files or bad arguments: let the operation report the error
+                return func(*args, **kwargs)
+
+            result = get(key, output_dir)
+            if result is not None:
+                _count('hits')
+                return result
+
+            _count('misses')
+            outer_skip = getattr(_local, 'skip', False)
+            _local.skip = False
+            try:
+                result = func(*args, **kwargs)
+                skip = _local.skip
+            finally:
+                _local.skip = outer_skip
+            if not skip:
+                put(key, operation, result, is_file_result)
+            return result
+
+        wrapper.cache_lookup = cache_lookup
+        return wrapper
+
+    return decorator
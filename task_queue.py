@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from uuid import uuid4
+from collections import namedtuple
+from utils import create_temp_dir, remove_temp_files
+from delivery import deliver_result, send_message
+from config import JOB_DB_PATH, JOB_WORKERS, JOB_PER_USER_LIMIT, JOB_LEASE
+
+logger = logging.getLogger(__name__)
+
+# A unit of heavy work queued by a handler.
+# params holds the operation's keyword arguments plus a 'delivery' spec telling the
+# worker how to send the result back (see delivery.deliver_result).
+Job = namedtuple('Job', ['id', 'user_id', 'chat_id', 'operation', 'input_paths', 'params'])
+
+def _call_merge(job, output_dir):
+    from pdf_operations import merge_pdfs
+    return merge_pdfs, (job.input_paths, output_dir), {}
+
+def _call_split(job, output_dir):
+    from pdf_operations import split_pdf
+    return split_pdf, (job.input_paths[0], job.params['split_points'], output_dir), {}
+
+def _call_split_pages(job, output_dir):
+    from pdf_editing import split_pages_to_files
+    return split_pages_to_files, (job.input_paths[0], output_dir), {'archive': job.params.get('archive', False)}
+
+def _call_delete_pages(job, output_dir):
+    from pdf_operations import delete_pages
+    return delete_pages, (job.input_paths[0], job.params['pages'], output_dir), {}
+
+def _call_add_pages(job, output_dir):
+    from pdf_operations import add_pages_to_pdf
+    original_pdf, pages_pdf = job.input_paths
+    return add_pages_to_pdf, (original_pdf, pages_pdf, output_dir), {'position': job.params['position']}
+
+def _call_pipeline(job, output_dir):
+    from pipeline import render_pipeline
+    return render_pipeline, (job.input_paths, job.params['pages'], output_dir), {}
+
+def _call_photo_to_pdf(job, output_dir):
+    from file_conversions import photos_to_pdf
+    return photos_to_pdf, (job.input_paths, output_dir), {}
+
+def _call_pdf_to_images(job, output_dir):
+    from file_conversions import pdf_to_images
+    return pdf_to_images, (job.input_paths[0], output_dir), {}
+
+def _call_pdf_to_word(job, output_dir):
+    from file_conversions import pdf_to_word
+    return pdf_to_word, (job.input_paths[0], output_dir), {}
+
+def _call_pdf_to_excel(job, output_dir):
+    from file_conversions import pdf_to_excel
+    return pdf_to_excel, (job.input_paths[0], output_dir), {}
+
+def _call_pdf_to_ppt(job, output_dir):
+    from file_conversions import pdf_to_ppt
+    return pdf_to_ppt, (job.input_paths[0], output_dir), {}
+
+def _call_word_to_pdf(job, output_dir):
+    from file_conversions import word_to_pdf
+    return word_to_pdf, (job.input_paths[0], output_dir), {}
+
+def _call_excel_to_pdf(job, output_dir):
+    from file_conversions import excel_to_pdf
+    return excel_to_pdf, (job.input_paths[0], output_dir), {}
+
+def _call_ppt_to_pdf(job, output_dir):
+    from file_conversions import ppt_to_pdf
+    return ppt_to_pdf, (job.input_paths[0], output_dir), {}
+
+def _call_extract_text(job, output_dir):
+    from content_extraction import extract_text
+    kwargs = {'languages': job.params['languages']} if job.params.get('languages') else {}
+    return extract_text, (job.input_paths[0],), kwargs
+
+# Operation name -> callable (job, output_dir) -> (function, args, kwargs) of the call that runs it.
+# The functions return a path, a list of paths or text, and are wrapped with result_cache.cached_result.
+OPERATIONS = {
+    'merge': _call_merge,
+    'split': _call_split,
+    'split_pages': _call_split_pages,
+    'delete_pages': _call_delete_pages,
+    'add_pages': _call_add_pages,
+    'pipeline': _call_pipeline,
+    'photo_to_pdf': _call_photo_to_pdf,
+    'pdf_to_images': _call_pdf_to_images,
+    'pdf_to_word': _call_pdf_to_word,
+    'pdf_to_excel': _call_pdf_to_excel,
+    'pdf_to_ppt': _call_pdf_to_ppt,
+    'word_to_pdf': _call_word_to_pdf,
+    'excel_to_pdf': _call_excel_to_pdf,
+    'ppt_to_pdf': _call_ppt_to_pdf,
+    'extract_text': _call_extract_text,
+}
+
+def run_operation(job, output_dir):
+    """Run the operation of a job and return its result."""
+    func, args, kwargs = OPERATIONS[job.operation](job, output_dir)
+    return func(*args, **kwargs)
+
+def lookup_cached_result(job, output_dir):
+    """Return the cached result of a job's operation, or None if it has to be run."""
+    func, args, kwargs = OPERATIONS[job.operation](job, output_dir)
+    lookup = getattr(func, 'cache_lookup', None)
+    return lookup(*args, **kwargs) if lookup else None
+
+class TaskQueue:
+    """
+    SQLite-backed queue of jobs processed by a bounded pool of worker threads.
+
+    Jobs are stored on disk until they finish, so queued work survives a restart.
+    Each user can have at most per_user_limit jobs running at the same time.
+
+    Several processes may share the queue file: a job is claimed with a single
+    UPDATE, so only one process runs it, and stays leased to that process until its
+    result has been delivered. The lease is renewed in the background; a job whose
+    lease has expired (its process died while running or delivering it) is queued again.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, workers=JOB_WORKERS, per_user_limit=JOB_PER_USER_LIMIT, lease=JOB_LEASE):
+        self.db_path = db_path
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.lease = lease
+        self.owner = uuid4().hex
+        self.bot = None
+        self._threads = []
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'user_id INTEGER NOT NULL, '
+            'chat_id INTEGER NOT NULL, '
+            'operation TEXT NOT NULL, '
+            'input_paths TEXT NOT NULL, '
+            'params TEXT NOT NULL, '
+            "status TEXT NOT NULL DEFAULT 'queued', "
+            'owner TEXT, '
+            'lease_until REAL NOT NULL DEFAULT 0, '
+            'result TEXT, '
+            'created_at REAL NOT NULL)'
+        )
+        # Columns added after the table was first created
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(jobs)')}
+        for name, definition in (('owner', 'TEXT'), ('lease_until', 'REAL NOT NULL DEFAULT 0'), ('result', 'TEXT')):
+            if name not in columns:
+                self._db.execute(f'ALTER TABLE jobs ADD COLUMN {name} {definition}')
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+
+    def start(self, bot):
+        """Start the worker threads and the lease keeper; jobs whose process died are queued again."""
+        self.bot = bot
+        with self._lock:
+            self._requeue_expired()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        thread = threading.Thread(target=self._lease_loop, name='job-lease-keeper', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """Ask the worker threads to exit once their current job is done."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+    def submit(self, user_id, chat_id, operation, input_paths, params=None):
+        """
+        Add a job to the queue.
+
+        If the result is already cached the job is stored as done, with its result: the
+        next free worker sends it without running the operation (uploading it here would
+        hold up the handler's thread).
+
+        Returns:
+            Tuple of (job id, position in the queue, 1 being next); the position is 0 on a cache hit
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation}")
+
+        job = Job(None, user_id, chat_id, operation, list(input_paths), params or {})
+        try:
+            cached = lookup_cached_result(job, create_temp_dir(user_id))
+        except Exception as e:
+            logger.warning(f"Cache lookup failed for {operation}: {str(e)}")
+            cached = None
+
+        with self._condition:
+            cursor = self._db.execute(
+                'INSERT INTO jobs (user_id, chat_id, operation, input_paths, params, status, result, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (user_id, chat_id, operation, json.dumps(list(input_paths)), json.dumps(params or {}),
+                 'queued' if cached is None else 'done', None if cached is None else json.dumps(cached), time.time())
+            )
+            job_id = cursor.lastrowid
+            position = self._position(job_id)
+            self._condition.notify()
+
+        return job_id, position
+
+    def position(self, job_id):
+        """Return the position of a queued job (1 = next to run), or 0 if it is no longer queued."""
+        with self._lock:
+            return self._position(job_id)
+
+    def _position(self, job_id):
+        row = self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id <= ? "
+            "AND EXISTS (SELECT 1 FROM jobs WHERE id = ? AND status = 'queued')",
+            (job_id, job_id)
+        ).fetchone()
+        return row[0]
+
+    def pending_count(self, user_id):
+        """Return the number of jobs of a user that are queued, running or being delivered."""
+        with self._lock:
+            row = self._db.execute('SELECT COUNT(*) FROM jobs WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0]
+
+    def _claim_next(self):
+        """
+        Lease the oldest runnable job to this process. Must be called with the lock held.
+
+        A queued job is marked as running; a done job (cached result) goes straight to delivering.
+        Selecting and marking the job is one statement, so two processes cannot claim the same job.
+
+        Returns:
+            Tuple of (job, cached result or None), or None if no job can run now
+        """
+        # fetchall steps the statement to its end, so the write is committed right away
+        rows = self._db.execute(
+            "UPDATE jobs SET status = CASE status WHEN 'done' THEN 'delivering' ELSE 'running' END, "
+            "owner = ?, lease_until = ? "
+            "WHERE status IN ('queued', 'done') AND id = ("
+            "SELECT id FROM jobs AS j WHERE status IN ('queued', 'done') AND "
+            "(SELECT COUNT(*) FROM jobs WHERE user_id = j.user_id AND status IN ('running', 'delivering')) < ? "
+            "ORDER BY id LIMIT 1) "
+            "RETURNING id, user_id, chat_id, operation, input_paths, params, result",
+            (self.owner, time.time() + self.lease, self.per_user_limit)
+        ).fetchall()
+        if not rows:
+            return None
+        row = rows[0]
+        cached = json.loads(row[6]) if row[6] is not None else None
+        return Job(row[0], row[1], row[2], row[3], json.loads(row[4]), json.loads(row[5])), cached
+
+    def _requeue_expired(self):
+        """
+        Queue again the running or delivering jobs whose lease has expired. Must be called with the lock held.
+
+        Jobs with a cached result become done again and are only delivered.
+        """
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = CASE WHEN result IS NULL THEN 'queued' ELSE 'done' END, owner = NULL "
+            "WHERE status IN ('running', 'delivering') AND lease_until < ?",
+            (time.time(),)
+        )
+        if cursor.rowcount:
+            logger.info(f"Queued {cursor.rowcount} interrupted job(s) again")
+
+    def _lease_loop(self):
+        """Renew the leases of the jobs this process is running or delivering, and requeue jobs of dead processes."""
+        while not self._stopping:
+            time.sleep(self.lease / 3)
+            try:
+                with self._condition:
+                    self._db.execute(
+                        "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN ('running', 'delivering')",
+                        (time.time() + self.lease, self.owner)
+                    )
+                    self._requeue_expired()
+                    self._condition.notify_all()
+            except Exception as e:
+                logger.error(f"Error renewing job leases: {str(e)}")
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                claimed = self._claim_next()
+                while claimed is None and not self._stopping:
+                    self._condition.wait(timeout=5)
+                    claimed = self._claim_next()
+                if claimed is None:
+                    return
+
+            job, result = claimed
+            if result is None:
+                result = self._run(job)
+
+                # The job keeps its row (and its user's slot) until the result is sent: pending_count
+                # still sees it, and it is run again if this process dies during the upload
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'delivering' WHERE id = ? AND owner = ?", (job.id, self.owner)
+                    )
+
+            self._complete(job, result)
+
+            with self._condition:
+                self._db.execute('DELETE FROM jobs WHERE id = ? AND owner = ?', (job.id, self.owner))
+                # A slot for this user was freed
+                self._condition.notify_all()
+
+    def _run(self, job):
+        """Run a job, reporting failures to the user. Returns None if the job failed."""
+        try:
+            return run_operation(job, create_temp_dir(job.user_id))
+        except Exception as e:
+            self._report_failure(job, e)
+            return None
+
+    def _complete(self, job, result):
+        """Deliver the result of a finished job and delete its files if the job asks for it."""
+        if result is not None:
+            try:
+                deliver_result(self.bot, job, result)
+            except Exception as e:
+                self._report_failure(job, e)
+
+        if job.params.get('cleanup'):
+            # Only the job's own files: the user may already have started another session
+            # whose uploads are in the same directory
+            paths = set(job.input_paths)
+            if isinstance(result, list):
+                paths.update(result)
+            elif isinstance(result, str):
+                paths.add(result)
+            remove_temp_files(job.user_id, paths - self._paths_in_use(job))
+
+    def _paths_in_use(self, job):
+        """Return the input files of the user's other jobs."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT input_paths FROM jobs WHERE user_id = ? AND id IS NOT ?', (job.user_id, job.id)
+            ).fetchall()
+        return {path for row in rows for path in json.loads(row[0])}
+
+    def _report_failure(self, job, e):
+        """Log a failed job and tell the user about it."""
+        logger.error(f"Error running job {job.id} ({job.operation}): {str(e)}")
+        error_prefix = job.params.get('delivery', {}).get('error', 'حدث خطأ أثناء تنفيذ العملية')
+        try:
+            send_message(self.bot, job.chat_id, f'{error_prefix}: {str(e)}')
+        except Exception as send_error:
+            logger.error(f"Error reporting failed job {job.id}: {str(send_error)}")
+
+_task_queue = None
+
+def start_task_queue(bot):
+    """Create the shared task queue and start its workers."""
+    global _task_queue
+    if _task_queue is None:
+        _task_queue = TaskQueue()
+        _task_queue.start(bot)
+    return _task_queue
+
+def get_task_queue():
+    """Return the shared task queue (start_task_queue must have been called)."""
+    if _task_queue is None:
+        raise RuntimeError("Task queue has not been started")
+    return _task_queue
@@ -0,0 +1,64 @@
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import DictionaryObject, NameObject, NumberObject
+
+from page_plan import PageRun, apply_page_plan, split_into_parts
+
+
+def _write_pdf(path, pages, root_rotate=None):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=300)
+    if root_rotate is not None:
+        writer._root_object['/Pages'][NameObject('/Rotate')] = NumberObject(root_rotate)
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return str(path)
+
+
+def _rotations(path):
+    return [page.rotation for page in PdfReader(path).pages]
+
+
+def test_rotation_adds_to_rotation_inherited_from_page_tree(tmp_path):
+    source = _write_pdf(tmp_path / 'source.pdf', 2, root_rotate=90)
+    assert _rotations(source) == [90, 90]
+
+    for incremental in (True, False):
+        output = str(tmp_path / f'output_{incremental}.pdf')
+        apply_page_plan([source], [PageRun(0, [0, 1], {0: 90})], output, incremental=incremental)
+        assert _rotations(output) == [180, 90]
+
+
+def test_inserted_page_keeps_its_own_rotation(tmp_path):
+    source = _write_pdf(tmp_path / 'source.pdf', 1, root_rotate=90)
+    other = _write_pdf(tmp_path / 'other.pdf', 1)
+
+    output = str(tmp_path / 'output.pdf')
+    apply_page_plan([source, other], [PageRun(0, [0]), PageRun(1, [0], 90)], output)
+    assert _rotations(output) == [90, 90]
+
+
+def test_split_follows_long_chains_of_references(tmp_path):
+    # Each object refers to the next one, deeper than Python's recursion limit
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=200, height=300)
+    ref = None
+    for number in range(3000):
+        node = DictionaryObject({NameObject('/N'): NumberObject(number)})
+        if ref is not None:
+            node[NameObject('/Next')] = ref
+        ref = writer._add_object(node)
+    writer.pages[1][NameObject('/Chain')] = ref
+    source = str(tmp_path / 'source.pdf')
+    with open(source, 'wb') as f:
+        writer.write(f)
+
+    outputs = [str(tmp_path / f'part_{i}.pdf') for i in range(3)]
+    split_into_parts(source, [[0], [1], [2]], output_paths=outputs)
+
+    assert [len(PdfReader(path).pages) for path in outputs] == [1, 1, 1]
+    node, length = PdfReader(outputs[1]).pages[0]['/Chain'], 0
+    while node is not None:
+        node, length = node.get_object().get('/Next'), length + 1
+    assert length == 3000
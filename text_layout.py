@@ -0,0 +1,225 @@
+import re
+import math
+from bisect import bisect_right
+from collections import Counter, namedtuple
+
+# A piece of text drawn at one position: x, y (PDF user space, y grows upwards) of its
+# start, estimated width, font size in points, and the text
+TextRun = namedtuple('TextRun', ['x', 'y', 'width', 'size', 'text'])
+
+# Runs sharing a baseline, in reading order
+TextLine = namedtuple('TextLine', ['x', 'y', 'width', 'size', 'runs', 'rtl'])
+
+# Consecutive lines of one block: level is 0 for body text, 1-3 for headings
+Paragraph = namedtuple('Paragraph', ['level', 'text', 'rtl'])
+
+# Average glyph width relative to the font size, used to estimate run widths
+GLYPH_WIDTH = 0.5
+
+_RTL_CHARS = re.compile('[\u0590-\u08ff\ufb1d-\ufdff\ufe70-\ufefc]')
+_LTR_CHARS = re.compile('[A-Za-z\u00c0-\u024f\u0400-\u04ff]')
+
+def is_rtl(text):
+    """Whether text is mostly written right to left (Arabic, Hebrew...)."""
+    return len(_RTL_CHARS.findall(text)) > len(_LTR_CHARS.findall(text))
+
+def _multiply(m, n):
+    """Product of two PDF matrices [a b c d e f]."""
+    return [
+        m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+def page_text_runs(page):
+    """
+    Extract the positioned text runs of a page.
+
+    Args:
+        page: PyPDF2 PageObject
+
+    Returns:
+        List of TextRun in content stream order
+    """
+    runs = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        if not text or not text.strip():
+            return
+        matrix = _multiply(tm, cm)
+        size = abs(font_size) * (math.hypot(matrix[2], matrix[3]) or 1)
+        # Several lines can come in one piece; they are laid out one below the other
+        for i, line in enumerate(text.strip('\n').split('\n')):
+            line = line.strip()
+            if line:
+                runs.append(TextRun(matrix[4], matrix[5] - i * size * 1.2, len(line) * size * GLYPH_WIDTH, size, line))
+
+    page.extract_text(visitor_text=visit)
+    return runs
+
+def group_lines(runs):
+    """
+    Group text runs into lines: runs whose baselines are within half a font size of each other.
+
+    Returns:
+        List of TextLine from the top of the page down
+    """
+    lines = []
+    for run in sorted(runs, key=lambda r: (-r.y, r.x)):
+        if lines and abs(lines[-1][0].y - run.y) <= max(lines[-1][0].size, run.size) / 2:
+            lines[-1].append(run)
+        else:
+            lines.append([run])
+
+    result = []
+    for line_runs in lines:
+        rtl = is_rtl(''.join(run.text for run in line_runs))
+        line_runs.sort(key=lambda r: r.x, reverse=rtl)
+        left = min(run.x for run in line_runs)
+        right = max(run.x + run.width for run in line_runs)
+        size = max(run.size for run in line_runs)
+        result.append(TextLine(left, line_runs[0].y, right - left, size, line_runs, rtl))
+    return result
+
+def line_text(line):
+    return ' '.join(run.text for run in line.runs)
+
+def body_size(lines, sizes=None):
+    """
+    The most common font size of the lines, weighted by their length.
+
+    When a Counter is given, the sizes of the lines are added to it and the most
+    common size over everything counted so far is returned (e.g. for a whole document).
+    """
+    sizes = Counter() if sizes is None else sizes
+    for line in lines:
+        for run in line.runs:
+            sizes[round(run.size)] += len(run.text)
+    return sizes.most_common(1)[0][0] if sizes else 0
+
+def heading_level(size, body):
+    """Heading level (1-3) of text of the given font size, or 0 for body text."""
+    if not body or size < body * 1.15:
+        return 0
+    if size >= body * 1.6:
+        return 1
+    if size >= body * 1.3:
+        return 2
+    return 3
+
+def group_paragraphs(lines, body=None):
+    """
+    Group lines into paragraphs and headings.
+
+    A new paragraph starts when the gap above a line is clearly larger than the
+    line spacing, or when the heading level or writing direction changes.
+
+    Args:
+        lines: List of TextLine from the top of the page down
+        body: Font size of body text (defaults to the most common size of the lines)
+
+    Returns:
+        List of Paragraph
+    """
+    if body is None:
+        body = body_size(lines)
+
+    paragraphs = []
+    current = []
+    level = 0
+    for previous, line in zip([None] + lines, lines):
+        line_level = heading_level(line.size, body)
+        if previous is not None:
+            gap = previous.y - line.y
+            if line_level != level or line.rtl != previous.rtl or gap > max(previous.size, line.size) * 1.5:
+                paragraphs.append(Paragraph(level, ' '.join(current), previous.rtl))
+                current = []
+        current.append(line_text(line))
+        level = line_level
+    if current:
+        paragraphs.append(Paragraph(level, ' '.join(current), lines[-1].rtl))
+    return paragraphs
+
+# A stretch of a page: kind is 'table' (lines aligned in columns) or 'text'; for a
+# table, cells holds the cells (TextRun) of each line
+Block = namedtuple('Block', ['kind', 'lines', 'cells'])
+
+# Runs of text separated by at least this many spaces are separate cells
+_CELL_GAP = re.compile(r'\s{2,}')
+
+def split_cells(line):
+    """Split the runs of a line at wide runs of spaces (cells drawn as a single piece of text)."""
+    cells = []
+    for run in line.runs:
+        parts = _CELL_GAP.split(run.text)
+        if len(parts) == 1:
+            cells.append(run)
+            continue
+        offset = 0
+        for part in parts:
+            start = run.text.index(part, offset)
+            offset = start + len(part)
+            char_width = run.width / max(len(run.text), 1)
+            cells.append(run._replace(x=run.x + start * char_width, width=len(part) * char_width, text=part))
+    return cells
+
+def group_blocks(lines, min_rows=2):
+    """
+    Split the lines of a page into tables and running text.
+
+    A table is at least min_rows consecutive lines of two or more cells each,
+    without a large vertical gap between them.
+
+    Returns:
+        List of Block in page order
+    """
+    blocks = []
+    candidate = []
+
+    def close_candidate():
+        if len(candidate) >= min_rows:
+            blocks.append(Block('table', [line for line, _ in candidate], [cells for _, cells in candidate]))
+        else:
+            blocks.extend(Block('text', [line], None) for line, _ in candidate)
+        candidate.clear()
+
+    for line in lines:
+        cells = split_cells(line)
+        if len(cells) >= 2:
+            if candidate and candidate[-1][0].y - line.y > max(candidate[-1][0].size, line.size) * 2.5:
+                close_candidate()
+            candidate.append((line, cells))
+        else:
+            close_candidate()
+            blocks.append(Block('text', [line], None))
+    close_candidate()
+    return blocks
+
+def table_rows(block):
+    """
+    Lay the cells of a table block out in columns.
+
+    Columns are the union of the horizontal extents of the cells of all rows;
+    each cell goes to the column its start falls in.
+
+    Returns:
+        List of rows, each a list of cell texts (None for empty cells)
+    """
+    rows = block.cells
+    columns = []
+    for cell in sorted((cell for row in rows for cell in row), key=lambda c: c.x):
+        if columns and cell.x <= columns[-1][1] + cell.size * 0.3:
+            columns[-1][1] = max(columns[-1][1], cell.x + cell.width)
+        else:
+            columns.append([cell.x, cell.x + cell.width])
+
+    rtl = sum(line.rtl for line in block.lines) * 2 > len(block.lines)
+    starts = [column[0] for column in columns]
+    result = []
+    for row in rows:
+        values = [None] * len(columns)
+        for cell in sorted(row, key=lambda c: c.x):
+            index = max(bisect_right(starts, cell.x + 0.01) - 1, 0)
+            values[index] = cell.text if values[index] is None else f"{values[index]} {cell.text}"
+        result.append(values[::-1] if rtl else values)
+    return result
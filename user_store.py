@@ -0,0 +1,188 @@
+import os
+import copy
+import json
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from config import USER_STATE_DB_PATH, USER_STATE_CACHE_SIZE, USER_STATE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Number of locks user ids are spread over; two users rarely share one
+LOCK_STRIPES = 64
+
+class UserStateStore:
+    """
+    Per-user key/value state kept in memory and written back to SQLite in batches.
+
+    Reads are served from an LRU cache of recently seen users. Writes update the
+    cache and queue the user's serialized state; a background thread writes all
+    queued users in one transaction every flush_interval seconds. Updates of the
+    same user are serialized by a per-user lock, so concurrent writes are not lost.
+    """
+
+    def __init__(self, db_path=USER_STATE_DB_PATH, cache_size=USER_STATE_CACHE_SIZE,
+                 flush_interval=USER_STATE_FLUSH_INTERVAL, legacy_dir=None):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.legacy_dir = legacy_dir
+        self._cache = OrderedDict()
+        # user_id -> JSON text not yet written; _flushing holds the batch being written
+        self._dirty = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._user_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._stopping = threading.Event()
+        self._thread = None
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS user_state ('
+            'user_id INTEGER PRIMARY KEY, '
+            'data TEXT NOT NULL, '
+            'updated_at REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def user_lock(self, user_id):
+        """Return the lock guarding a user's state; hold it to make several calls atomic."""
+        return self._user_locks[hash(user_id) % LOCK_STRIPES]
+
+    def _load_legacy(self, user_id):
+        """Read state saved by the old one-JSON-file-per-user format, if any."""
+        if not self.legacy_dir:
+            return None
+        path = os.path.join(self.legacy_dir, f"{user_id}.json")
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self, user_id):
+        """Return the cached state dict of a user, loading it on a miss. Call with the user's lock held."""
+        with self._lock:
+            state = self._cache.get(user_id)
+            if state is not None:
+                self._cache.move_to_end(user_id)
+                return state
+            pending = self._dirty.get(user_id, self._flushing.get(user_id))
+
+        if pending is not None:
+            state = json.loads(pending)
+        else:
+            with self._flush_lock:
+                row = self._db.execute('SELECT data FROM user_state WHERE user_id = ?', (user_id,)).fetchone()
+            if row is not None:
+                state = json.loads(row[0])
+            else:
+                state = self._load_legacy(user_id)
+                if state is not None:
+                    self._mark_dirty(user_id, state)
+                else:
+                    state = {}
+
+        with self._lock:
+            self._cache[user_id] = state
+            while len(self._cache) > self.cache_size:
+                # Unsaved changes are kept in _dirty, so evicting never loses data
+                self._cache.popitem(last=False)
+        return state
+
+    def _mark_dirty(self, user_id, state):
+        data = json.dumps(state)
+        with self._lock:
+            self._dirty[user_id] = data
+
+    def get(self, user_id, key, default=None):
+        """Return a copy of a user's value for key, or default."""
+        with self.user_lock(user_id):
+            state = self._load(user_id)
+            if key not in state:
+                return default
+            return copy.deepcopy(state[key])
+
+    def set(self, user_id, key, value):
+        """Set a user's value for key; it is written to disk on the next flush."""
+        with self.user_lock(user_id):
+            state = self._load(user_id)
+            state[key] = copy.deepcopy(value)
+            self._mark_dirty(user_id, state)
+
+    def update(self, user_id, key, func, default=None):
+        """
+        Atomically replace a user's value for key with func(current value).
+
+        Returns:
+            The new value
+        """
+        with self.user_lock(user_id):
+            state = self._load(user_id)
+            value = func(copy.deepcopy(state.get(key, default)))
+            state[key] = copy.deepcopy(value)
+            self._mark_dirty(user_id, state)
+            return value
+
+    def flush(self):
+        """Write all changed users to disk in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                self._flushing, self._dirty = self._dirty, {}
+                batch = self._flushing
+
+            now = time.time()
+            try:
+                with self._db:
+                    self._db.executemany(
+                        'INSERT OR REPLACE INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?)',
+                        [(user_id, data, now) for user_id, data in batch.items()]
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Error flushing user state: {str(e)}")
+                # Put the batch back unless newer changes were queued meanwhile
+                with self._lock:
+                    for user_id, data in batch.items():
+                        self._dirty.setdefault(user_id, data)
+                    self._flushing = {}
+                return 0
+
+            with self._lock:
+                self._flushing = {}
+            return len(batch)
+
+    def _flush_loop(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """Start the background flush thread; pending changes are also flushed at exit."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name='user-state-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def close(self):
+        """Stop the flush thread and write pending changes."""
+        self._stopping.set()
+        self.flush()
+
+_user_store = None
+_user_store_lock = threading.Lock()
+
+def get_user_store(legacy_dir=None):
+    """Return the shared user state store, opening it and starting its flush thread on first use."""
+    global _user_store
+    with _user_store_lock:
+        if _user_store is None:
+            _user_store = UserStateStore(legacy_dir=legacy_dir)
+            _user_store.start()
+        return _user_store
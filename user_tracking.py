@@ -1,7 +1,13 @@
+import atexit
+import threading
 from models import Session, User
+from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
-from config import ADMIN_ID
+from config import ADMIN_ID, ACTIVITY_FLUSH_INTERVAL, USER_COUNT_REFRESH_INTERVAL
+
+# عدد الصفوف في كل جملة إدراج جماعية
+UPSERT_BATCH_SIZE = 500
 
 def get_or_create_user(user):
     """
@@ -51,6 +57,16 @@ def get_or_create_user(user):
 def get_total_users_count():
     """
     الحصول على إجمالي عدد المستخدمين
+    (من العداد المحفوظ في الذاكرة إذا كان متتبع النشاط يعمل)
+    """
+    if _activity_tracker is not None:
+        return _activity_tracker.user_count()
+    
+    return _count_users()
+
+def _count_users():
+    """
+    عدّ المستخدمين في قاعدة البيانات
     """
     session = Session()
     try:
@@ -65,6 +81,7 @@ def get_total_users_count():
 def get_all_users():
     """
     الحصول على جميع المستخدمين
+    (يحمّل الجدول كاملاً في الذاكرة؛ استخدم iter_users للمرور على عدد كبير من المستخدمين)
     """
     session = Session()
     try:
@@ -76,6 +93,73 @@ def get_all_users():
     finally:
         session.close()
 
+def _iter_user_batches(columns, filters=(), after_id=0, batch_size=1000):
+    """
+    قراءة جدول المستخدمين على دفعات بترتيب المفتاح الأساسي (keyset pagination):
+    كل دفعة تبدأ بعد آخر مفتاح في الدفعة السابقة، فلا يتباطأ الاستعلام مع تقدم القراءة
+    كما يحدث مع OFFSET، ولا يبقى في الذاكرة إلا دفعة واحدة
+    
+    Yields:
+        قوائم من الصفوف، وأول عمود في كل صف هو المفتاح الأساسي
+    """
+    while True:
+        # جلسة جديدة لكل دفعة حتى لا يبقى الاتصال محجوزاً أثناء معالجة الدفعة
+        session = Session()
+        try:
+            batch = session.query(User.id, *columns) \
+                .filter(User.id > after_id, *filters) \
+                .order_by(User.id) \
+                .limit(batch_size) \
+                .all()
+        finally:
+            session.close()
+        
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1][0]
+
+def _user_filters(active_since=None, language_code=None):
+    filters = []
+    if active_since is not None:
+        filters.append(User.last_activity >= active_since)
+    if language_code is not None:
+        filters.append(User.language_code == language_code)
+    return filters
+
+def iter_users(batch_size=1000, active_since=None, language_code=None):
+    """
+    المرور على المستخدمين بذاكرة ثابتة مهما كان عددهم
+    
+    Args:
+        batch_size: عدد الصفوف التي تُقرأ من قاعدة البيانات في كل مرة
+        active_since: إذا تم تحديده، فقط المستخدمون الذين كان آخر نشاط لهم بعد هذا الوقت (datetime)
+        language_code: إذا تم تحديده، فقط المستخدمون بهذه اللغة
+        
+    Yields:
+        (معرف المستخدم على تيليجرام, رمز اللغة, وقت آخر نشاط)
+    """
+    columns = [User.user_id, User.language_code, User.last_activity]
+    for batch in _iter_user_batches(columns, _user_filters(active_since, language_code), batch_size=batch_size):
+        for _, user_id, user_language, last_activity in batch:
+            yield user_id, user_language, last_activity
+
+def iter_user_id_batches(after_id=0, batch_size=1000, active_since=None):
+    """
+    إرجاع معرفات المستخدمين على دفعات مرتبة حسب المفتاح الأساسي
+    (مع المفتاح الأساسي لكل مستخدم حتى يمكن الاستئناف من نقطة معينة)
+    
+    Args:
+        after_id: آخر مفتاح أساسي تمت معالجته (للاستئناف من نقطة معينة)
+        batch_size: عدد المستخدمين في كل دفعة
+        active_since: إذا تم تحديده، فقط المستخدمون النشطون بعد هذا الوقت
+        
+    Yields:
+        قوائم من (المفتاح الأساسي, معرف المستخدم على تيليجرام)
+    """
+    for batch in _iter_user_batches([User.user_id], _user_filters(active_since), after_id, batch_size):
+        yield [tuple(row) for row in batch]
+
 def notify_admin_new_user(bot, user):
     """
     إشعار المدير بمستخدم جديد
@@ -94,4 +178,227 @@ def notify_admin_new_user(bot, user):
 """
         bot.send_message(chat_id=ADMIN_ID, text=user_info)
     except Exception as e:
-        print(f"Error notifying admin: {e}")
\ No newline at end of file
+        print(f"Error notifying admin: {e}")
+
+def _dialect_insert(session):
+    """
+    إرجاع دالة insert الخاصة بنوع قاعدة البيانات إذا كانت تدعم ON CONFLICT
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+def _user_row(user, seen_at):
+    return {
+        'user_id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'language_code': user.language_code,
+        'is_bot': bool(user.is_bot),
+        'join_date': seen_at,
+        'last_activity': seen_at,
+    }
+
+class ActivityTracker:
+    """
+    تتبع نشاط المستخدمين في الذاكرة وحفظه في قاعدة البيانات على دفعات
+
+    record() لا تصل إلى قاعدة البيانات؛ يتم حفظ آخر نشاط لكل مستخدم كل
+    flush_interval ثانية بجمل إدراج جماعية (INSERT ... ON CONFLICT).
+    المستخدمون الجدد يُكتشفون أثناء الحفظ ويُمرَّرون إلى on_new_users،
+    ويتم تحديث عدد المستخدمين المحفوظ في الذاكرة تدريجياً.
+    """
+
+    def __init__(self, on_new_users=None, flush_interval=ACTIVITY_FLUSH_INTERVAL,
+                 count_refresh_interval=USER_COUNT_REFRESH_INTERVAL):
+        self.on_new_users = on_new_users
+        self.flush_interval = flush_interval
+        self.count_refresh_interval = count_refresh_interval
+        # user_id -> (telegram user, وقت آخر نشاط)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._count = None
+        self._count_updated = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def record(self, user):
+        """
+        تسجيل نشاط مستخدم (بدون أي اتصال بقاعدة البيانات)
+        """
+        if user is None:
+            return
+        with self._lock:
+            self._pending[user.id] = (user, datetime.utcnow())
+
+    def user_count(self):
+        """
+        إرجاع عدد المستخدمين المحفوظ في الذاكرة
+        """
+        with self._lock:
+            count = self._count
+            stale = datetime.utcnow().timestamp() - self._count_updated > self.count_refresh_interval
+        if count is None or stale:
+            count = self._refresh_count()
+        return count
+
+    def _refresh_count(self):
+        # عمليات أخرى قد تضيف مستخدمين، لذلك نعيد العد من قاعدة البيانات من حين لآخر
+        count = _count_users()
+        with self._lock:
+            self._count = count
+            self._count_updated = datetime.utcnow().timestamp()
+        return count
+
+    def flush(self):
+        """
+        حفظ النشاط المتراكم في قاعدة البيانات
+
+        Returns:
+            قائمة المستخدمين الجدد (كائنات telegram.User)
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return []
+                batch, self._pending = self._pending, {}
+
+            session = Session()
+            try:
+                insert = _dialect_insert(session)
+                rows = [_user_row(user, seen_at) for user, seen_at in batch.values()]
+                if insert is not None:
+                    new_ids = self._upsert(session, insert, rows)
+                else:
+                    new_ids = self._merge(session, rows)
+                session.commit()
+            except SQLAlchemyError as e:
+                session.rollback()
+                print(f"Database error: {e}")
+                # إعادة الدفعة ما لم يُسجَّل نشاط أحدث لنفس المستخدمين
+                with self._lock:
+                    for user_id, entry in batch.items():
+                        self._pending.setdefault(user_id, entry)
+                return []
+            finally:
+                session.close()
+
+        with self._lock:
+            if self._count is not None:
+                self._count += len(new_ids)
+
+        new_users = [batch[user_id][0] for user_id in new_ids]
+        if new_users and self.on_new_users:
+            try:
+                self.on_new_users(new_users)
+            except Exception as e:
+                print(f"Error handling new users: {e}")
+        return new_users
+
+    def _upsert(self, session, insert, rows):
+        """
+        إدراج المستخدمين الجدد ثم تحديث الموجودين بجملتين جماعيتين لكل دفعة
+
+        Returns:
+            معرفات المستخدمين الذين تم إنشاؤهم
+        """
+        new_ids = []
+        for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+            chunk = rows[i:i + UPSERT_BATCH_SIZE]
+
+            # RETURNING يرجع فقط الصفوف التي أُدرجت فعلاً، أي المستخدمين الجدد
+            created = session.execute(
+                insert(User).values(chunk)
+                .on_conflict_do_nothing(index_elements=['user_id'])
+                .returning(User.user_id)
+            )
+            new_ids.extend(row[0] for row in created)
+
+            stmt = insert(User).values(chunk)
+            excluded = stmt.excluded
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={
+                    'last_activity': excluded.last_activity,
+                    # لا نمسح البيانات المحفوظة إذا لم يرسلها تيليجرام هذه المرة
+                    'username': func.coalesce(excluded.username, User.username),
+                    'first_name': func.coalesce(excluded.first_name, User.first_name),
+                    'last_name': func.coalesce(excluded.last_name, User.last_name),
+                    'language_code': func.coalesce(excluded.language_code, User.language_code),
+                }
+            ))
+        return new_ids
+
+    def _merge(self, session, rows):
+        """
+        بديل لقواعد البيانات التي لا تدعم ON CONFLICT: استعلام واحد للموجودين ثم إدراج/تحديث
+
+        Returns:
+            معرفات المستخدمين الذين تم إنشاؤهم
+        """
+        new_ids = []
+        for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+            chunk = {row['user_id']: row for row in rows[i:i + UPSERT_BATCH_SIZE]}
+            existing = session.query(User).filter(User.user_id.in_(list(chunk))).all()
+            for db_user in existing:
+                row = chunk.pop(db_user.user_id)
+                db_user.last_activity = row['last_activity']
+                for field in ('username', 'first_name', 'last_name', 'language_code'):
+                    if row[field]:
+                        setattr(db_user, field, row[field])
+            session.add_all(User(**row) for row in chunk.values())
+            new_ids.extend(chunk)
+        return new_ids
+
+    def _flush_loop(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+            if datetime.utcnow().timestamp() - self._count_updated > self.count_refresh_interval:
+                self._refresh_count()
+
+    def start(self):
+        """
+        تشغيل خيط الحفظ الدوري (ويتم الحفظ أيضاً عند إيقاف البرنامج)
+        """
+        if self._thread is None:
+            # عدد المستخدمين يُقرأ لاحقاً في الخلفية (أو عند أول طلب له) حتى لا يتأخر بدء التشغيل
+            self._thread = threading.Thread(target=self._flush_loop, name='activity-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """
+        إيقاف الخيط وحفظ النشاط المتبقي
+        """
+        self._stopping.set()
+        self.flush()
+
+_activity_tracker = None
+
+def start_activity_tracker(bot):
+    """
+    إنشاء متتبع النشاط المشترك وتشغيله، مع إشعار المدير بالمستخدمين الجدد
+    """
+    global _activity_tracker
+    if _activity_tracker is None:
+        def notify_new_users(users):
+            for user in users:
+                notify_admin_new_user(bot, user)
+        
+        _activity_tracker = ActivityTracker(on_new_users=notify_new_users)
+        _activity_tracker.start()
+    return _activity_tracker
+
+def record_activity(update, context):
+    """
+    معالج يُستدعى مع كل تحديث لتسجيل نشاط المستخدم
+    """
+    if _activity_tracker is not None:
+        _activity_tracker.record(update.effective_user)
@@ -1,14 +1,15 @@
 import os
-import json
 import shutil
 import logging
 import tempfile
-from PyPDF2 import PdfReader
+from documents import probe_document, forget_document, forget_documents
+from user_store import get_user_store
 
 logger = logging.getLogger(__name__)
 
 # Directory to store temporary user data
 TEMP_DIR = os.path.join(tempfile.gettempdir(), "telegram_pdf_bot")
+# One JSON file per user, written by earlier versions; migrated into the user state store on first read
 USER_DATA_DIR = os.path.join(TEMP_DIR, "user_data")
 
 def create_temp_dir(user_id):
@@ -26,44 +27,35 @@ def clean_temp_files(user_id):
     auto_delete = settings.get('auto_delete', True)
     
     if auto_delete and os.path.exists(user_dir):
+        forget_documents(user_dir)
         shutil.rmtree(user_dir)
 
-def save_user_data(user_id, key, data):
-    """Save user data to disk."""
-    os.makedirs(USER_DATA_DIR, exist_ok=True)
-    
-    user_data_file = os.path.join(USER_DATA_DIR, f"{user_id}.json")
-    
-    # Load existing data if any
-    if os.path.exists(user_data_file):
-        with open(user_data_file, 'r') as f:
-            try:
-                all_data = json.load(f)
-            except json.JSONDecodeError:
-                all_data = {}
-    else:
-        all_data = {}
+def remove_temp_files(user_id, paths):
+    """Delete some of a user's temporary files (e.g. the inputs and outputs of a finished job)."""
+    user_dir = os.path.join(os.path.abspath(TEMP_DIR), str(user_id), '')
     
-    # Update data
-    all_data[key] = data
+    settings = get_user_data(user_id, 'settings', {})
+    if not settings.get('auto_delete', True):
+        return
     
-    # Save back to disk
-    with open(user_data_file, 'w') as f:
-        json.dump(all_data, f)
+    for path in paths:
+        path = os.path.abspath(path)
+        # Only files the bot created for this user, never anything outside their directory
+        if not path.startswith(user_dir) or not os.path.isfile(path):
+            continue
+        forget_document(path)
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not delete temporary file {path}: {str(e)}")
+
+def save_user_data(user_id, key, data):
+    """Save user data; it is kept in memory and written to disk in batches."""
+    get_user_store(legacy_dir=USER_DATA_DIR).set(user_id, key, data)
 
 def get_user_data(user_id, key, default=None):
-    """Get user data from disk."""
-    user_data_file = os.path.join(USER_DATA_DIR, f"{user_id}.json")
-    
-    if not os.path.exists(user_data_file):
-        return default
-    
-    with open(user_data_file, 'r') as f:
-        try:
-            all_data = json.load(f)
-            return all_data.get(key, default)
-        except json.JSONDecodeError:
-            return default
+    """Get user data, from memory when the user was seen recently."""
+    return get_user_store(legacy_dir=USER_DATA_DIR).get(user_id, key, default)
 
 def get_file_info(file_path):
     """Get information about a file."""
@@ -78,13 +70,14 @@ def get_file_info(file_path):
     # Get PDF-specific information
     if file_ext == '.pdf':
         try:
-            reader = PdfReader(file_path)
-            num_pages = len(reader.pages)
+            # قراءة عدد الصفحات والبيانات الوصفية دون تحليل الملف بالكامل
+            num_pages, encrypted, metadata = probe_document(file_path)
             
             info += f"عدد الصفحات: {num_pages}\n"
+            if encrypted:
+                info += "الملف محمي بكلمة مرور\n"
             
             # Get metadata
-            metadata = reader.metadata
             if metadata:
                 info += "\nبيانات وصفية:\n"
                 